@@ -5,18 +5,25 @@ Workflow del Agente Especializado - Simplified Invoice Agent
 Este módulo define un flujo simplificado del Agente Especializado utilizando LangGraph.
 El agente trabaja solo con:
 - rag_get_invoice_data: Obtener información de factura desde RAG
+- rag_get_invoices_batch: Obtener información de varias facturas en una sola llamada
 - calcular_vencimiento: Calcular vencimiento de factura
+- calcular_vencimientos_batch: Calcular el vencimiento de varias facturas en una sola llamada
 
 El agente puede pedir aclaraciones al usuario cuando la información no sea suficiente.
 """
 
-from typing import Annotated, Sequence, TypedDict, Optional, Dict, Any
+from typing import Annotated, Sequence, TypedDict, Optional
+from dataclasses import dataclass
+import asyncio
+import json
 import logging
 import re
+import time
 from langgraph.graph import StateGraph, END
 from langgraph.graph.message import add_messages
-from langchain_core.messages import AIMessage, HumanMessage, ToolMessage, BaseMessage, SystemMessage
-from functools import partial
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage, BaseMessage, SystemMessage, message_chunk_to_message
+from functools import lru_cache
+from collections import OrderedDict
 
 logger = logging.getLogger(__name__)
 
@@ -24,44 +31,69 @@ logger = logging.getLogger(__name__)
 # Estado Simplificado del Agente
 # ===============================================================================
 
+@dataclass(slots=True)
+class RagInvoice:
+    """Información de factura obtenida desde el RAG."""
+    raw_text: str
+    extracted: bool = False
+
+
 class AgentState(TypedDict):
     """Estado simplificado del agente."""
     messages: Annotated[Sequence[BaseMessage], add_messages]
-    rag_invoice: Optional[Dict[str, Any]]  # Información de factura desde RAG
+    rag_invoice: Optional[RagInvoice]  # Información de factura desde RAG
 
 # ===============================================================================
 # Nodos del Grafo Simplificado
 # ===============================================================================
 
-def _extract_invoice_identifier_from_text(text: str) -> Optional[str]:
+# Patrones comunes para números de factura (compilados una sola vez al cargar el módulo),
+# evaluados en orden de prioridad: un código real en cualquier posición gana sobre la
+# palabra que siga a "factura" ("factura de HBE122090" debe dar HBE122090, no "de")
+_INVOICE_PATTERNS = (
+    re.compile(r'\b([A-Z]{2,4}\d{6,})\b', re.IGNORECASE),  # HBE122090
+    re.compile(r'\b([A-Z]+\d*-\d+)\b', re.IGNORECASE),  # FACT-12345, INV-789, E018-175709
+    # factura 12345, factura número 4567: se saltan las palabras de relleno y el
+    # identificador debe contener un dígito
+    re.compile(
+        r'\bfactura\s+(?:(?:de|del|la|el|n[°ºo]\.?|nro\.?|n[uú]mero)\s+)*([A-Z0-9-]*\d[A-Z0-9-]*)',
+        re.IGNORECASE,
+    ),
+)
+
+# CUFE (32 caracteres alfanuméricos), solo como último recurso
+_CUFE_RE = re.compile(r'\b([A-Z0-9]{32})\b', re.IGNORECASE)
+
+
+@lru_cache(maxsize=512)
+def _extract_cached(text: str) -> Optional[str]:
     """
-    Extrae identificadores de factura del texto (número de factura, CUFE).
+    Extrae el identificador de factura de un texto, memorizando el resultado.
+    El historial se reenvía en cada turno, así que los mismos contenidos se repiten.
     """
-    # Patrones comunes para números de factura
-    invoice_patterns = [
-        r'\b([A-Z]{2,4}\d{6,})\b',  # HBE122090, E018-175709
-        r'\b([A-Z]+-\d+)\b',  # FACT-12345, INV-789
-        r'\bfactura\s+([A-Z0-9-]+)',  # factura HBE122090
-    ]
-    
-    for pattern in invoice_patterns:
-        match = re.search(pattern, text, re.IGNORECASE)
-        if match:
-            return match.group(1) if match.lastindex else match.group(0)
+    # Todos los identificadores de factura contienen dígitos: descartar rápido
+    # los mensajes que no los tienen sin pasar por el motor de regex
+    if len(text) < 3 or not any(map(str.isdigit, text)):
+        return None
     
-    # Buscar CUFE (32 caracteres alfanuméricos)
-    cufe_match = re.search(r'\b([A-Z0-9]{32})\b', text, re.IGNORECASE)
-    if cufe_match:
-        return cufe_match.group(1)
+    for pattern in _INVOICE_PATTERNS:
+        match = pattern.search(text)
+        if match:
+            return match.group(1)
     
-    return None
+    cufe_match = _CUFE_RE.search(text)
+    return cufe_match.group(1) if cufe_match else None
 
 
-def _get_capabilities_prompt():
+def _extract_invoice_identifier_from_text(text: str) -> Optional[str]:
     """
-    Genera el prompt del sistema que explica las capacidades del agente.
+    Extrae identificadores de factura del texto (número de factura, CUFE).
     """
-    return """Eres un ASISTENTE EXPERTO en gestión de Liquidaciones, Proveedores y Facturas para GreenTravelBackend.
+    return _extract_cached(text)
+
+
+# Prompt del sistema que explica las capacidades del agente (constante del módulo)
+_CAPABILITIES_PROMPT = """Eres un ASISTENTE EXPERTO en gestión de Liquidaciones, Proveedores y Facturas para GreenTravelBackend.
 
 # REGLA CRÍTICA PARA FACTURAS
 
@@ -183,18 +215,32 @@ Puedo realizar las siguientes operaciones con facturas:
    - Si el usuario menciona un número de factura específico, SIEMPRE extrae ese número y úsalo como `invoice_number`
    - Retorna: Texto completo de la factura con todos sus detalles (número, CUFE, proveedor, cliente, fecha, total, items, etc.)
 
-2. **Calcular fecha de vencimiento** (`calcular_vencimiento`)
+2. **Obtener información de varias facturas** (`rag_get_invoices_batch`)
+   - **CUANDO USAR**: Cuando el usuario mencione DOS O MÁS números de factura en la misma pregunta (ej: "compara las facturas HBE122090 y E018-175709")
+   - Parámetro requerido:
+     - `invoice_numbers`: Lista de números de factura (ej: ["HBE122090", "E018-175709"])
+   - Busca todas las facturas en paralelo en una sola llamada, en lugar de llamar `rag_get_invoice_data` una vez por factura
+   - Retorna: JSON con el texto de cada factura, por número de factura
+
+3. **Calcular fecha de vencimiento** (`calcular_vencimiento`)
    - Calcula la fecha de vencimiento de una factura y determina si está vencida
    - Parámetros requeridos:
      - `fecha_emision`: Fecha de emisión en formato YYYY-MM-DD (también acepta DD-MM-YYYY, DD/MM/YYYY)
      - `dias_credito`: Días de crédito otorgado (número entero)
    - Retorna: fecha_emision, fecha_vencimiento, vencida (bool), dias_restantes, mensaje
 
+4. **Calcular vencimiento de varias facturas** (`calcular_vencimientos_batch`)
+   - **CUANDO USAR**: Cuando necesites el vencimiento de DOS O MÁS facturas
+   - Parámetro requerido:
+     - `items`: Lista de objetos con `fecha_emision` (YYYY-MM-DD) y `dias_credito` (ej: [{"fecha_emision": "2025-10-03", "dias_credito": 30}])
+   - Retorna: Lista con un resultado por factura, en el mismo orden y formato que `calcular_vencimiento`
+
 ### FLUJO DE TRABAJO PARA FACTURAS Y VENCIMIENTOS:
 
 **Cuando el usuario solicite información de factura (OBLIGATORIO usar `rag_get_invoice_data`):**
 1. **SIEMPRE** usa `rag_get_invoice_data` con los parámetros que puedas extraer de la pregunta:
    - Si menciona un número de factura (HBE122090, E018-175709, etc.) → usa `invoice_number`
+   - Si menciona dos o más números de factura → usa `rag_get_invoices_batch` con `invoice_numbers`
    - Si menciona un CUFE → usa `cufe`
    - Si menciona un NIT de proveedor → usa `provider_nit`
    - Si pregunta "¿qué facturas hay?" → llama sin parámetros
@@ -293,104 +339,301 @@ Cuando un usuario te pregunte qué puedes hacer, explícale claramente:
 - Incluye los IDs y números importantes en tus respuestas
 - Sé conciso pero completo"""
 
+# Mensaje de sistema compartido entre turnos (no se modifica, es seguro reutilizarlo)
+_SYSTEM_MESSAGE = SystemMessage(content=_CAPABILITIES_PROMPT)
+
 
-async def decide_node(state: AgentState, model, tools_by_name):
+def _get_capabilities_prompt():
     """
-    Nodo de decisión principal (ReAct). El LLM decide qué herramienta usar o si necesita aclaración.
+    Retorna el prompt del sistema que explica las capacidades del agente.
     """
-    logger.info("[DECIDE] Procesando solicitud del usuario...")
-    
-    # Verificar si se está consultando una factura diferente
-    # Buscar en los mensajes más recientes si hay un número de factura diferente
-    current_invoice_id = None
-    for msg in reversed(state.get("messages", [])):
-        if isinstance(msg, HumanMessage):
-            current_invoice_id = _extract_invoice_identifier_from_text(msg.content)
-            if current_invoice_id:
-                break
-    
-    # Si hay información de factura previa y se detecta una factura diferente, limpiar
-    if state.get("rag_invoice") and current_invoice_id:
-        prev_invoice_text = state["rag_invoice"].get("raw_text", "")
-        prev_invoice_id = _extract_invoice_identifier_from_text(prev_invoice_text)
-        
-        if prev_invoice_id and prev_invoice_id.upper() != current_invoice_id.upper():
-            logger.warning(f"[DECIDE] Detectada factura diferente: {prev_invoice_id} -> {current_invoice_id}. Limpiando estado.")
-            state["rag_invoice"] = None
-    
-    system_prompt = _get_capabilities_prompt()
+    return _CAPABILITIES_PROMPT
+
+
+# Máximo de mensajes del historial que se envían al LLM en cada turno
+_MAX_HISTORY_MESSAGES = 20
+
+
+def _trim_history(history):
+    """
+    Recorta el historial a una ventana deslizante de los últimos mensajes.
     
-    # Construir mensajes para el LLM
-    messages = [SystemMessage(content=system_prompt)]
+    La ventana siempre inicia en un HumanMessage para no separar un AIMessage
+    de sus ToolMessage, y nunca descarta el turno actual del usuario.
+    """
+    if len(history) <= _MAX_HISTORY_MESSAGES:
+        return history
     
-    # Agregar mensajes del estado
-    for msg in state.get("messages", []):
-        if isinstance(msg, (HumanMessage, AIMessage, ToolMessage)):
-            messages.append(msg)
+    start = len(history) - _MAX_HISTORY_MESSAGES
+    for i in range(start, len(history)):
+        if isinstance(history[i], HumanMessage):
+            return history[i:]
     
-    # Agregar contexto si hay información de factura
-    if state.get("rag_invoice"):
-        invoice_text = state["rag_invoice"].get("raw_text", "")
-        if invoice_text:
-            context_msg = f"Contexto: Ya tengo información de factura obtenida del RAG ({len(invoice_text)} caracteres). Puedo usar esta información para responder preguntas o calcular vencimientos."
-            messages.append(HumanMessage(content=context_msg))
+    # El turno actual es más largo que la ventana: conservarlo completo
+    for i in range(start - 1, -1, -1):
+        if isinstance(history[i], HumanMessage):
+            return history[i:]
     
-    # Invocar modelo con herramientas
-    response = await model.ainvoke(messages)
+    return history
+
 
-    if not isinstance(response, AIMessage):
-        raise ValueError(f"Se esperaba AIMessage, pero se obtuvo {type(response)}")
+# Máximo de facturas recientes que se reutilizan sin volver a consultar el RAG
+_RAG_INVOICE_CACHE_SIZE = 32
 
-    return {"messages": state["messages"] + [response]}
+# Vigencia (segundos) de cada factura en la caché del nodo. La caché la comparten
+# todas las sesiones del proceso, así que no debe superar la del RAG_CACHE del
+# servidor MCP (900s): pasado ese tiempo la factura se vuelve a consultar
+_RAG_INVOICE_CACHE_TTL = 300.0
 
+# Llave de una consulta sin parámetros ("¿Qué facturas hay?"): su respuesta es un
+# listado que cambia con el tiempo, no una factura concreta, así que no se cachea
+_EMPTY_INVOICE_KEY = ("", "", "")
 
-async def tools_node(state: AgentState, tools_by_name):
+
+def _rag_invoice_cache_key(tool_input) -> tuple:
     """
-    Nodo que ejecuta las herramientas llamadas por el LLM.
+    Normaliza los parámetros de rag_get_invoice_data para usarlos como llave de caché.
+    """
+    return tuple(
+        str(tool_input.get(param) or "").strip().upper()
+        for param in ("invoice_number", "cufe", "provider_nit")
+    )
+
+
+class _AgentNodes:
+    """
+    Nodos del grafo con el modelo y las herramientas ligados como atributos.
     """
-    logger.info("[TOOLS] Ejecutando herramientas...")
     
-    last = state["messages"][-1]
-    tool_calls = getattr(last, "tool_calls", []) or []
+    def __init__(self, model, tools_by_name):
+        self.model = model
+        self.tools_by_name = tools_by_name
+        self._tool_names = frozenset(tools_by_name)
+        # Caché LRU de textos de factura por parámetros normalizados:
+        # llave -> (expira_en, texto)
+        self._rag_invoice_cache = OrderedDict()
+    
+    def _get_cached_invoice(self, tool_input, state: AgentState) -> Optional[str]:
+        """
+        Retorna el texto de factura ya obtenido para los mismos parámetros, si existe.
+        """
+        key = _rag_invoice_cache_key(tool_input)
+        entry = self._rag_invoice_cache.get(key)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self._rag_invoice_cache.move_to_end(key)
+                return entry[1]
+            del self._rag_invoice_cache[key]
+        
+        # La factura solicitada puede ser la misma que ya está en el estado
+        invoice_number = key[0]
+        rag_invoice = state.get("rag_invoice")
+        if invoice_number and rag_invoice:
+            raw_text = rag_invoice.raw_text
+            cached_id = _extract_invoice_identifier_from_text(raw_text)
+            if cached_id and cached_id.upper() == invoice_number:
+                return raw_text
+        
+        return None
     
-    new_messages = []
-    updated_state = {}
+    def _cache_invoice(self, tool_input, invoice_text: str):
+        """
+        Almacena el texto de factura en la caché LRU descartando la entrada más antigua.
+        """
+        key = _rag_invoice_cache_key(tool_input)
+        if key == _EMPTY_INVOICE_KEY:
+            return
+        self._rag_invoice_cache[key] = (time.monotonic() + _RAG_INVOICE_CACHE_TTL, invoice_text)
+        self._rag_invoice_cache.move_to_end(key)
+        if len(self._rag_invoice_cache) > _RAG_INVOICE_CACHE_SIZE:
+            self._rag_invoice_cache.popitem(last=False)
     
-    for call in tool_calls:
-        tool_name = call["name"]
-        tool_input = call["args"]
+    async def decide(self, state: AgentState):
+        """
+        Nodo de decisión principal (ReAct). El LLM decide qué herramienta usar o si necesita aclaración.
+        """
+        logger.info("[DECIDE] Procesando solicitud del usuario...")
+    
+        # Verificar si se está consultando una factura diferente
+        # Solo importa el turno actual: revisar únicamente el último HumanMessage
+        current_invoice_id = None
+        for msg in reversed(state.get("messages", [])):
+            if isinstance(msg, HumanMessage):
+                current_invoice_id = _extract_invoice_identifier_from_text(msg.content)
+                break
+    
+        # Si hay información de factura previa y se detecta una factura diferente, limpiar
+        if state.get("rag_invoice") and current_invoice_id:
+            prev_invoice_text = state["rag_invoice"].raw_text
+            prev_invoice_id = _extract_invoice_identifier_from_text(prev_invoice_text)
+        
+            if prev_invoice_id and prev_invoice_id.upper() != current_invoice_id.upper():
+                logger.warning("[DECIDE] Detectada factura diferente: %s -> %s. Limpiando estado.", prev_invoice_id, current_invoice_id)
+                state["rag_invoice"] = None
+    
+        # Construir mensajes para el LLM
+        messages = [_SYSTEM_MESSAGE]
+    
+        # Agregar mensajes del estado (ventana deslizante para acotar tokens).
+        # Los nodos solo agregan HumanMessage, AIMessage y ToolMessage al estado,
+        # por lo que no es necesario filtrar por tipo en cada turno
+        messages.extend(_trim_history(state.get("messages", ())))
+    
+        # El texto de la factura ya viaja en el ToolMessage del historial,
+        # por lo que no se agrega un mensaje de contexto adicional
+    
+        # Invocar modelo con herramientas en modo streaming: los tokens quedan
+        # disponibles para los consumidores de LangGraph (stream_mode="messages")
+        # a medida que llegan, y se acumulan en un solo mensaje para el estado
+        accumulated = None
+        async for chunk in self.model.astream(messages):
+            accumulated = chunk if accumulated is None else accumulated + chunk
         
-        tool = tools_by_name.get(tool_name)
-        if tool is None:
-            result = f"Error: herramienta '{tool_name}' no existe."
+        if accumulated is None:
+            raise ValueError("El modelo no retornó ninguna respuesta")
+        
+        response = message_chunk_to_message(accumulated)
+
+        if not isinstance(response, AIMessage):
+            raise ValueError(f"Se esperaba AIMessage, pero se obtuvo {type(response)}")
+
+        return {"messages": [response]}
+    
+    async def _invoke_tool(self, call, state: AgentState):
+        """
+        Ejecuta una llamada a herramienta individual y retorna su resultado.
+        """
+        if call["name"] not in self._tool_names:
+            return f"Error: herramienta '{call['name']}' no existe."
+        tool = self.tools_by_name[call["name"]]
+        
+        if call["name"] == "rag_get_invoices_batch":
+            return await self._invoke_invoices_batch(tool, call["args"].get("invoice_numbers") or (), state)
+        
+        # Evitar una nueva consulta al RAG si ya se tiene la misma factura
+        if call["name"] == "rag_get_invoice_data":
+            cached = self._get_cached_invoice(call["args"], state)
+            if cached is not None:
+                logger.info("[TOOLS] Factura reutilizada sin consultar el RAG")
+                return cached
+        
+        return await tool.ainvoke(call["args"])
+    
+    async def _invoke_invoices_batch(self, tool, invoice_numbers, state: AgentState) -> dict:
+        """
+        Ejecuta rag_get_invoices_batch por el mismo camino que las consultas individuales:
+        las facturas ya obtenidas salen de la caché o del estado y las demás se piden en
+        una sola llamada a rag_get_invoice_data_batch.
+        
+        Returns:
+            dict: Texto de cada factura, por número de factura (en el orden solicitado)
+        """
+        invoices = {}
+        pending = []
+        for number in invoice_numbers:
+            cached = self._get_cached_invoice({"invoice_number": number}, state)
+            if cached is not None:
+                invoices[number] = cached
+            elif number not in pending:
+                pending.append(number)
+        if not pending:
+            return {number: invoices[number] for number in invoice_numbers}
+        
+        batch_tool = self.tools_by_name.get("rag_get_invoice_data_batch")
+        if batch_tool is not None:
+            texts = await self._invoke_invoice_batch(
+                batch_tool, [{"args": {"invoice_number": number}} for number in pending]
+            )
+            invoices.update(zip(pending, texts))
         else:
-            try:
-                result = await tool.ainvoke(tool_input)
-                
-                # Si es rag_get_invoice_data, almacenar en el estado
-                if tool_name == "rag_get_invoice_data":
-                    if isinstance(result, str) and not result.startswith("Error"):
-                        updated_state["rag_invoice"] = {
-                            "raw_text": result,
-                            "extracted": False
-                        }
-                        logger.info(f"[TOOLS] Información de factura almacenada ({len(result)} caracteres)")
-                
-            except Exception as e:
-                result = f"Error ejecutando herramienta {tool_name}: {e}"
+            result = await tool.ainvoke({"invoice_numbers": pending})
+            invoices.update(json.loads(result) if isinstance(result, str) else result)
+        return {number: invoices.get(number, "Error: factura no retornada") for number in invoice_numbers}
+    
+    async def _invoke_invoice_batch(self, batch_tool, calls) -> list:
+        """
+        Ejecuta varias llamadas a rag_get_invoice_data con una sola invocación por lotes.
+        """
+        logger.info("[TOOLS] Agrupando %s consultas de factura en una sola llamada", len(calls))
+        result = await batch_tool.ainvoke({"invoices": [call["args"] for call in calls]})
+        invoice_texts = json.loads(result) if isinstance(result, str) else result
+        if not isinstance(invoice_texts, list) or len(invoice_texts) != len(calls):
+            raise ValueError("La respuesta por lotes no corresponde con las facturas solicitadas")
+        return invoice_texts
+    
+    async def tools(self, state: AgentState):
+        """
+        Nodo que ejecuta las herramientas llamadas por el LLM.
+        """
+        logger.info("[TOOLS] Ejecutando herramientas...")
+    
+        last = state["messages"][-1]
+        # Solo se llega aquí desde un AIMessage con tool_calls (ver should_continue)
+        tool_calls = last.tool_calls or ()
+    
+        # Agrupar las consultas de factura sin caché en una sola llamada por lotes
+        batch_tool = self.tools_by_name.get("rag_get_invoice_data_batch")
+        batch_indexes = []
+        if batch_tool is not None:
+            batch_indexes = [
+                i for i, call in enumerate(tool_calls)
+                if call["name"] == "rag_get_invoice_data"
+                and self._get_cached_invoice(call["args"], state) is None
+            ]
+            if len(batch_indexes) < 2:
+                batch_indexes = []
+        single_indexes = [i for i in range(len(tool_calls)) if i not in batch_indexes]
+        
+        # Ejecutar todas las herramientas en paralelo (son llamadas de red); gather
+        # retorna las excepciones como resultados
+        tasks = [self._invoke_tool(tool_calls[i], state) for i in single_indexes]
+        if batch_indexes:
+            tasks.append(self._invoke_invoice_batch(batch_tool, [tool_calls[i] for i in batch_indexes]))
+        gathered = await asyncio.gather(*tasks, return_exceptions=True)
+        
+        # Reconstruir los resultados en el orden original de tool_calls
+        results = [None] * len(tool_calls)
+        for i, result in zip(single_indexes, gathered):
+            results[i] = result
+        if batch_indexes:
+            batch_result = gathered[-1]
+            for position, i in enumerate(batch_indexes):
+                results[i] = batch_result if isinstance(batch_result, BaseException) else batch_result[position]
+    
+        # Una sola asignación de memoria: un ToolMessage por cada tool_call
+        new_messages = [None] * len(tool_calls)
+        updated_state = {}
+    
+        for i, (call, result) in enumerate(zip(tool_calls, results)):
+            tool_name = call["name"]
+        
+            if isinstance(result, BaseException):
+                result = f"Error ejecutando herramienta {tool_name}: {result}"
                 logger.error(result)
+            # Si es rag_get_invoice_data, almacenar en el estado
+            elif tool_name == "rag_get_invoice_data":
+                if isinstance(result, str) and not result.startswith("Error"):
+                    self._cache_invoice(call["args"], result)
+                    updated_state["rag_invoice"] = RagInvoice(raw_text=result)
+                    logger.info("[TOOLS] Información de factura almacenada (%s caracteres)", len(result))
+            # Las facturas por lotes se guardan igual, una por número (el estado conserva la última)
+            elif tool_name == "rag_get_invoices_batch" and isinstance(result, dict):
+                for number, text in result.items():
+                    if isinstance(text, str) and not text.startswith("Error"):
+                        self._cache_invoice({"invoice_number": number}, text)
+                        updated_state["rag_invoice"] = RagInvoice(raw_text=text)
+                logger.info("[TOOLS] Información de %s facturas almacenada", len(result))
+                result = json.dumps(result, ensure_ascii=False)
         
-        new_messages.append(
-            ToolMessage(
+            new_messages[i] = ToolMessage(
                 content=str(result),
                 tool_call_id=call["id"]
             )
-        )
     
-    return {
-        "messages": new_messages,
-        **updated_state
-    }
+        return {
+            "messages": new_messages,
+            **updated_state
+        }
 
 
 # ===============================================================================
@@ -404,7 +647,8 @@ def should_continue(state: AgentState):
     last = state["messages"][-1]
     
     # Si el último mensaje es AIMessage con tool_calls, ir a tools
-    if isinstance(last, AIMessage) and getattr(last, "tool_calls", None):
+    # (AIMessage.tool_calls siempre está definido, por defecto [])
+    if isinstance(last, AIMessage) and last.tool_calls:
         return "tools"
     
     # Si el último mensaje es AIMessage sin tool_calls, terminar
@@ -415,7 +659,7 @@ def should_continue(state: AgentState):
 # Construcción del Grafo Simplificado
 # ===============================================================================
 
-def build_custom_agent(model, tools_by_name, rag_get_invoice_tool):
+def build_custom_agent(model, tools_by_name, rag_get_invoice_tool, checkpointer=None):
     """
     Construye el grafo simplificado del agente.
     
@@ -423,6 +667,7 @@ def build_custom_agent(model, tools_by_name, rag_get_invoice_tool):
         model: Modelo LLM con herramientas vinculadas
         tools_by_name: Diccionario de herramientas por nombre
         rag_get_invoice_tool: Herramienta para obtener datos de factura desde RAG (no se usa directamente aquí, se pasa en tools_by_name)
+        checkpointer: Checkpointer opcional de LangGraph para persistir el estado por thread_id
     
     Returns:
         Graph: Grafo compilado listo para ejecutar
@@ -430,8 +675,9 @@ def build_custom_agent(model, tools_by_name, rag_get_invoice_tool):
     graph = StateGraph(AgentState)
     
     # Agregar nodos
-    graph.add_node("decide", partial(decide_node, model=model, tools_by_name=tools_by_name))
-    graph.add_node("tools", partial(tools_node, tools_by_name=tools_by_name))
+    nodes = _AgentNodes(model, tools_by_name)
+    graph.add_node("decide", nodes.decide)
+    graph.add_node("tools", nodes.tools)
     
     # Definir entrada
     graph.set_entry_point("decide")
@@ -449,17 +695,30 @@ def build_custom_agent(model, tools_by_name, rag_get_invoice_tool):
     # Edge desde tools de vuelta a decide (para continuar el ciclo ReAct)
     graph.add_edge("tools", "decide")
     
-    return graph.compile()
+    return graph.compile(checkpointer=checkpointer)
 
 # ===============================================================================
 # Función para visualización del grafo (compatibilidad)
 # ===============================================================================
 
-def visualize_graph(graph_instance=None):
-    """Genera una visualización del grafo."""
+def visualize_graph(graph_instance=None, force=False):
+    """
+    Genera una visualización del grafo.
+    
+    Si no se pasa un grafo y la imagen ya existe y es más reciente que este
+    módulo, se reutiliza sin volver a renderizarla (evita la llamada a mermaid.ink).
+    """
     try:
         from pathlib import Path
         
+        images_dir = Path(__file__).parent.parent / "images"
+        output_path = images_dir / "custom_agent_graph.png"
+        
+        if graph_instance is None and not force and output_path.exists() \
+                and output_path.stat().st_mtime >= Path(__file__).stat().st_mtime:
+            logger.info("Usando visualización en caché: %s", output_path)
+            return str(output_path)
+        
         if graph_instance is None:
             from mcp_server.model import llm
             from langchain_core.tools import tool
@@ -483,16 +742,14 @@ def visualize_graph(graph_instance=None):
         
         graph_image = graph_instance.get_graph().draw_mermaid_png()
         
-        images_dir = Path(__file__).parent.parent / "images"
         images_dir.mkdir(exist_ok=True)
         
-        output_path = images_dir / "custom_agent_graph.png"
         with open(output_path, "wb") as f:
             f.write(graph_image)
         
-        logger.info(f"Grafo visualizado y guardado en: {output_path}")
+        logger.info("Grafo visualizado y guardado en: %s", output_path)
         return str(output_path)
         
     except Exception as e:
-        logger.warning(f"No se pudo visualizar el grafo: {e}", exc_info=True)
+        logger.warning("No se pudo visualizar el grafo: %s", e, exc_info=True)
         return None
@@ -9,14 +9,15 @@ de GreenTravelBackend mediante herramientas MCP.
 HERRAMIENTAS DISPONIBLES:
 - Liquidaciones: list_liquidaciones, get_liquidacion, create_liquidacion, 
   update_liquidacion, delete_liquidacion, get_liquidacion_stats
-- Proveedores: list_provedores, get_provedor, create_provedor, 
-  update_provedor, delete_provedor, get_provedor_stats
+- Proveedores: list_provedores, list_all_provedores, get_provedor, batch_get_provedores, create_provedor, 
+  create_provedores_bulk, update_provedor, delete_provedor, delete_provedores_bulk, get_provedor_stats
 
 El agente puede realizar operaciones CRUD completas y consultar estadísticas
 sobre liquidaciones y proveedores.
 """
 
 from typing import Annotated, Sequence, TypedDict, Optional, Dict, Any
+import asyncio
 import logging
 from langgraph.graph import StateGraph, END
 from langgraph.graph.message import add_messages
@@ -129,20 +130,24 @@ Puedo realizar las siguientes operaciones con proveedores:
      - `estado`: Filtrar por estado (1=activo, 0=inactivo)
      - `tipo`: Filtrar por tipo de proveedor
      - `ciudad`: Filtrar por ID de ciudad
+   - Para obtener TODOS los proveedores usa `list_all_provedores` (mismos filtros, con `limit_per_page` y `max_pages`) en lugar de llamar `list_provedores` página por página
 
 2. **Obtener proveedor específico** (`get_provedor`)
    - Requiere: `provedor_id` (ID único del proveedor)
+   - Para varios proveedores a la vez usa `batch_get_provedores` con `provedor_ids` (lista de IDs) en lugar de llamar `get_provedor` una vez por ID
 
 3. **Crear nuevo proveedor** (`create_provedor`)
    - Todos los campos son opcionales: provedor_hotel_code, provedor_razonsocial,
      provedor_nombre, provedor_identificacion, provedor_direccion, provedor_telefono,
      provedor_tipo, provedor_estado (default: 1), provedor_ciudad, provedor_link_dropbox
+   - Para crear varios proveedores a la vez usa `create_provedores_bulk` con `data` (JSON con una lista de proveedores)
 
 4. **Actualizar proveedor** (`update_provedor`)
    - Requiere: `provedor_id` y JSON con campos a actualizar (todos opcionales)
 
 5. **Eliminar proveedor** (`delete_provedor`)
    - Requiere: `provedor_id` (realiza soft delete - marca como inactivo)
+   - Para eliminar varios proveedores a la vez usa `delete_provedores_bulk` con `provedor_ids` (lista de IDs)
 
 6. **Estadísticas de proveedores** (`get_provedor_stats`)
    - Retorna: total, activos, inactivos, por_estado, por_tipo
@@ -311,34 +316,42 @@ async def tools_node(state: AgentState, tools_by_name):
     last = state["messages"][-1]
     tool_calls = getattr(last, "tool_calls", []) or []
     
-    new_messages = []
+    # Las llamadas de un mismo turno son independientes (llamadas de red al servidor
+    # MCP): se ejecutan en paralelo y el turno tarda lo que la herramienta más lenta
+    results = await asyncio.gather(*(_run_tool(call, tools_by_name) for call in tool_calls))
     
-    for call in tool_calls:
-        tool_name = call["name"]
-        tool_input = call["args"]
-        
-        tool = tools_by_name.get(tool_name)
-        if tool is None:
-            result = f"Error: herramienta '{tool_name}' no existe. Herramientas disponibles: {', '.join(tools_by_name.keys())}"
-        else:
-            try:
-                logger.info(f"[TOOLS] Ejecutando {tool_name} con parámetros: {tool_input}")
-                result = await tool.ainvoke(tool_input)
-                logger.info(f"[TOOLS] {tool_name} ejecutada exitosamente")
-            except Exception as e:
-                result = f"Error ejecutando herramienta {tool_name}: {str(e)}"
-                logger.error(f"[TOOLS] {result}")
-        
-        new_messages.append(
-            ToolMessage(
-                content=str(result),
-                tool_call_id=call["id"]
-            )
+    new_messages = [
+        ToolMessage(
+            content=str(result),
+            tool_call_id=call["id"]
         )
+        for call, result in zip(tool_calls, results)
+    ]
     
     return {"messages": new_messages}
 
 
+async def _run_tool(call, tools_by_name):
+    """
+    Ejecuta una llamada a herramienta; los errores se retornan como texto para el LLM.
+    """
+    tool_name = call["name"]
+    tool_input = call["args"]
+    
+    tool = tools_by_name.get(tool_name)
+    if tool is None:
+        return f"Error: herramienta '{tool_name}' no existe. Herramientas disponibles: {', '.join(tools_by_name.keys())}"
+    try:
+        logger.info("[TOOLS] Ejecutando %s con parámetros: %s", tool_name, tool_input)
+        result = await tool.ainvoke(tool_input)
+        logger.info("[TOOLS] %s ejecutada exitosamente", tool_name)
+        return result
+    except Exception as e:
+        result = f"Error ejecutando herramienta {tool_name}: {str(e)}"
+        logger.error("[TOOLS] %s", result)
+        return result
+
+
 # ===============================================================================
 # Funciones de Condición para Edges
 # ===============================================================================
@@ -442,10 +455,10 @@ def visualize_graph(graph_instance=None):
         with open(output_path, "wb") as f:
             f.write(graph_image)
         
-        logger.info(f"Grafo visualizado y guardado en: {output_path}")
+        logger.info("Grafo visualizado y guardado en: %s", output_path)
         return str(output_path)
         
     except Exception as e:
-        logger.warning(f"No se pudo visualizar el grafo: {e}", exc_info=True)
+        logger.warning("No se pudo visualizar el grafo: %s", e, exc_info=True)
         return None
 
@@ -22,29 +22,46 @@ CARACTERÍSTICAS:
 from typing import Annotated, Sequence, TypedDict
 from langgraph.graph import StateGraph, START, END
 from langgraph.graph.message import add_messages
-from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, ToolMessage, SystemMessage
+from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, ToolMessage, SystemMessage, message_chunk_to_message
 
+import asyncio
 import logging
+import os
 import sys
-
-# Configurar logging con UTF-8
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.StreamHandler(sys.stdout)
-    ]
-)
-# Asegurar que el handler use UTF-8
-for handler in logging.root.handlers:
-    if hasattr(handler, 'stream') and hasattr(handler.stream, 'reconfigure'):
-        try:
-            handler.stream.reconfigure(encoding='utf-8')
-        except:
-            pass
+from collections import OrderedDict
+from itertools import count
 
 logger = logging.getLogger(__name__)
 
+# Contador para los tool_call_id de los ToolMessage sintéticos del nodo ask
+_tool_id_counter = count()
+
+
+def configure_logging():
+    """
+    Configura logging con UTF-8 sobre stdout.
+    
+    Es idempotente y debe llamarse desde el punto de entrada de la aplicación,
+    no al importar el módulo, para no reinstalar handlers en cada worker.
+    """
+    if logging.getLogger().handlers:
+        return
+    
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+        handlers=[
+            logging.StreamHandler(sys.stdout)
+        ]
+    )
+    # Asegurar que el handler use UTF-8
+    for handler in logging.root.handlers:
+        if hasattr(handler, 'stream') and hasattr(handler.stream, 'reconfigure'):
+            try:
+                handler.stream.reconfigure(encoding='utf-8')
+            except:
+                pass
+
 # Importación opcional para visualización del grafo
 try:
     from IPython.display import Image, display
@@ -62,91 +79,189 @@ class AgentState(TypedDict):
     messages: Annotated[Sequence[BaseMessage], add_messages]
 
 
-def build_rag_agent(model, ask_tool):
+# Prompt del sistema del nodo LLM (constante del módulo)
+SYSTEM_PROMPT = """Eres un asistente que responde preguntas basándote ÚNICAMENTE en el contexto proporcionado del sistema RAG.
+
+INSTRUCCIONES:
+- Usa SOLO la información del contexto proporcionado para responder la pregunta
+- Si el contexto contiene la respuesta, úsala directamente
+- Si el contexto no tiene suficiente información, indica que no tienes esa información específica
+- Sé preciso y conciso en tu respuesta, simpre incluir el numero o codigo de la factura, liquidacion o servicio turistico completo.
+- No inventes información que no esté en el contexto
+- Entrega un formato de respuesta claro y estructurado usando Markdown.
+
+"""
+
+# Mensaje de sistema compartido entre turnos (no se modifica, es seguro reutilizarlo)
+_SYSTEM_MESSAGE = SystemMessage(content=SYSTEM_PROMPT)
+
+# Borrador especulativo: el LLM responde con la pregunta sola mientras el RAG
+# está en curso; solo se acepta para preguntas generales que no requieren datos
+SPECULATIVE_DRAFT = os.getenv("RAG_SPECULATIVE_DRAFT", "").lower() in ("1", "true", "yes")
+
+_DRAFT_DECLINE = "no tengo esa información"
+
+DRAFT_PROMPT = f"""Eres un asistente de un sistema de facturas, liquidaciones y servicios turísticos.
+
+INSTRUCCIONES:
+- Si la pregunta es general (saludos, qué puedes hacer, cómo usar el sistema), respóndela de forma breve usando Markdown.
+- Si la pregunta requiere cualquier dato específico (facturas, liquidaciones, servicios, proveedores, montos, fechas), responde EXACTAMENTE: "{_DRAFT_DECLINE}"
+- No inventes información.
+"""
+
+_DRAFT_SYSTEM_MESSAGE = SystemMessage(content=DRAFT_PROMPT)
+
+
+def _accept_draft(draft) -> bool:
+    """Acepta el borrador solo si el modelo no declinó responder sin contexto."""
+    content = draft.content if isinstance(draft.content, str) else str(draft.content)
+    return bool(content.strip()) and _DRAFT_DECLINE not in content.lower()
+
+
+# Grafos compilados por (modelo, herramienta); se guardan las referencias para
+# que los id() usados como llave no puedan reutilizarse mientras la entrada exista
+_COMPILED_GRAPHS = OrderedDict()
+_COMPILED_GRAPHS_MAXSIZE = 8
+
+
+def build_rag_agent(model, ask_tool, speculative=None):
+    """
+    Construye (o reutiliza) un agente RAG con flujo lineal.
+    
+    El grafo compilado se memoriza por (modelo, herramienta, modo), de modo que
+    llamadas repetidas con los mismos objetos no vuelven a compilarlo.
+    
+    Args:
+        model: El modelo LLM (Gemini) configurado
+        ask_tool: Herramienta MCP para consultar el RAG
+        speculative: Si genera un borrador sin contexto en paralelo con el RAG
+                     (por defecto, la variable de entorno RAG_SPECULATIVE_DRAFT)
+    
+    Returns:
+        CompiledGraph: El grafo compilado listo para ejecutar
+    """
+    if speculative is None:
+        speculative = SPECULATIVE_DRAFT
+    
+    key = (id(model), id(ask_tool), speculative)
+    cached = _COMPILED_GRAPHS.get(key)
+    if cached is not None:
+        _COMPILED_GRAPHS.move_to_end(key)
+        return cached[2]
+    
+    compiled_graph = _compile_rag_agent(model, ask_tool, speculative)
+    _COMPILED_GRAPHS[key] = (model, ask_tool, compiled_graph)
+    if len(_COMPILED_GRAPHS) > _COMPILED_GRAPHS_MAXSIZE:
+        _COMPILED_GRAPHS.popitem(last=False)
+    return compiled_graph
+
+
+def _compile_rag_agent(model, ask_tool, speculative=False):
     """
     Construye un agente RAG con flujo lineal.
     Recuerden usar la herrmaienta del MCP definida para consultar el RAG.
     
+    En modo especulativo, el nodo ask lanza la consulta al RAG en segundo plano
+    y mientras tanto pide al LLM un borrador con la pregunta sola. Si el borrador
+    es aceptable se cancela el RAG y el flujo termina; si no, se espera el
+    contexto y el nodo llm responde como siempre.
+    
     Args:
         model: El modelo LLM (Gemini) configurado
         ask_tool: Herramienta MCP para consultar el RAG
+        speculative: Si genera el borrador especulativo en paralelo con el RAG
     
     Returns:
         CompiledGraph: El grafo compilado listo para ejecutar
     """
     
-    # Nodo que invoca la herramienta MCP para consultar el RAG
-    async def ask_node(state: AgentState):
-        """Nodo que consulta el sistema RAG usando la herramienta MCP."""
-        messages = state["messages"]
-        
-        # Obtener la última pregunta del usuario
-        last_message = messages[-1]
-        if not isinstance(last_message, HumanMessage):
-            raise ValueError("El último mensaje debe ser un HumanMessage")
-        
-        question = last_message.content
-        
-        logger.info(f"[ASK NODE] Consultando RAG con pregunta: {question[:50]}...")
+    async def fetch_context(question: str) -> ToolMessage:
+        """Consulta el sistema RAG usando la herramienta MCP y retorna el contexto como ToolMessage."""
+        logger.info("[ASK NODE] Consultando RAG con pregunta: %s...", question[:50])
         
         # Invocar la herramienta MCP para consultar el RAG
         try:
             # La herramienta MCP se invoca directamente con el parámetro 'query'
             rag_context = await ask_tool.ainvoke({"query": question})
             
-            # Crear un ToolMessage con el contexto recuperado
+            # Crear un ToolMessage con el contexto recuperado (se convierte a str una sola vez)
+            content = rag_context if isinstance(rag_context, str) else str(rag_context)
             tool_message = ToolMessage(
-                content=str(rag_context),
-                tool_call_id=f"rag_ask_{id(question)}"
+                content=content,
+                tool_call_id=f"rag_ask_{next(_tool_id_counter)}"
             )
             
-            logger.info(f"[ASK NODE] Contexto recuperado del RAG ({len(str(rag_context))} caracteres)")
+            logger.info("[ASK NODE] Contexto recuperado del RAG (%d caracteres)", len(content))
             
-            return {"messages": [tool_message]}
+            return tool_message
             
         except Exception as e:
-            logger.error(f"[ASK NODE] Error al consultar RAG: {str(e)}")
+            logger.error("[ASK NODE] Error al consultar RAG: %s", e)
             # Retornar mensaje de error como ToolMessage
-            error_message = ToolMessage(
+            return ToolMessage(
                 content=f"Error al consultar el sistema RAG: {str(e)}",
-                tool_call_id=f"rag_ask_error_{id(question)}"
+                tool_call_id=f"rag_ask_error_{next(_tool_id_counter)}"
             )
-            return {"messages": [error_message]}
+    
+    # Nodo que invoca la herramienta MCP para consultar el RAG
+    async def ask_node(state: AgentState):
+        """Nodo que consulta el sistema RAG usando la herramienta MCP."""
+        messages = state["messages"]
+        
+        # Obtener la última pregunta del usuario
+        last_message = messages[-1]
+        if not isinstance(last_message, HumanMessage):
+            raise ValueError("El último mensaje debe ser un HumanMessage")
+        
+        question = last_message.content
+        
+        if not speculative:
+            return {"messages": [await fetch_context(question)]}
+        
+        # Lanzar el RAG en segundo plano y pedir el borrador mientras tanto
+        rag_task = asyncio.create_task(fetch_context(question))
+        try:
+            draft = await model.ainvoke([_DRAFT_SYSTEM_MESSAGE, last_message])
+        except Exception as e:
+            logger.warning("[ASK NODE] Error generando borrador especulativo: %s", e)
+            draft = None
+        
+        if draft is not None and _accept_draft(draft):
+            rag_task.cancel()
+            logger.info("[ASK NODE] Borrador especulativo aceptado, se omite el RAG")
+            return {"messages": [draft]}
+        
+        return {"messages": [await rag_task]}
+    
+    def route_after_ask(state: AgentState):
+        """Termina si el nodo ask ya respondió con el borrador; si no, pasa al LLM."""
+        return END if isinstance(state["messages"][-1], AIMessage) else "llm"
     
     # Nodo que genera la respuesta usando el LLM
     async def llm_node(state: AgentState):
         """Nodo que genera la respuesta final usando el LLM con el contexto del RAG."""
         messages = state["messages"]
         
-        logger.info(f"[LLM NODE] Generando respuesta con {len(messages)} mensajes en el contexto")
+        logger.info("[LLM NODE] Generando respuesta con %s mensajes en el contexto", len(messages))
         
-        # Extraer la pregunta del usuario y el contexto del RAG
+        # Extraer la última pregunta del usuario y el último contexto del RAG
+        # recorriendo desde el final (ambos suelen estar al final del historial)
         human_message = None
         rag_context = None
         
-        for msg in messages:
-            if isinstance(msg, HumanMessage):
+        for msg in reversed(messages):
+            if human_message is None and isinstance(msg, HumanMessage):
                 human_message = msg
-            elif isinstance(msg, ToolMessage):
+            elif rag_context is None and isinstance(msg, ToolMessage):
                 rag_context = msg.content
+            if human_message is not None and rag_context is not None:
+                break
         
         # Construir mensajes para el LLM con instrucciones claras
         llm_messages = []
         
-        # Agregar mensaje del sistema con instrucciones
-        system_prompt = """Eres un asistente que responde preguntas basándote ÚNICAMENTE en el contexto proporcionado del sistema RAG.
-
-INSTRUCCIONES:
-- Usa SOLO la información del contexto proporcionado para responder la pregunta
-- Si el contexto contiene la respuesta, úsala directamente
-- Si el contexto no tiene suficiente información, indica que no tienes esa información específica
-- Sé preciso y conciso en tu respuesta, simpre incluir el numero o codigo de la factura, liquidacion o servicio turistico completo.
-- No inventes información que no esté en el contexto
-- Entrega un formato de respuesta claro y estructurado usando Markdown.
-
-"""
-        
-        llm_messages.append(SystemMessage(content=system_prompt))
+        # Agregar mensaje del sistema con instrucciones (compartido entre turnos)
+        llm_messages.append(_SYSTEM_MESSAGE)
         
         # Agregar el contexto del RAG si está disponible
         if rag_context:
@@ -162,10 +277,19 @@ Responde la pregunta del usuario basándote ÚNICAMENTE en el contexto proporcio
             if human_message:
                 llm_messages.append(human_message)
         
-        # Invocar el modelo LLM con los mensajes estructurados
-        response = await model.ainvoke(llm_messages)
+        # Invocar el modelo LLM en modo streaming: los tokens se emiten a los
+        # consumidores de astream_events a medida que llegan y se acumulan
+        # en un solo mensaje para el estado
+        accumulated = None
+        async for chunk in model.astream(llm_messages):
+            accumulated = chunk if accumulated is None else accumulated + chunk
+        
+        if accumulated is None:
+            raise ValueError("El modelo no retornó ninguna respuesta")
         
-        logger.info(f"[LLM NODE] Respuesta generada exitosamente")
+        response = message_chunk_to_message(accumulated)
+        
+        logger.info("[LLM NODE] Respuesta generada exitosamente")
         
         return {"messages": [response]}
     
@@ -178,7 +302,11 @@ Responde la pregunta del usuario basándote ÚNICAMENTE en el contexto proporcio
     
     # Conectar los nodos en flujo lineal: START → ask → llm → END
     graph.add_edge(START, "ask")
-    graph.add_edge("ask", "llm")
+    if speculative:
+        # ask → END cuando el borrador especulativo se acepta
+        graph.add_conditional_edges("ask", route_after_ask, ["llm", END])
+    else:
+        graph.add_edge("ask", "llm")
     graph.add_edge("llm", END)
     
     # Compilar y retornar el grafo
@@ -193,13 +321,17 @@ def visualize_graph(graph_instance=None):
     """
     Genera una visualización del grafo RAG.
     
+    La imagen solo se vuelve a renderizar (llamada a mermaid.ink) cuando cambia
+    la estructura del grafo: el hash blake2b del código mermaid se guarda junto
+    a la imagen y, si coincide, se reutiliza el PNG existente.
+    
     Args:
         graph_instance: Instancia del grafo compilado (opcional)
     
     Returns:
         str: Ruta al archivo de imagen generado o None si falla
     """
-    import os
+    import hashlib
     from pathlib import Path
     
     try:
@@ -216,22 +348,32 @@ def visualize_graph(graph_instance=None):
             
             graph_instance = build_rag_agent(llm, mock_ask_tool)
         
+        images_dir = Path(__file__).parent.parent / "images"
+        output_path = images_dir / "rag_agent_graph.png"
+        key_path = images_dir / ".rag_agent_graph.key"
+        
+        # Reutilizar la imagen si el código mermaid del grafo no cambió
+        drawable = graph_instance.get_graph()
+        key = hashlib.blake2b(drawable.draw_mermaid().encode(), digest_size=16).hexdigest()
+        if output_path.exists() and key_path.exists() and key_path.read_text().strip() == key:
+            logger.info("Usando visualización en caché: %s", output_path)
+            return str(output_path)
+        
         # Obtener el grafo visual
-        graph_image = graph_instance.get_graph().draw_mermaid_png()
+        graph_image = drawable.draw_mermaid_png()
         
         # Guardar la imagen
-        images_dir = Path(__file__).parent.parent / "images"
         images_dir.mkdir(exist_ok=True)
         
-        output_path = images_dir / "rag_agent_graph.png"
         with open(output_path, "wb") as f:
             f.write(graph_image)
+        key_path.write_text(key)
         
-        logger.info(f"Grafo visualizado y guardado en: {output_path}")
+        logger.info("Grafo visualizado y guardado en: %s", output_path)
         return str(output_path)
         
     except Exception as e:
-        logger.warning(f"No se pudo visualizar el grafo: {e}")
+        logger.warning("No se pudo visualizar el grafo: %s", e)
         return None
 
 
@@ -253,6 +395,8 @@ def graph(config=None):
     Returns:
         CompiledGraph: El grafo compilado listo para ejecutar
     """
+    configure_logging()
+    
     from mcp_server.model import llm
     from langchain_core.tools import tool
     
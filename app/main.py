@@ -6,11 +6,12 @@ Este es el punto de entrada principal de la aplicación FastAPI que orquesta
 los agentes inteligentes: RAG Agent, Custom Agent y GreenTravelBackend Agent.
 
 CONFIGURACIÓN:
-- CORS habilitado para localhost:3000 (frontend)
-- Servidores MCP configurados para todos los agentes
+- CORS abierto sin credenciales (frontend en localhost:3000 y despliegue)
+- Servidores MCP configurados e inicializados al arrancar (lifespan)
 - UTF-8 encoding para manejo correcto de caracteres especiales
 """
 
+from flows.rag_agent import configure_logging
 from services.custom_agent_service import CUSTOM_AGENT_SERVICE
 from services.rag_agent_service import RAG_AGENT_SERVICE
 from services.greentravel_agent_service import GREEN_TRAVEL_AGENT_SERVICE
@@ -18,21 +19,75 @@ from routers import rag_agent_router, custom_agent_router, greentravel_agent_rou
 from mcp_server.config import get_server_parameters, get_greentravel_server_parameters
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager
+import asyncio
+import logging
+
+
+configure_logging()
+logger = logging.getLogger(__name__)
+
+
+# Servicios que entran a stdio_client/ClientSession en la tarea que llama a initialize()
+# y salen en la que llama a shutdown(): los cancel scopes de anyio exigen que sea la
+# misma, así que se inicializan y cierran directamente en la tarea del lifespan
+# (Starlette entra y sale del lifespan en una sola tarea), no en tareas de gather
+SAME_TASK_SERVICES = (RAG_AGENT_SERVICE, CUSTOM_AGENT_SERVICE)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Configura e inicializa los servicios de agentes antes de recibir tráfico.
+    
+    Los subprocesos MCP y la carga de herramientas se hacen al arrancar, para que
+    la primera petición no pague ese costo. GreenTravel abre su conexión en una
+    tarea dueña propia, así que se prepara en paralelo con los demás. Si un
+    servicio falla al iniciar, se reintenta de forma perezosa en su primera petición.
+    """
+    RAG_AGENT_SERVICE.set_server_parameters(get_server_parameters("/app/mcp_server/rag_server.py"))
+    CUSTOM_AGENT_SERVICE.set_server_parameters(get_server_parameters("/app/mcp_server/custom_server.py"))
+    GREEN_TRAVEL_AGENT_SERVICE.set_server_parameters(get_greentravel_server_parameters())
+    
+    greentravel_warmup = asyncio.ensure_future(GREEN_TRAVEL_AGENT_SERVICE.warmup())
+    for service in SAME_TASK_SERVICES:
+        try:
+            await service.initialize()
+        except Exception as e:
+            logger.warning("No se pudo inicializar %s al arrancar: %s", type(service).__name__, e)
+    try:
+        await greentravel_warmup
+    except Exception as e:
+        logger.warning("No se pudo inicializar %s al arrancar: %s", type(GREEN_TRAVEL_AGENT_SERVICE).__name__, e)
+    
+    yield
+    
+    greentravel_shutdown = asyncio.ensure_future(GREEN_TRAVEL_AGENT_SERVICE.shutdown())
+    # Orden inverso a la inicialización
+    for service in reversed(SAME_TASK_SERVICES):
+        try:
+            await service.shutdown()
+        except Exception as e:
+            logger.warning("Error cerrando %s: %s", type(service).__name__, e)
+    try:
+        await greentravel_shutdown
+    except Exception as e:
+        logger.warning("Error cerrando %s: %s", type(GREEN_TRAVEL_AGENT_SERVICE).__name__, e)
+
+
+app = FastAPI(title = "202515 MISW4411 Agent Backend Template", lifespan=lifespan)
+
+
+# Configurar CORS para permitir peticiones desde el frontend.
+# El backend no usa cookies ni autenticación, así que no se envían credenciales
+# y el comodín cubre localhost:3000, 127.0.0.1:3000 y el despliegue en GCP
+# (comodín + credenciales viola la especificación CORS y los navegadores lo rechazan)
+ALLOWED_ORIGINS = ("*",)
 
-
-app = FastAPI(title = "202515 MISW4411 Agent Backend Template")
-
-
-# Configurar CORS para permitir peticiones desde el frontend
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=[
-        "http://localhost:3000",  # Frontend local
-        "http://127.0.0.1:3000",   # Alternativa localhost
-        "http://136.115.143.51/",
-        "*"
-    ],
-    allow_credentials=True,
+    allow_origins=ALLOWED_ORIGINS,
+    allow_credentials=False,
     allow_methods=["*"],  
     allow_headers=["*"], 
 )
@@ -48,14 +103,3 @@ async def health_check():
     """Endpoint de health check para verificar que el backend está funcionando."""
     return {"status": "ok", "message": "Backend is running"}
 
-
-rag_agent_parameters = get_server_parameters("/app/mcp_server/rag_server.py")
-RAG_AGENT_SERVICE.set_server_parameters(rag_agent_parameters)
-
-
-custom_agent_parameters = get_server_parameters("/app/mcp_server/custom_server.py")
-CUSTOM_AGENT_SERVICE.set_server_parameters(custom_agent_parameters)
-
-
-greentravel_agent_parameters = get_greentravel_server_parameters()
-GREEN_TRAVEL_AGENT_SERVICE.set_server_parameters(greentravel_agent_parameters)
@@ -23,7 +23,6 @@ import logging
 import os 
 
 
-logging.basicConfig(level = logging.INFO, format = "%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
 
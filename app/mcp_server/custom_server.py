@@ -10,14 +10,23 @@ de facturas desde RAG.
 
 from mcp.server.fastmcp import FastMCP
 import logging
-import json
-from datetime import datetime, timedelta
+import orjson
+import asyncio
+from datetime import date, timedelta
 import httpx
 import os
+import re
 import sys
 from typing import Optional
 from pathlib import Path
+from urllib.parse import quote
+from contextlib import asynccontextmanager
+from importlib.util import find_spec
 from dotenv import load_dotenv
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential_jitter
+# El servidor se ejecuta como script (uv run mcp_server/custom_server.py),
+# por lo que los módulos hermanos se importan directamente
+from semantic_cache import SemanticCache
 
 # Configurar logging con UTF-8 primero (antes de cargar .env para poder loguear)
 logging.basicConfig(
@@ -42,13 +51,22 @@ logger = logging.getLogger(__name__)
 env_path = Path(__file__).parent.parent / ".env"
 if env_path.exists():
     load_dotenv(env_path)
-    logger.info(f"[CONFIG] Variables de entorno cargadas desde: {env_path}")
+    logger.info("[CONFIG] Variables de entorno cargadas desde: %s", env_path)
 else:
     # Si no existe .env, intentar cargar desde el directorio actual
     load_dotenv()
     logger.info("[CONFIG] Intentando cargar variables de entorno desde directorio actual")
 
-mcp = FastMCP("custom-server")
+@asynccontextmanager
+async def _lifespan(server):
+    """Cierra el cliente HTTP compartido cuando el servidor MCP termina."""
+    try:
+        yield
+    finally:
+        await _close_client()
+
+
+mcp = FastMCP("custom-server", lifespan=_lifespan)
 
 # Configuración del Servicio de Liquidaciones
 def _get_liquidaciones_service_url():
@@ -68,8 +86,8 @@ def _get_liquidaciones_service_url():
     # Limpiar la URL (remover trailing slash)
     base_url = base_url.rstrip('/')
     
-    logger.info(f"[LIQUIDACIONES] GREENTRAVEL_GATEWAY_URL={os.getenv('GREENTRAVEL_GATEWAY_URL', 'NO CONFIGURADO')}")
-    logger.info(f"[LIQUIDACIONES] URL base configurada: {base_url}")
+    logger.info("[LIQUIDACIONES] GREENTRAVEL_GATEWAY_URL=%s", os.getenv('GREENTRAVEL_GATEWAY_URL', 'NO CONFIGURADO'))
+    logger.info("[LIQUIDACIONES] URL base configurada: %s", base_url)
     return base_url
 
 # Configuración del Servicio de Proveedores
@@ -90,25 +108,151 @@ def _get_provedores_service_url():
     # Limpiar la URL (remover trailing slash)
     base_url = base_url.rstrip('/')
     
-    logger.info(f"[PROVEDORES] GREENTRAVEL_GATEWAY_URL={os.getenv('GREENTRAVEL_GATEWAY_URL', 'NO CONFIGURADO')}")
-    logger.info(f"[PROVEDORES] URL base configurada: {base_url}")
+    logger.info("[PROVEDORES] GREENTRAVEL_GATEWAY_URL=%s", os.getenv('GREENTRAVEL_GATEWAY_URL', 'NO CONFIGURADO'))
+    logger.info("[PROVEDORES] URL base configurada: %s", base_url)
     return base_url
 
 # URLs de servicios GreenTravel
 LIQUIDACIONES_SERVICE_URL = _get_liquidaciones_service_url()
-logger.info(f"[LIQUIDACIONES] URL final: {LIQUIDACIONES_SERVICE_URL}/api/v1/liquidaciones")
+logger.info("[LIQUIDACIONES] URL final: %s/api/v1/liquidaciones", LIQUIDACIONES_SERVICE_URL)
 
 PROVEDORES_SERVICE_URL = _get_provedores_service_url()
-logger.info(f"[PROVEDORES] URL final: {PROVEDORES_SERVICE_URL}/api/v1/provedores")
+logger.info("[PROVEDORES] URL final: %s/api/v1/provedores", PROVEDORES_SERVICE_URL)
 
 RAG_BASE_URL = os.getenv("RAG_BASE_URL", "http://34.63.203.124")
 
+# Endpoints precalculados (los getters ya remueven el slash final)
+LIQUIDACIONES_BASE = f"{LIQUIDACIONES_SERVICE_URL}/api/v1/liquidaciones"
+LIQUIDACIONES_STATS_URL = LIQUIDACIONES_BASE + "/stats"
+PROVEDORES_BASE = f"{PROVEDORES_SERVICE_URL}/api/v1/provedores"
+PROVEDORES_STATS_URL = PROVEDORES_BASE + "/stats"
+RAG_ASK_URL = f"{RAG_BASE_URL.rstrip('/')}/api/v1/ask"
+
+# Servicio de facturas con búsqueda exacta por número (opcional). Si está configurado,
+# las consultas solo por número de factura se resuelven ahí, sin reranking ni generación del RAG
+INVOICES_SERVICE_URL = os.getenv("INVOICES_SERVICE_URL", "").rstrip("/")
+
+# Configuración del RAG (mismos valores que rag_server.py); cada consulta agrega question y top_k
+_RAG_PAYLOAD_TEMPLATE = {
+    "collection": "semana3_test_collection",
+    "use_reranking": True,
+    "use_query_rewriting": True
+}
+
+# Con identificadores exactos (número de factura o CUFE) la recuperación directa basta:
+# el reranking y la reescritura de la consulta solo agregan latencia
+_RAG_PAYLOAD_EXACT = _RAG_PAYLOAD_TEMPLATE | {"use_reranking": False, "use_query_rewriting": False}
+
 HTTP_TIMEOUT = 30.0
 
+# Conexión con fallo rápido; lectura tolerante a consultas agregadas lentas (stats)
+_TIMEOUT = httpx.Timeout(HTTP_TIMEOUT, connect=5.0, read=HTTP_TIMEOUT, write=10.0)
+
+# Caché de respuestas del RAG para consultas de factura idénticas. Las consultas salen
+# de _build_invoice_query y solo difieren en los identificadores, así que la capa
+# aproximada nunca acierta donde la exacta falla y sin dígitos ("ABCDE" vs "ABCDF")
+# podría devolver otra factura: solo coincidencia exacta
+RAG_CACHE = SemanticCache(max_entries=256, ttl_seconds=900.0, approximate=False)
+
+# Cliente HTTP compartido entre todas las herramientas (keep-alive y pool de conexiones)
+_CLIENT: Optional[httpx.AsyncClient] = None
+
+# HTTP/2 solo si el paquete h2 está disponible (httpx[http2]); permite multiplexar
+# llamadas concurrentes a herramientas sobre una misma conexión
+# find_spec comprueba la instalación sin importar el paquete (httpcore lo carga al abrir la primera conexión)
+HTTP2_ENABLED = find_spec("h2") is not None
+
+# Brotli reduce el tamaño de las respuestas JSON; solo se anuncia si se puede decodificar
+ACCEPT_ENCODING = "br, gzip" if find_spec("brotli") is not None else "gzip"
+
+
+def _get_client() -> httpx.AsyncClient:
+    """
+    Retorna el cliente HTTP compartido, creándolo en el primer uso.
+    
+    Reutilizar el cliente evita un handshake TCP/TLS y una resolución DNS
+    por cada llamada a herramienta.
+    """
+    global _CLIENT
+    if _CLIENT is None or _CLIENT.is_closed:
+        _CLIENT = httpx.AsyncClient(
+            timeout=_TIMEOUT,
+            http2=HTTP2_ENABLED,
+            headers={"Accept-Encoding": ACCEPT_ENCODING},
+            limits=httpx.Limits(max_keepalive_connections=50, max_connections=100)
+        )
+    return _CLIENT
+
+
+async def _close_client():
+    """Cierra el cliente HTTP compartido si fue creado."""
+    global _CLIENT
+    if _CLIENT is not None:
+        await _CLIENT.aclose()
+        _CLIENT = None
+
 # ===============================================================================
 # FUNCIONES AUXILIARES
 # ===============================================================================
 
+# JSON compacto por defecto: las respuestas van al contexto del LLM, donde la
+# indentación solo consume tokens. MCP_PRETTY_JSON=1 la activa para depurar.
+_DUMPS_OPTION = orjson.OPT_NON_STR_KEYS | (
+    orjson.OPT_INDENT_2
+    if os.getenv("MCP_PRETTY_JSON", "").lower() in ("1", "true", "yes")
+    else 0
+)
+
+
+def _dumps(obj) -> str:
+    """
+    Serializa a JSON con orjson (extensión en C, UTF-8 sin escapar como ensure_ascii=False).
+    """
+    return orjson.dumps(obj, option=_DUMPS_OPTION).decode()
+
+
+_loads = orjson.loads
+
+
+# Errores transitorios del gateway NGINX / red que vale la pena reintentar
+_RETRYABLE_STATUS = frozenset({502, 503, 504})
+_SAFE_METHODS = frozenset({"GET", "HEAD"})
+
+
+def _is_transient(exc: BaseException) -> bool:
+    """Indica si el error HTTP es transitorio (timeout, conexión cortada, 502/503/504)."""
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code in _RETRYABLE_STATUS
+    return isinstance(exc, (httpx.TimeoutException, httpx.ConnectError, httpx.RemoteProtocolError))
+
+
+@retry(
+    stop=stop_after_attempt(3),
+    wait=wait_exponential_jitter(initial=0.1, max=1.0),
+    retry=retry_if_exception(_is_transient),
+    reraise=True
+)
+async def _send_with_retry(method: str, url: str, **kwargs) -> httpx.Response:
+    response = await _get_client().request(method, url, **kwargs)
+    if response.status_code in _RETRYABLE_STATUS:
+        response.raise_for_status()
+    return response
+
+
+async def _send(method: str, url: str, idempotent: Optional[bool] = None, **kwargs) -> httpx.Response:
+    """
+    Envía la petición con el cliente compartido, reintentando errores transitorios.
+    
+    Solo se reintenta cuando la petición es idempotente (por defecto GET y HEAD);
+    las escrituras se envían una sola vez para no duplicar efectos.
+    """
+    if idempotent is None:
+        idempotent = method in _SAFE_METHODS
+    if idempotent:
+        return await _send_with_retry(method, url, **kwargs)
+    return await _get_client().request(method, url, **kwargs)
+
+
 async def _make_request(method: str, url: str, **kwargs) -> dict:
     """
     Realiza una petición HTTP a los servicios de GreenTravelBackend y retorna la respuesta como dict.
@@ -125,31 +269,31 @@ async def _make_request(method: str, url: str, **kwargs) -> dict:
         ValueError: Si hay un error en la petición HTTP
     """
     try:
-        async with httpx.AsyncClient(timeout=HTTP_TIMEOUT) as client:
-            response = await client.request(method, url, **kwargs)
-            
-            # Para DELETE, puede retornar 204 No Content
-            if response.status_code == 204:
-                return {"success": True, "message": "Operación completada exitosamente"}
-            
-            response.raise_for_status()
-            return response.json()
+        response = await _send(method, url, **kwargs)
+        
+        # Para DELETE, puede retornar 204 No Content
+        if response.status_code == 204:
+            return {"success": True, "message": "Operación completada exitosamente"}
+        
+        response.raise_for_status()
+        # orjson parsea los bytes directamente, sin decodificar a str primero
+        return _loads(response.content)
             
     except httpx.HTTPStatusError as e:
         error_msg = f"Error HTTP {e.response.status_code}: {e.response.text}"
-        logger.error(f"{method} {url}: {error_msg}")
+        logger.error("%s %s: %s", method, url, error_msg)
         raise ValueError(error_msg)
     except httpx.TimeoutException as e:
         error_msg = f"Timeout al conectar con el servicio: {str(e)}"
-        logger.error(f"{method} {url}: {error_msg}")
+        logger.error("%s %s: %s", method, url, error_msg)
         raise ValueError(error_msg)
     except httpx.RequestError as e:
         error_msg = f"Error de conexión: {str(e)}"
-        logger.error(f"{method} {url}: {error_msg}")
+        logger.error("%s %s: %s", method, url, error_msg)
         raise ValueError(error_msg)
-    except Exception as e:
-        error_msg = f"Error inesperado: {str(e)}"
-        logger.error(f"{method} {url}: {error_msg}")
+    except orjson.JSONDecodeError as e:
+        error_msg = f"Respuesta JSON inválida del servicio: {str(e)}"
+        logger.error("%s %s: %s", method, url, error_msg)
         raise ValueError(error_msg)
 
 
@@ -158,49 +302,44 @@ async def _make_request(method: str, url: str, **kwargs) -> dict:
 # HERRAMIENTA MCP 1 - CALCULAR VENCIMIENTO DE FACTURA
 # ===============================================================================
 
-@mcp.tool()
-async def calcular_vencimiento(fecha_emision: str, dias_credito: int) -> str:
-    """
-    Calcula la fecha de vencimiento de una factura y determina si ya está vencida.
+# Formatos de fecha aceptados: YYYY-MM-DD, YYYY/MM/DD, DD-MM-YYYY y DD/MM/YYYY
+# (el separador debe ser el mismo en toda la fecha). Una sola expresión regular
+# reemplaza los intentos sucesivos con strptime, que lanzaban una excepción por formato fallido.
+_FECHA_YMD_RE = re.compile(r"(\d{4})([-/])(\d{1,2})\2(\d{1,2})")
+_FECHA_DMY_RE = re.compile(r"(\d{1,2})([-/])(\d{1,2})\2(\d{4})")
 
-    Args:
-        fecha_emision (str): Fecha de emisión en formato YYYY-MM-DD (formato preferido).
-                            También acepta DD-MM-YYYY, DD/MM/YYYY, pero se recomienda YYYY-MM-DD.
-        dias_credito (int): Días de crédito otorgado al cliente.
 
-    Returns:
-        dict: Diccionario con:
-            - fecha_emision: Fecha de emisión en formato YYYY-MM-DD
-            - fecha_vencimiento: Fecha de vencimiento en formato YYYY-MM-DD
-            - vencida (bool): Indica si la factura ya está vencida
-            - dias_restantes: Días restantes hasta el vencimiento (negativo si ya venció)
-            - mensaje: Mensaje descriptivo del estado
-            - error (si aplica): Mensaje de error si hubo algún problema
+def _parse_fecha(fecha_texto: str) -> Optional[date]:
+    """Convierte la fecha de emisión a `date`, o retorna None si no tiene un formato aceptado."""
+    fecha_texto = fecha_texto.strip()
+    try:
+        match = _FECHA_YMD_RE.fullmatch(fecha_texto)
+        if match:
+            return date(int(match[1]), int(match[3]), int(match[4]))
+        match = _FECHA_DMY_RE.fullmatch(fecha_texto)
+        if match:
+            return date(int(match[4]), int(match[3]), int(match[1]))
+    except ValueError:
+        # Día o mes fuera de rango (ej: 2025-02-30)
+        return None
+    return None
+
+
+def _calcular_vencimiento_core(fecha_emision: str, dias_credito: int, hoy: Optional[date] = None) -> dict:
+    """
+    Calcula el vencimiento de una factura y retorna el resultado como dict.
+    
+    Es la lógica pura detrás de `calcular_vencimiento`; `hoy` permite que los
+    cálculos por lotes usen la misma fecha de referencia para todos los ítems.
     """
     try:
-        fecha_emision_dt = None
-        
-        # Intentar diferentes formatos de fecha
-        formatos_fecha = [
-            "%Y-%m-%d",      # YYYY-MM-DD (formato preferido)
-            "%d-%m-%Y",      # DD-MM-YYYY
-            "%d/%m/%Y",      # DD/MM/YYYY
-            "%Y/%m/%d",      # YYYY/MM/DD
-        ]
-        
-        for formato in formatos_fecha:
-            try:
-                fecha_emision_dt = datetime.strptime(fecha_emision.strip(), formato).date()
-                break
-            except ValueError:
-                continue
-        
+        fecha_emision_dt = _parse_fecha(fecha_emision)
         if fecha_emision_dt is None:
             raise ValueError(f"No se pudo parsear la fecha '{fecha_emision}'. Use formato YYYY-MM-DD (ej: 2025-10-03)")
 
         dias_credito = int(dias_credito)
-        fecha_vencimiento = fecha_emision_dt + timedelta(days=dias_credito)
-        hoy = datetime.now().date()
+        fecha_vencimiento = fecha_emision_dt + timedelta(days=dias_credito) if dias_credito else fecha_emision_dt
+        hoy = hoy or date.today()
 
         dias_restantes = (fecha_vencimiento - hoy).days
         vencida = dias_restantes < 0
@@ -218,10 +357,10 @@ async def calcular_vencimiento(fecha_emision: str, dias_credito: int) -> str:
             "mensaje": mensaje,
             "error": None
         }
-        return json.dumps(result, ensure_ascii=False, indent=2)
+        return result
         
     except Exception as e:
-        logger.error(f"Error calculando vencimiento: {e}")
+        logger.error("Error calculando vencimiento: %s", e)
         error_result = {
             "fecha_emision": fecha_emision,
             "fecha_vencimiento": None,
@@ -230,12 +369,178 @@ async def calcular_vencimiento(fecha_emision: str, dias_credito: int) -> str:
             "mensaje": f"Hubo un error al intentar calcular la fecha de vencimiento: {e}",
             "error": str(e)
         }
-        return json.dumps(error_result, ensure_ascii=False, indent=2)
+        return error_result
+
+
+@mcp.tool()
+async def calcular_vencimiento(fecha_emision: str, dias_credito: int) -> str:
+    """
+    Calcula la fecha de vencimiento de una factura y determina si ya está vencida.
+
+    Args:
+        fecha_emision (str): Fecha de emisión en formato YYYY-MM-DD (formato preferido).
+                            También acepta DD-MM-YYYY, DD/MM/YYYY, pero se recomienda YYYY-MM-DD.
+        dias_credito (int): Días de crédito otorgado al cliente.
+
+    Returns:
+        dict: Diccionario con:
+            - fecha_emision: Fecha de emisión en formato YYYY-MM-DD
+            - fecha_vencimiento: Fecha de vencimiento en formato YYYY-MM-DD
+            - vencida (bool): Indica si la factura ya está vencida
+            - dias_restantes: Días restantes hasta el vencimiento (negativo si ya venció)
+            - mensaje: Mensaje descriptivo del estado
+            - error (si aplica): Mensaje de error si hubo algún problema
+    """
+    return _dumps(_calcular_vencimiento_core(fecha_emision, dias_credito))
+
+
+@mcp.tool()
+async def calcular_vencimientos_batch(items: list[dict]) -> str:
+    """
+    Calcula el vencimiento de varias facturas en una sola llamada.
+
+    Args:
+        items (list[dict]): Lista de objetos con `fecha_emision` (YYYY-MM-DD) y `dias_credito`.
+
+    Returns:
+        str: Lista JSON con un resultado por ítem, en el mismo orden y con el mismo
+             formato que `calcular_vencimiento`. Los ítems que no son objetos
+             producen una entrada con `error` en su posición.
+    """
+    hoy = date.today()
+    return _dumps([
+        _calcular_vencimiento_core(
+            str(item.get("fecha_emision", "")),
+            item.get("dias_credito", 0),
+            hoy=hoy
+        )
+        if isinstance(item, dict)
+        else {"index": index, "error": f"El ítem {index} debe ser un objeto con fecha_emision y dias_credito"}
+        for index, item in enumerate(items)
+    ])
 
 # ===============================================================================
 # HERRAMIENTA MCP 2 - OBTENER DATOS DE FACTURA DESDE RAG
 # ===============================================================================
 
+def _build_invoice_query(invoice_number: Optional[str] = None, cufe: Optional[str] = None, provider_nit: Optional[str] = None) -> str:
+    """
+    Construye la pregunta para el RAG a partir de los identificadores de la factura.
+    """
+    parts = tuple(
+        template.format(value)
+        for value, template in (
+            (invoice_number, "factura número {}"),
+            (cufe, "CUFE {}"),
+            (provider_nit, "proveedor NIT {}")
+        )
+        if value
+    )
+    return "Dame toda la información de la factura" + (f" con {' y '.join(parts)}" if parts else "")
+
+
+# Consultas al RAG en curso, por (pregunta, top_k), compartidas entre llamadas concurrentes idénticas
+_RAG_INFLIGHT: dict = {}
+
+
+async def _fetch_invoice_text(query: str, top_k: int = 5, exact: bool = False) -> str:
+    """
+    Consulta el endpoint /api/v1/ask del RAG y retorna el texto de la factura.
+    
+    Args:
+        query: Pregunta a enviar al RAG
+        top_k: Número de fragmentos a recuperar
+        exact: Si la consulta incluye un número de factura o CUFE (desactiva reranking y reescritura)
+    
+    Returns:
+        str: Texto de la factura o un mensaje que inicia con "Error" si la consulta falla
+    """
+    cached = RAG_CACHE.get(query)
+    if cached is not None:
+        logger.info("[RAG_GET_INVOICE_DATA] Respuesta obtenida de la caché")
+        return cached
+    
+    # Una consulta idéntica ya en curso se comparte en lugar de repetir la petición
+    key = (query, top_k, exact)
+    task = _RAG_INFLIGHT.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_request_invoice_text(query, top_k, exact))
+        _RAG_INFLIGHT[key] = task
+        task.add_done_callback(lambda _: _RAG_INFLIGHT.pop(key, None))
+    
+    # shield: si una de las llamadas se cancela, la consulta sigue para las demás
+    return await asyncio.shield(task)
+
+
+async def _request_invoice_text(query: str, top_k: int, exact: bool) -> str:
+    """Envía la consulta al RAG y guarda la respuesta exitosa en la caché."""
+    payload = (_RAG_PAYLOAD_EXACT if exact else _RAG_PAYLOAD_TEMPLATE) | {"question": query, "top_k": top_k}
+    
+    try:
+        # Sin reintentos (igual que en greentravel_server): un timeout de lectura significa
+        # que el RAG ya está lento, y repetir la consulta vuelve a ejecutar el reranking
+        # y la generación, triplicando el peor caso de la llamada a la herramienta
+        response = await _send("POST", RAG_ASK_URL, json=payload)
+        response.raise_for_status()
+        result = _loads(response.content)
+        
+        invoice_text = result.get("answer") if isinstance(result, dict) else None
+        if invoice_text is None:
+            return "Error: La respuesta del RAG no contiene el campo 'answer'"
+        
+        logger.info("[RAG_GET_INVOICE_DATA] Texto obtenido del RAG (%s caracteres)", len(invoice_text))
+        RAG_CACHE.set(query, invoice_text)
+        
+        # Retornar el texto directamente - el agente lo interpretará cuando sea necesario
+        return invoice_text
+            
+    except httpx.HTTPError as e:
+        logger.error("Error HTTP consultando RAG: %s", e)
+        return f"Error HTTP consultando RAG: {str(e)}"
+    except Exception as e:
+        logger.error("Error obteniendo datos de factura desde RAG: %s", e)
+        return f"Error obteniendo datos de factura: {str(e)}"
+
+
+async def _fetch_invoice_direct(invoice_number: str) -> Optional[str]:
+    """
+    Busca la factura por número exacto en INVOICES_SERVICE_URL.
+    
+    Returns:
+        str | None: JSON de la factura, o None si el servicio no está configurado,
+                    no la encuentra o falla (en ese caso se consulta el RAG)
+    """
+    if not INVOICES_SERVICE_URL:
+        return None
+    
+    url = f"{INVOICES_SERVICE_URL}/invoices/{quote(invoice_number, safe='')}"
+    try:
+        response = await _send("GET", url)
+    except httpx.HTTPError as e:
+        logger.warning("[RAG_GET_INVOICE_DATA] Servicio de facturas no disponible, se usa el RAG: %s", e)
+        return None
+    if response.status_code != 200:
+        return None
+    
+    logger.info("[RAG_GET_INVOICE_DATA] Factura %s obtenida del servicio de facturas", invoice_number)
+    return response.content.decode()
+
+
+async def _get_invoice(invoice_number: Optional[str] = None, cufe: Optional[str] = None, provider_nit: Optional[str] = None) -> str:
+    """
+    Obtiene el texto de una factura: primero el servicio de facturas (solo con número
+    de factura) y, si no está disponible o no la encuentra, el RAG.
+    """
+    # Camino directo: el caso más común (solo número de factura) no necesita el RAG
+    if invoice_number and not cufe and not provider_nit:
+        invoice_json = await _fetch_invoice_direct(invoice_number)
+        if invoice_json is not None:
+            return invoice_json
+    
+    query = _build_invoice_query(invoice_number, cufe, provider_nit)
+    return await _fetch_invoice_text(query, exact=bool(invoice_number or cufe))
+
+
 @mcp.tool()
 async def rag_get_invoice_data(invoice_number: Optional[str] = None, cufe: Optional[str] = None, provider_nit: Optional[str] = None) -> str:
     """
@@ -260,57 +565,54 @@ async def rag_get_invoice_data(invoice_number: Optional[str] = None, cufe: Optio
     Returns:
         str: Texto completo de la factura obtenido del RAG con todos los detalles (número, CUFE, proveedor, cliente, fecha, total, items, etc.)
     """
-    # Construir query para RAG
-    query_parts = []
-    if invoice_number:
-        query_parts.append(f"factura número {invoice_number}")
-    if cufe:
-        query_parts.append(f"CUFE {cufe}")
-    if provider_nit:
-        query_parts.append(f"proveedor NIT {provider_nit}")
-    
-    if not query_parts:
-        query = "Dame toda la información de la factura"
-    else:
-        query = f"Dame toda la información de la factura con {' y '.join(query_parts)}"
-    
-    rag_url = f"{RAG_BASE_URL.rstrip('/')}/api/v1/ask"
-    
-    # Configuración del RAG (mismos valores que rag_server.py)
-    rag_collection = "semana3_test_collection"
-    rag_top_k = 5
-    rag_use_reranking = True
-    rag_use_query_rewriting = True
-    
-    payload = {
-        "question": query,
-        "top_k": rag_top_k,
-        "collection": rag_collection,
-        "use_reranking": rag_use_reranking,
-        "use_query_rewriting": rag_use_query_rewriting
-    }
+    return await _get_invoice(invoice_number, cufe, provider_nit)
+
+
+@mcp.tool()
+async def rag_get_invoice_data_batch(invoices: list[dict]) -> str:
+    """
+    Obtiene la información de varias facturas desde el sistema RAG en una sola llamada.
     
-    try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(rag_url, json=payload)
-            response.raise_for_status()
-            result = response.json()
-            
-            if "answer" not in result:
-                return "Error: La respuesta del RAG no contiene el campo 'answer'"
-            
-            invoice_text = result["answer"]
-            logger.info(f"[RAG_GET_INVOICE_DATA] Texto obtenido del RAG ({len(invoice_text)} caracteres)")
-            
-            # Retornar el texto directamente - el agente lo interpretará cuando sea necesario
-            return invoice_text
-                
-    except httpx.HTTPError as e:
-        logger.error(f"Error HTTP consultando RAG: {e}")
-        return f"Error HTTP consultando RAG: {str(e)}"
-    except Exception as e:
-        logger.error(f"Error obteniendo datos de factura desde RAG: {e}")
-        return f"Error obteniendo datos de factura: {str(e)}"
+    Variante por lotes de `rag_get_invoice_data` usada por el agente para agrupar
+    varias consultas de factura de un mismo turno.
+    
+    Args:
+        invoices: Lista de parámetros por factura, cada uno con las llaves opcionales
+                  invoice_number, cufe y provider_nit.
+    
+    Returns:
+        str: JSON string con la lista de textos de factura, en el mismo orden de `invoices`
+    """
+    # Cada factura sigue el mismo camino que rag_get_invoice_data (servicio directo y luego RAG)
+    results = await asyncio.gather(*(
+        _get_invoice(invoice.get("invoice_number"), invoice.get("cufe"), invoice.get("provider_nit"))
+        for invoice in invoices
+    ))
+    return _dumps(results)
+
+
+@mcp.tool()
+async def rag_get_invoices_batch(invoice_numbers: list[str]) -> str:
+    """
+    Obtiene información de VARIAS facturas en una sola llamada.
+    
+    **USA ESTA HERRAMIENTA cuando el usuario mencione dos o más números de factura** en la misma
+    pregunta (ej: "compara las facturas HBE122090 y E018-175709"), en lugar de llamar
+    `rag_get_invoice_data` una vez por cada factura.
+    
+    Args:
+        invoice_numbers: Lista de números de factura (ej: ["HBE122090", "E018-175709"])
+    
+    Returns:
+        str: JSON string con el texto de cada factura, por número de factura
+    """
+    if not invoice_numbers:
+        return _dumps({})
+    
+    # Mismo camino por factura que rag_get_invoice_data_batch, ejecutadas en paralelo
+    # (el agente personalizado resuelve esta herramienta con esa variante por lotes)
+    results = await asyncio.gather(*(_get_invoice(number) for number in invoice_numbers))
+    return _dumps(dict(zip(invoice_numbers, results)))
 
 
 # ===============================================================================
@@ -340,26 +642,19 @@ async def list_liquidaciones(
     Returns:
         str: JSON string con lista paginada de liquidaciones
     """
-    url = f"{LIQUIDACIONES_SERVICE_URL.rstrip('/')}/api/v1/liquidaciones"
-    params = {
-        "page": page,
-        "limit": limit
-    }
-    
-    if search:
-        params["search"] = search
-    if estado is not None:
-        params["estado"] = estado
-    if id_reserva is not None:
-        params["id_reserva"] = id_reserva
-    if factura is not None:
-        params["factura"] = factura
+    url = LIQUIDACIONES_BASE
+    # Solo se envían los filtros definidos (search vacío se omite)
+    params = {k: v for k, v in (
+        ("page", page), ("limit", limit),
+        ("search", search or None), ("estado", estado),
+        ("id_reserva", id_reserva), ("factura", factura),
+    ) if v is not None}
     
     try:
         result = await _make_request("GET", url, params=params)
-        return json.dumps(result, ensure_ascii=False, indent=2)
-    except Exception as e:
-        return json.dumps({"error": str(e)}, ensure_ascii=False)
+        return _dumps(result)
+    except ValueError as e:
+        return _dumps({"error": str(e)})
 
 
 @mcp.tool()
@@ -373,13 +668,13 @@ async def get_liquidacion(liquidacion_id: int) -> str:
     Returns:
         str: JSON string con los datos de la liquidación
     """
-    url = f"{LIQUIDACIONES_SERVICE_URL.rstrip('/')}/api/v1/liquidaciones/{liquidacion_id}"
+    url = f"{LIQUIDACIONES_BASE}/{liquidacion_id}"
     
     try:
         result = await _make_request("GET", url)
-        return json.dumps(result, ensure_ascii=False, indent=2)
-    except Exception as e:
-        return json.dumps({"error": str(e)}, ensure_ascii=False)
+        return _dumps(result)
+    except ValueError as e:
+        return _dumps({"error": str(e)})
 
 
 @mcp.tool()
@@ -398,16 +693,16 @@ async def create_liquidacion(data: str) -> str:
     Returns:
         str: JSON string con la liquidación creada
     """
-    url = f"{LIQUIDACIONES_SERVICE_URL.rstrip('/')}/api/v1/liquidaciones"
+    url = LIQUIDACIONES_BASE
     
     try:
-        payload = json.loads(data)
+        payload = _loads(data)
         result = await _make_request("POST", url, json=payload)
-        return json.dumps(result, ensure_ascii=False, indent=2)
-    except json.JSONDecodeError as e:
-        return json.dumps({"error": f"JSON inválido: {str(e)}"}, ensure_ascii=False)
-    except Exception as e:
-        return json.dumps({"error": str(e)}, ensure_ascii=False)
+        return _dumps(result)
+    except orjson.JSONDecodeError as e:
+        return _dumps({"error": f"JSON inválido: {str(e)}"})
+    except ValueError as e:
+        return _dumps({"error": str(e)})
 
 
 @mcp.tool()
@@ -422,16 +717,16 @@ async def update_liquidacion(liquidacion_id: int, data: str) -> str:
     Returns:
         str: JSON string con la liquidación actualizada
     """
-    url = f"{LIQUIDACIONES_SERVICE_URL.rstrip('/')}/api/v1/liquidaciones/{liquidacion_id}"
+    url = f"{LIQUIDACIONES_BASE}/{liquidacion_id}"
     
     try:
-        payload = json.loads(data)
+        payload = _loads(data)
         result = await _make_request("PUT", url, json=payload)
-        return json.dumps(result, ensure_ascii=False, indent=2)
-    except json.JSONDecodeError as e:
-        return json.dumps({"error": f"JSON inválido: {str(e)}"}, ensure_ascii=False)
-    except Exception as e:
-        return json.dumps({"error": str(e)}, ensure_ascii=False)
+        return _dumps(result)
+    except orjson.JSONDecodeError as e:
+        return _dumps({"error": f"JSON inválido: {str(e)}"})
+    except ValueError as e:
+        return _dumps({"error": str(e)})
 
 
 @mcp.tool()
@@ -445,13 +740,13 @@ async def delete_liquidacion(liquidacion_id: int) -> str:
     Returns:
         str: JSON string confirmando la eliminación
     """
-    url = f"{LIQUIDACIONES_SERVICE_URL.rstrip('/')}/api/v1/liquidaciones/{liquidacion_id}"
+    url = f"{LIQUIDACIONES_BASE}/{liquidacion_id}"
     
     try:
         result = await _make_request("DELETE", url)
-        return json.dumps(result, ensure_ascii=False, indent=2)
-    except Exception as e:
-        return json.dumps({"error": str(e)}, ensure_ascii=False)
+        return _dumps(result)
+    except ValueError as e:
+        return _dumps({"error": str(e)})
 
 
 @mcp.tool()
@@ -462,13 +757,13 @@ async def get_liquidacion_stats() -> str:
     Returns:
         str: JSON string con estadísticas (total, activas, inactivas, por_estado)
     """
-    url = f"{LIQUIDACIONES_SERVICE_URL.rstrip('/')}/api/v1/liquidaciones/stats"
+    url = LIQUIDACIONES_STATS_URL
     
     try:
         result = await _make_request("GET", url)
-        return json.dumps(result, ensure_ascii=False, indent=2)
-    except Exception as e:
-        return json.dumps({"error": str(e)}, ensure_ascii=False)
+        return _dumps(result)
+    except ValueError as e:
+        return _dumps({"error": str(e)})
 
 
 # ===============================================================================
@@ -498,26 +793,19 @@ async def list_provedores(
     Returns:
         str: JSON string con lista paginada de proveedores
     """
-    url = f"{PROVEDORES_SERVICE_URL.rstrip('/')}/api/v1/provedores"
-    params = {
-        "page": page,
-        "limit": limit
-    }
-    
-    if search:
-        params["search"] = search
-    if estado is not None:
-        params["estado"] = estado
-    if tipo is not None:
-        params["tipo"] = tipo
-    if ciudad is not None:
-        params["ciudad"] = ciudad
+    url = PROVEDORES_BASE
+    # Solo se envían los filtros definidos (search vacío se omite)
+    params = {k: v for k, v in (
+        ("page", page), ("limit", limit),
+        ("search", search or None), ("estado", estado),
+        ("tipo", tipo), ("ciudad", ciudad),
+    ) if v is not None}
     
     try:
         result = await _make_request("GET", url, params=params)
-        return json.dumps(result, ensure_ascii=False, indent=2)
-    except Exception as e:
-        return json.dumps({"error": str(e)}, ensure_ascii=False)
+        return _dumps(result)
+    except ValueError as e:
+        return _dumps({"error": str(e)})
 
 
 @mcp.tool()
@@ -531,13 +819,13 @@ async def get_provedor(provedor_id: int) -> str:
     Returns:
         str: JSON string con los datos del proveedor
     """
-    url = f"{PROVEDORES_SERVICE_URL.rstrip('/')}/api/v1/provedores/{provedor_id}"
+    url = f"{PROVEDORES_BASE}/{provedor_id}"
     
     try:
         result = await _make_request("GET", url)
-        return json.dumps(result, ensure_ascii=False, indent=2)
-    except Exception as e:
-        return json.dumps({"error": str(e)}, ensure_ascii=False)
+        return _dumps(result)
+    except ValueError as e:
+        return _dumps({"error": str(e)})
 
 
 @mcp.tool()
@@ -554,16 +842,16 @@ async def create_provedor(data: str) -> str:
     Returns:
         str: JSON string con el proveedor creado
     """
-    url = f"{PROVEDORES_SERVICE_URL.rstrip('/')}/api/v1/provedores"
+    url = PROVEDORES_BASE
     
     try:
-        payload = json.loads(data)
+        payload = _loads(data)
         result = await _make_request("POST", url, json=payload)
-        return json.dumps(result, ensure_ascii=False, indent=2)
-    except json.JSONDecodeError as e:
-        return json.dumps({"error": f"JSON inválido: {str(e)}"}, ensure_ascii=False)
-    except Exception as e:
-        return json.dumps({"error": str(e)}, ensure_ascii=False)
+        return _dumps(result)
+    except orjson.JSONDecodeError as e:
+        return _dumps({"error": f"JSON inválido: {str(e)}"})
+    except ValueError as e:
+        return _dumps({"error": str(e)})
 
 
 @mcp.tool()
@@ -578,16 +866,16 @@ async def update_provedor(provedor_id: int, data: str) -> str:
     Returns:
         str: JSON string con el proveedor actualizado
     """
-    url = f"{PROVEDORES_SERVICE_URL.rstrip('/')}/api/v1/provedores/{provedor_id}"
+    url = f"{PROVEDORES_BASE}/{provedor_id}"
     
     try:
-        payload = json.loads(data)
+        payload = _loads(data)
         result = await _make_request("PUT", url, json=payload)
-        return json.dumps(result, ensure_ascii=False, indent=2)
-    except json.JSONDecodeError as e:
-        return json.dumps({"error": f"JSON inválido: {str(e)}"}, ensure_ascii=False)
-    except Exception as e:
-        return json.dumps({"error": str(e)}, ensure_ascii=False)
+        return _dumps(result)
+    except orjson.JSONDecodeError as e:
+        return _dumps({"error": f"JSON inválido: {str(e)}"})
+    except ValueError as e:
+        return _dumps({"error": str(e)})
 
 
 @mcp.tool()
@@ -601,13 +889,13 @@ async def delete_provedor(provedor_id: int) -> str:
     Returns:
         str: JSON string confirmando la eliminación
     """
-    url = f"{PROVEDORES_SERVICE_URL.rstrip('/')}/api/v1/provedores/{provedor_id}"
+    url = f"{PROVEDORES_BASE}/{provedor_id}"
     
     try:
         result = await _make_request("DELETE", url)
-        return json.dumps(result, ensure_ascii=False, indent=2)
-    except Exception as e:
-        return json.dumps({"error": str(e)}, ensure_ascii=False)
+        return _dumps(result)
+    except ValueError as e:
+        return _dumps({"error": str(e)})
 
 
 @mcp.tool()
@@ -618,13 +906,13 @@ async def get_provedor_stats() -> str:
     Returns:
         str: JSON string con estadísticas (total, activos, inactivos, por_estado, por_tipo)
     """
-    url = f"{PROVEDORES_SERVICE_URL.rstrip('/')}/api/v1/provedores/stats"
+    url = PROVEDORES_STATS_URL
     
     try:
         result = await _make_request("GET", url)
-        return json.dumps(result, ensure_ascii=False, indent=2)
-    except Exception as e:
-        return json.dumps({"error": str(e)}, ensure_ascii=False)
+        return _dumps(result)
+    except ValueError as e:
+        return _dumps({"error": str(e)})
 
 
 
@@ -884,5 +1172,11 @@ async def get_provedor_stats() -> str:
 #         return json.dumps({"error": str(e)})
 
 if __name__ == "__main__":
+    # uvloop (si está instalado) reemplaza el bucle de eventos por defecto; no existe en Windows
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass
     mcp.run(transport="stdio")
 
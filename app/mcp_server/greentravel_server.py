@@ -14,14 +14,26 @@ estadísticas y gestionar información de facturas.
 
 from mcp.server.fastmcp import FastMCP
 import logging
-import json
+import orjson
+import asyncio
+import base64
 import httpx
 import os
+import re
 import sys
+import time
 from typing import Optional
-from datetime import datetime, timedelta
+from datetime import date, timedelta
 from pathlib import Path
+from urllib.parse import quote, urlencode, urlsplit
+from functools import lru_cache
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from importlib.util import find_spec
 from dotenv import load_dotenv
+from tenacity import AsyncRetrying, retry_if_exception, stop_after_attempt, wait_exponential_jitter
+# El servidor se ejecuta como script (uv run), por lo que los módulos hermanos se importan directamente
+from semantic_cache import SemanticCache
 
 # Configurar logging con UTF-8 primero (antes de cargar .env para poder loguear)
 logging.basicConfig(
@@ -46,118 +58,608 @@ logger = logging.getLogger(__name__)
 env_path = Path(__file__).parent.parent / ".env"
 if env_path.exists():
     load_dotenv(env_path)
-    logger.info(f"[CONFIG] Variables de entorno cargadas desde: {env_path}")
+    logger.info("[CONFIG] Variables de entorno cargadas desde: %s", env_path)
 else:
     # Si no existe .env, intentar cargar desde el directorio actual
     load_dotenv()
     logger.info("[CONFIG] Intentando cargar variables de entorno desde directorio actual")
 
-mcp = FastMCP("greentravel-server")
+async def _warmup():
+    """Abre una conexión al gateway con un HEAD barato para que la primera herramienta no pague el handshake."""
+    try:
+        await _get_client().head(PROVEDORES_SERVICE_URL, timeout=5.0)
+        logger.info("[WARMUP] Conexión con el gateway establecida")
+    except Exception as e:
+        logger.warning("[WARMUP] No se pudo precalentar la conexión con el gateway: %s", e)
+
 
-# Configuración del Servicio de Liquidaciones
-def _get_liquidaciones_service_url():
+@asynccontextmanager
+async def _lifespan(server):
     """
-    Obtiene la URL base del servicio de liquidaciones desde GREENTRAVEL_GATEWAY_URL.
-    
-    La URL base se usa para construir las rutas completas:
-    - {base_url}/api/v1/liquidaciones
-    
-    Configuración:
-    - GREENTRAVEL_GATEWAY_URL: URL base del gateway NGINX (ej: http://34.134.74.83)
-    - Si no está configurada, usa http://localhost como valor por defecto para desarrollo
+    Precalienta la conexión con el gateway al iniciar y cierra el cliente HTTP
+    compartido cuando el servidor MCP termina.
     """
-    # Obtener URL base del gateway NGINX
-    base_url = os.getenv("GREENTRAVEL_GATEWAY_URL", "http://localhost")
-    
-    # Limpiar la URL (remover trailing slash)
-    base_url = base_url.rstrip('/')
-    
-    logger.info(f"[LIQUIDACIONES] GREENTRAVEL_GATEWAY_URL={os.getenv('GREENTRAVEL_GATEWAY_URL', 'NO CONFIGURADO')}")
-    logger.info(f"[LIQUIDACIONES] URL base configurada: {base_url}")
-    return base_url
+    warmup_task = asyncio.create_task(_warmup())
+    try:
+        yield
+    finally:
+        warmup_task.cancel()
+        await _close_client()
+
 
-LIQUIDACIONES_SERVICE_URL = _get_liquidaciones_service_url()
-logger.info(f"[LIQUIDACIONES] URL final: {LIQUIDACIONES_SERVICE_URL}/api/v1/liquidaciones")
+mcp = FastMCP("greentravel-server", lifespan=_lifespan)
 
-# Configuración del Servicio de Proveedores
-def _get_provedores_service_url():
+# Configuración de los servicios de Liquidaciones y Proveedores
+def _get_gateway_url():
     """
-    Obtiene la URL base del servicio de proveedores desde GREENTRAVEL_GATEWAY_URL.
+    Obtiene la URL base de los servicios de GreenTravelBackend desde GREENTRAVEL_GATEWAY_URL.
     
-    La URL base se usa para construir las rutas completas:
+    Liquidaciones y proveedores comparten el gateway; la URL base se usa para
+    construir las rutas completas:
+    - {base_url}/api/v1/liquidaciones
     - {base_url}/api/v1/provedores
     
     Configuración:
     - GREENTRAVEL_GATEWAY_URL: URL base del gateway NGINX (ej: http://34.134.74.83)
     - Si no está configurada, usa http://localhost como valor por defecto para desarrollo
     """
-    # Obtener URL base del gateway NGINX (misma que liquidaciones)
+    # Obtener URL base del gateway NGINX
     base_url = os.getenv("GREENTRAVEL_GATEWAY_URL", "http://localhost")
     
     # Limpiar la URL (remover trailing slash)
     base_url = base_url.rstrip('/')
     
-    logger.info(f"[PROVEDORES] GREENTRAVEL_GATEWAY_URL={os.getenv('GREENTRAVEL_GATEWAY_URL', 'NO CONFIGURADO')}")
-    logger.info(f"[PROVEDORES] URL base configurada: {base_url}")
+    logger.info("[GATEWAY] GREENTRAVEL_GATEWAY_URL=%s", os.getenv("GREENTRAVEL_GATEWAY_URL", "NO CONFIGURADO"))
+    logger.info("[GATEWAY] URL base configurada: %s", base_url)
     return base_url
 
-PROVEDORES_SERVICE_URL = _get_provedores_service_url()
-logger.info(f"[PROVEDORES] URL final: {PROVEDORES_SERVICE_URL}/api/v1/provedores")
+LIQUIDACIONES_SERVICE_URL = PROVEDORES_SERVICE_URL = _get_gateway_url()
+logger.info("[LIQUIDACIONES] URL final: %s/api/v1/liquidaciones", LIQUIDACIONES_SERVICE_URL)
+logger.info("[PROVEDORES] URL final: %s/api/v1/provedores", PROVEDORES_SERVICE_URL)
 
 # Configuración del Sistema RAG para Facturas
 RAG_BASE_URL = os.getenv("RAG_BASE_URL", "http://34.63.203.124")
 
+# Endpoints precalculados (los getters ya remueven el slash final)
+LIQUIDACIONES_BASE = f"{LIQUIDACIONES_SERVICE_URL}/api/v1/liquidaciones"
+LIQUIDACIONES_STATS_URL = LIQUIDACIONES_BASE + "/stats"
+PROVEDORES_BASE = f"{PROVEDORES_SERVICE_URL}/api/v1/provedores"
+PROVEDORES_STATS_URL = PROVEDORES_BASE + "/stats"
+RAG_ASK_URL = f"{RAG_BASE_URL.rstrip('/')}/api/v1/ask"
+
+# Servicio de facturas con búsqueda exacta por número (opcional). Si está configurado,
+# las consultas solo por número de factura se resuelven ahí, sin reranking ni generación del RAG
+INVOICES_SERVICE_URL = os.getenv("INVOICES_SERVICE_URL", "").rstrip("/")
+
+# Configuración del RAG (mismos valores que rag_server.py); cada consulta agrega question
+_RAG_PAYLOAD_TEMPLATE = {
+    "top_k": 5,
+    "collection": "semana3_test_collection",
+    "use_reranking": True,
+    "use_query_rewriting": True
+}
+
+# Con identificadores exactos (número de factura o CUFE) la recuperación directa basta:
+# el reranking y la reescritura de la consulta solo agregan latencia
+_RAG_PAYLOAD_EXACT = _RAG_PAYLOAD_TEMPLATE | {"use_reranking": False, "use_query_rewriting": False}
+
 HTTP_TIMEOUT = 30.0
 
+# Caché de respuestas del RAG para consultas de factura idénticas. Las consultas salen
+# de _build_invoice_query y solo difieren en los identificadores, así que la capa
+# aproximada nunca acierta donde la exacta falla y sin dígitos ("ABCDE" vs "ABCDF")
+# podría devolver otra factura: solo coincidencia exacta
+RAG_CACHE = SemanticCache(max_entries=256, ttl_seconds=900.0, approximate=False)
+
+# Conexión con fallo rápido; lectura tolerante a consultas agregadas lentas (stats)
+_TIMEOUT = httpx.Timeout(HTTP_TIMEOUT, connect=5.0, read=HTTP_TIMEOUT, write=10.0)
+
+# Cliente HTTP compartido entre todas las herramientas (keep-alive y pool de conexiones)
+_CLIENT: Optional[httpx.AsyncClient] = None
+
+# HTTP/2 solo si el paquete h2 está disponible (httpx[http2]); permite multiplexar
+# llamadas concurrentes a herramientas sobre una misma conexión
+# find_spec comprueba la instalación sin importar el paquete (httpcore lo carga al abrir la primera conexión)
+HTTP2_ENABLED = find_spec("h2") is not None
+
+# Brotli reduce el tamaño de las respuestas JSON; solo se anuncia si se puede decodificar
+ACCEPT_ENCODING = "br, gzip" if find_spec("brotli") is not None else "gzip"
+
+
+def _get_client() -> httpx.AsyncClient:
+    """
+    Retorna el cliente HTTP compartido, creándolo en el primer uso.
+    
+    Reutilizar el cliente evita un handshake TCP/TLS y una resolución DNS
+    por cada llamada a herramienta.
+    """
+    global _CLIENT
+    if _CLIENT is None or _CLIENT.is_closed:
+        _CLIENT = httpx.AsyncClient(
+            timeout=_TIMEOUT,
+            http2=HTTP2_ENABLED,
+            headers={"Accept-Encoding": ACCEPT_ENCODING},
+            limits=httpx.Limits(max_keepalive_connections=20, max_connections=100)
+        )
+    return _CLIENT
+
+
+async def _close_client():
+    """Cierra el cliente HTTP compartido si fue creado."""
+    global _CLIENT
+    if _CLIENT is not None:
+        await _CLIENT.aclose()
+        _CLIENT = None
+
 
 # ===============================================================================
 # FUNCIONES AUXILIARES
 # ===============================================================================
 
-async def _make_request(method: str, url: str, **kwargs) -> dict:
+# JSON compacto por defecto: las respuestas van al contexto del LLM, donde la
+# indentación solo consume tokens. MCP_PRETTY_JSON=1 la activa para depurar.
+PRETTY_JSON = os.getenv("MCP_PRETTY_JSON", "").lower() in ("1", "true", "yes")
+
+
+_DUMPS_COMPACT = orjson.OPT_NON_STR_KEYS
+_DUMPS_PRETTY = orjson.OPT_NON_STR_KEYS | orjson.OPT_INDENT_2
+
+
+def _dumps(obj, pretty: bool = PRETTY_JSON) -> str:
+    """
+    Serializa a JSON con orjson (extensión en C, UTF-8 sin escapar como ensure_ascii=False).
+    """
+    return orjson.dumps(obj, option=_DUMPS_PRETTY if pretty else _DUMPS_COMPACT).decode()
+
+
+_loads = orjson.loads
+
+
+# Campos aceptados por los servicios; se validan localmente para no gastar una
+# petición en un payload que el servicio rechazaría con 400/422
+_LIQUIDACION_FIELDS = frozenset({
+    "observaciones", "id_reserva", "nombre_asesor", "nombre_empresa", "nit_empresa",
+    "direccion_empresa", "telefono_empresa", "servicio", "fecha_servicio", "incluye_servicio",
+    "numero_pasajeros", "valor_liquidacion", "iva", "valor_iva", "valor_total_iva",
+    "nombre_pasajero", "fecha", "factura", "estado", "origen_venta"
+})
+_PROVEDOR_FIELDS = frozenset({
+    "provedor_hotel_code", "provedor_razonsocial", "provedor_nombre", "provedor_identificacion",
+    "provedor_direccion", "provedor_telefono", "provedor_tipo", "provedor_estado",
+    "provedor_ciudad", "provedor_link_dropbox"
+})
+
+
+def _parse_payload(data: str, fields: frozenset, required: tuple = ()) -> dict:
+    """
+    Parsea el JSON de `data` y valida sus campos antes de enviarlo al servicio.
+    
+    Raises:
+        orjson.JSONDecodeError: Si `data` no es JSON válido
+        ValueError: Si no es un objeto, tiene campos desconocidos o faltan requeridos
+    """
+    return _validate_payload(_loads(data), fields, required)
+
+
+def _validate_payload(payload, fields: frozenset, required: tuple = ()) -> dict:
+    """
+    Valida que `payload` sea un objeto con campos conocidos y los requeridos presentes.
+    
+    Raises:
+        ValueError: Si no es un objeto, tiene campos desconocidos o faltan requeridos
+    """
+    if not isinstance(payload, dict):
+        raise ValueError("El JSON debe ser un objeto con los campos a enviar")
+    
+    unknown = payload.keys() - fields
+    if unknown:
+        raise ValueError(f"Campos desconocidos: {', '.join(sorted(unknown))}")
+    
+    missing = [field for field in required if payload.get(field) in (None, "")]
+    if missing:
+        raise ValueError(f"Campos requeridos faltantes: {', '.join(missing)}")
+    
+    return payload
+
+
+def _encode_cursor(last_id) -> str:
+    """Codifica el último ID visto como un cursor opaco (base64 URL-safe)."""
+    return base64.urlsafe_b64encode(orjson.dumps({"after_id": last_id})).decode()
+
+
+def _decode_cursor(cursor: str):
+    """Decodifica un cursor generado por `_encode_cursor` y retorna el último ID visto."""
+    try:
+        return orjson.loads(base64.urlsafe_b64decode(cursor.encode()))["after_id"]
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError(f"Cursor inválido: {cursor}") from e
+
+
+def _add_next_cursor(result, limit: int):
+    """
+    Agrega `next_cursor` a una respuesta paginada cuando puede haber más elementos.
+    
+    El ID del último elemento se toma de la llave `id` o, en su defecto, de la
+    primera llave con forma de ID (`id_*` o `*_id`).
+    """
+    items = result.get("items") if isinstance(result, dict) else None
+    if not items or len(items) < limit or not isinstance(items[-1], dict):
+        return result
+    
+    last = items[-1]
+    last_id = last.get("id")
+    if last_id is None:
+        last_id = next(
+            (value for key, value in last.items() if key.startswith("id_") or key.endswith("_id")),
+            None
+        )
+    if last_id is None:
+        return result
+    # Copia superficial: la respuesta puede estar compartida entre GETs coalescidos
+    return {**result, "next_cursor": _encode_cursor(last_id)}
+
+
+# Caché de estadísticas: los agregados cambian lentamente y los agentes los
+# consultan repetidamente al planificar; llave -> (expira_en, respuesta JSON)
+STATS_CACHE_TTL = 30.0
+_STATS_CACHE: dict = {}
+_STATS_LOCKS: dict = {}
+
+# Generación de las cachés de lectura: cada escritura la incrementa al vaciarlas. Una
+# lectura que empezó antes de la escritura puede traer datos previos a ella, así que
+# solo se guarda si la generación no cambió mientras estaba en curso
+_CACHE_GENERATION = 0
+
+
+async def _cached_stats(key: str, url: str) -> str:
+    """
+    Retorna las estadísticas de `url` cacheadas durante STATS_CACHE_TTL segundos.
+    
+    Un lock por llave agrupa las peticiones concurrentes que fallan la caché en
+    una sola llamada al servicio. Los errores no se cachean.
+    """
+    entry = _STATS_CACHE.get(key)
+    if entry is not None and entry[0] > time.monotonic():
+        return entry[1]
+    
+    lock = _STATS_LOCKS.setdefault(key, asyncio.Lock())
+    async with lock:
+        # Otra corrutina pudo haber llenado la caché mientras se esperaba el lock
+        entry = _STATS_CACHE.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            return entry[1]
+        
+        generation = _CACHE_GENERATION
+        try:
+            output = await _make_request("GET", url, raw=not PRETTY_JSON)
+        except ValueError as e:
+            return _dumps({"error": str(e)})
+        
+        if PRETTY_JSON:
+            output = _dumps(output)
+        if generation == _CACHE_GENERATION:
+            _STATS_CACHE[key] = (time.monotonic() + STATS_CACHE_TTL, output)
+        return output
+
+
+# Caché de lecturas (get/list): un agente suele repetir la misma consulta dentro de
+# una traza; se invalida completa con cualquier escritura. URL -> (expira_en, respuesta JSON)
+GET_CACHE_TTL = 60.0
+GET_CACHE_MAX_ENTRIES = 512
+_GET_CACHE: OrderedDict = OrderedDict()
+
+
+def _get_cached(url: str) -> Optional[str]:
+    """Retorna la respuesta cacheada de `url` si sigue vigente (y la marca como usada)."""
+    entry = _GET_CACHE.get(url)
+    if entry is None:
+        return None
+    if entry[0] <= time.monotonic():
+        del _GET_CACHE[url]
+        return None
+    _GET_CACHE.move_to_end(url)
+    return entry[1]
+
+
+def _set_cached(url: str, output: str, generation: int):
+    """
+    Guarda la respuesta de `url`, desalojando la menos usada si se supera el máximo.
+    
+    `generation` es el valor de _CACHE_GENERATION leído antes de la petición; si una
+    escritura la cambió mientras tanto, la respuesta puede estar obsoleta y no se guarda.
+    """
+    if generation != _CACHE_GENERATION:
+        return
+    _GET_CACHE[url] = (time.monotonic() + GET_CACHE_TTL, output)
+    _GET_CACHE.move_to_end(url)
+    while len(_GET_CACHE) > GET_CACHE_MAX_ENTRIES:
+        _GET_CACHE.popitem(last=False)
+
+
+# Peticiones GET en curso, por (url, params), compartidas entre llamadas concurrentes idénticas
+_INFLIGHT: dict = {}
+
+
+async def _make_request(method: str, url: str, raw: bool = False, **kwargs):
     """
     Realiza una petición HTTP a los servicios de GreenTravelBackend y retorna la respuesta como dict.
     
+    Los GET concurrentes idénticos (misma URL y parámetros) comparten una sola
+    petición al servicio; el resto de métodos se envían siempre.
+    
+    Args:
+        method: Método HTTP (GET, POST, PUT, DELETE)
+        url: URL completa del endpoint
+        raw: Si es True retorna el cuerpo JSON tal como llegó (str), sin parsearlo
+        **kwargs: Argumentos adicionales para httpx (json, params, etc.)
+    
+    Returns:
+        dict | str: Respuesta JSON parseada, o el texto JSON original si `raw`
+    
+    Raises:
+        ValueError: Si hay un error en la petición HTTP
+    """
+    if method != "GET":
+        return await _do_request(method, url, raw, **kwargs)
+    
+    params = kwargs.get("params")
+    key = (url, tuple(sorted(params.items())) if params else (), raw)
+    task = _INFLIGHT.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_do_request(method, url, raw, **kwargs))
+        _INFLIGHT[key] = task
+        task.add_done_callback(lambda _: _INFLIGHT.pop(key, None))
+    
+    # shield: si una de las llamadas se cancela, la petición sigue para las demás
+    return await asyncio.shield(task)
+
+
+# Límite de peticiones simultáneas por host (GREENTRAVEL_MAX_CONC), para que los
+# lotes de herramientas no saturen el pool de conexiones ni el servicio
+MAX_CONCURRENT_REQUESTS = int(os.getenv("GREENTRAVEL_MAX_CONC", "20"))
+_HOST_SEM: dict = {}
+
+
+def _host_semaphore(url: str) -> asyncio.Semaphore:
+    """Retorna el semáforo del host de `url` (límite de peticiones simultáneas por servicio)."""
+    host = urlsplit(url).netloc
+    sem = _HOST_SEM.get(host)
+    if sem is None:
+        sem = _HOST_SEM[host] = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    return sem
+
+
+# Errores transitorios del gateway NGINX / red que vale la pena reintentar
+_RETRYABLE_STATUS = frozenset({502, 503, 504})
+_SAFE_METHODS = frozenset({"GET", "HEAD"})
+
+
+def _is_transient(exc: BaseException) -> bool:
+    """Indica si el error HTTP es transitorio (timeout, conexión cortada, 502/503/504)."""
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code in _RETRYABLE_STATUS
+    return isinstance(exc, (httpx.TimeoutException, httpx.ConnectError, httpx.RemoteProtocolError))
+
+
+async def _send(method: str, url: str, **kwargs) -> httpx.Response:
+    """
+    Envía la petición con el cliente compartido, reintentando errores transitorios.
+    
+    Solo GET y HEAD se reintentan (hasta 3 intentos, espera ~100 ms y ~400 ms con
+    jitter); las escrituras se envían una sola vez para no duplicar efectos. Cada
+    intento viaja con la cabecera X-Request-Attempt para trazabilidad.
+    """
+    if method not in _SAFE_METHODS:
+        async with _host_semaphore(url):
+            return await _get_client().request(method, url, **kwargs)
+    
+    headers = dict(kwargs.pop("headers", None) or {})
+    retrying = AsyncRetrying(
+        stop=stop_after_attempt(3),
+        wait=wait_exponential_jitter(initial=0.1, max=1.6, exp_base=4, jitter=0.05),
+        retry=retry_if_exception(_is_transient),
+        reraise=True
+    )
+    async for attempt in retrying:
+        with attempt:
+            headers["X-Request-Attempt"] = str(attempt.retry_state.attempt_number)
+            async with _host_semaphore(url):
+                response = await _get_client().request(method, url, headers=headers, **kwargs)
+            if response.status_code in _RETRYABLE_STATUS:
+                response.raise_for_status()
+    return response
+
+
+async def _do_request(method: str, url: str, raw: bool = False, **kwargs):
+    """
+    Envía una petición HTTP con el cliente compartido y retorna la respuesta como dict.
+    
     Args:
         method: Método HTTP (GET, POST, PUT, DELETE)
         url: URL completa del endpoint
+        raw: Si es True retorna el cuerpo JSON tal como llegó (str), sin parsearlo
         **kwargs: Argumentos adicionales para httpx (json, params, etc.)
     
     Returns:
-        dict: Respuesta JSON parseada
+        dict | str: Respuesta JSON parseada, o el texto JSON original si `raw`
     
     Raises:
         ValueError: Si hay un error en la petición HTTP
     """
+    global _CACHE_GENERATION
     try:
-        async with httpx.AsyncClient(timeout=HTTP_TIMEOUT) as client:
-            response = await client.request(method, url, **kwargs)
-            
-            # Para DELETE, puede retornar 204 No Content
-            if response.status_code == 204:
-                return {"success": True, "message": "Operación completada exitosamente"}
-            
-            response.raise_for_status()
-            return response.json()
+        response = await _send(method, url, **kwargs)
+        
+        # Una escritura puede cambiar los datos y los agregados: invalidar las lecturas cacheadas
+        if method != "GET":
+            _CACHE_GENERATION += 1
+            _STATS_CACHE.clear()
+            _GET_CACHE.clear()
+        
+        # Para DELETE, puede retornar 204 No Content
+        if response.status_code == 204:
+            result = {"success": True, "message": "Operación completada exitosamente"}
+            return _dumps(result) if raw else result
+        
+        response.raise_for_status()
+        if raw:
+            # Paso directo: evita parsear y volver a serializar una respuesta que no se transforma
+            return response.content.decode()
+        # orjson parsea los bytes directamente, sin decodificar a str primero
+        return _loads(response.content)
             
     except httpx.HTTPStatusError as e:
         error_msg = f"Error HTTP {e.response.status_code}: {e.response.text}"
-        logger.error(f"{method} {url}: {error_msg}")
+        logger.error("%s %s: %s", method, url, error_msg)
         raise ValueError(error_msg)
     except httpx.TimeoutException as e:
         error_msg = f"Timeout al conectar con el servicio: {str(e)}"
-        logger.error(f"{method} {url}: {error_msg}")
+        logger.error("%s %s: %s", method, url, error_msg)
         raise ValueError(error_msg)
     except httpx.RequestError as e:
         error_msg = f"Error de conexión: {str(e)}"
-        logger.error(f"{method} {url}: {error_msg}")
+        logger.error("%s %s: %s", method, url, error_msg)
         raise ValueError(error_msg)
-    except Exception as e:
-        error_msg = f"Error inesperado: {str(e)}"
-        logger.error(f"{method} {url}: {error_msg}")
+    except orjson.JSONDecodeError as e:
+        error_msg = f"Respuesta JSON inválida del servicio: {str(e)}"
+        logger.error("%s %s: %s", method, url, error_msg)
         raise ValueError(error_msg)
 
 
+# ===============================================================================
+# OPERACIONES CRUD GENÉRICAS
+# ===============================================================================
+# Liquidaciones y proveedores exponen la misma API REST; las herramientas MCP
+# conservan su firma y docstring (lo que ve el LLM) y delegan en estas funciones.
+
+# Máximo de elementos por página que aceptan los servicios de listado
+MAX_PAGE_LIMIT = 100
+
+
+@lru_cache(maxsize=1024)
+def _build_list_url(base_url: str, query: tuple) -> str:
+    """Construye la URL final con query string; las combinaciones repetidas salen de la caché."""
+    return f"{base_url}?{urlencode(query)}"
+
+
+async def _crud_list(base_url: str, page: int, limit: int, cursor: Optional[str] = None, **filters) -> str:
+    """
+    Lista recursos paginados aplicando solo los filtros definidos.
+    
+    `page` y `limit` se ajustan a los rangos que acepta el servicio (page >= 1,
+    limit entre 1 y 100) y un `estado` distinto de 0/1 se rechaza localmente,
+    para no gastar una petición que el servicio respondería con error.
+    """
+    page = max(1, page)
+    limit = max(1, min(MAX_PAGE_LIMIT, limit))
+    if filters.get("estado") not in (None, 0, 1):
+        return _dumps({"error": f"estado inválido: {filters['estado']} (use 1=activo, 0=inactivo)"})
+    
+    params = {"page": page, "limit": limit} | {k: v for k, v in filters.items() if v is not None}
+    
+    try:
+        # Paginación por keyset: el servicio continúa después del último ID visto
+        if cursor:
+            del params["page"]
+            params["after_id"] = _decode_cursor(cursor)
+        
+        url = _build_list_url(base_url, tuple(params.items()))
+        output = _get_cached(url)
+        if output is None:
+            generation = _CACHE_GENERATION
+            result = await _make_request("GET", url)
+            output = _dumps(_add_next_cursor(result, limit))
+            _set_cached(url, output, generation)
+        return output
+    except ValueError as e:
+        return _dumps({"error": str(e)})
+
+
+def _total_pages(result, limit: int) -> int:
+    """Obtiene el número de páginas de una respuesta paginada (`total_pages`, `pages` o `total`)."""
+    if not isinstance(result, dict):
+        return 1
+    pages = result.get("total_pages") or result.get("pages")
+    if pages is None and result.get("total") is not None:
+        pages = -(-int(result["total"]) // limit)
+    return int(pages or 1)
+
+
+async def _crud_list_all(base_url: str, limit: int, max_pages: int, **filters) -> str:
+    """
+    Lista todas las páginas de un recurso: la primera en serie para conocer el total
+    y el resto en paralelo (acotado por el semáforo por host de `_send`).
+    """
+    limit = max(1, min(MAX_PAGE_LIMIT, limit))
+    if filters.get("estado") not in (None, 0, 1):
+        return _dumps({"error": f"estado inválido: {filters['estado']} (use 1=activo, 0=inactivo)"})
+    
+    filters = {k: v for k, v in filters.items() if v is not None}
+    
+    def page_url(page: int) -> str:
+        return _build_list_url(base_url, tuple(({"page": page, "limit": limit} | filters).items()))
+    
+    try:
+        first = await _make_request("GET", page_url(1))
+        items = list(first.get("items") or ()) if isinstance(first, dict) else []
+        total_pages = min(_total_pages(first, limit), max(1, max_pages))
+        
+        results = await asyncio.gather(
+            *(_make_request("GET", page_url(page)) for page in range(2, total_pages + 1)),
+            return_exceptions=True
+        )
+        errors = []
+        for page, result in enumerate(results, start=2):
+            if isinstance(result, Exception):
+                errors.append({"page": page, "error": str(result)})
+            elif isinstance(result, dict):
+                items.extend(result.get("items") or ())
+        
+        response = {"items": items, "total": len(items), "pages_fetched": total_pages}
+        if errors:
+            response["errors"] = errors
+        return _dumps(response)
+    except ValueError as e:
+        return _dumps({"error": str(e)})
+
+
+async def _crud_call(method: str, url: str) -> str:
+    """
+    Ejecuta una operación sin cuerpo (GET o DELETE de un recurso) y serializa el resultado.
+    
+    Los GET exitosos se cachean durante GET_CACHE_TTL segundos.
+    """
+    if method == "GET":
+        output = _get_cached(url)
+        if output is not None:
+            return output
+    generation = _CACHE_GENERATION
+    try:
+        # Sin formato legible la respuesta del servicio se retorna tal cual, sin re-serializar
+        if not PRETTY_JSON:
+            output = await _make_request(method, url, raw=True)
+        else:
+            output = _dumps(await _make_request(method, url))
+    except ValueError as e:
+        return _dumps({"error": str(e)})
+    
+    if method == "GET":
+        _set_cached(url, output, generation)
+    return output
+
+
+async def _crud_write(method: str, url: str, data: str, fields: frozenset, required: tuple = ()) -> str:
+    """Valida el JSON de `data` y lo envía con POST o PUT."""
+    try:
+        payload = _parse_payload(data, fields, required)
+        result = await _make_request(method, url, json=payload)
+        return _dumps(result)
+    except orjson.JSONDecodeError as e:
+        return _dumps({"error": f"JSON inválido: {str(e)}"})
+    except ValueError as e:
+        return _dumps({"error": str(e)})
+
+
 # ===============================================================================
 # HERRAMIENTAS MCP - LIQUIDACIONES
 # ===============================================================================
@@ -169,7 +671,8 @@ async def list_liquidaciones(
     search: Optional[str] = None,
     estado: Optional[int] = None,
     id_reserva: Optional[int] = None,
-    factura: Optional[int] = None
+    factura: Optional[int] = None,
+    cursor: Optional[str] = None
 ) -> str:
     """
     Lista liquidaciones con paginación y filtros opcionales.
@@ -181,30 +684,16 @@ async def list_liquidaciones(
         estado: Filtrar por estado (1=activo, 0=inactivo, opcional)
         id_reserva: Filtrar por ID de reserva (opcional)
         factura: Filtrar por número de factura (opcional)
+        cursor: Cursor `next_cursor` de una respuesta anterior para continuar desde el
+                último elemento visto, sin paginar por offset (opcional, reemplaza a `page`)
     
     Returns:
         str: JSON string con lista paginada de liquidaciones
     """
-    url = f"{LIQUIDACIONES_SERVICE_URL.rstrip('/')}/api/v1/liquidaciones"
-    params = {
-        "page": page,
-        "limit": limit
-    }
-    
-    if search:
-        params["search"] = search
-    if estado is not None:
-        params["estado"] = estado
-    if id_reserva is not None:
-        params["id_reserva"] = id_reserva
-    if factura is not None:
-        params["factura"] = factura
-    
-    try:
-        result = await _make_request("GET", url, params=params)
-        return json.dumps(result, ensure_ascii=False, indent=2)
-    except Exception as e:
-        return json.dumps({"error": str(e)}, ensure_ascii=False)
+    return await _crud_list(
+        LIQUIDACIONES_BASE, page, limit, cursor,
+        search=search or None, estado=estado, id_reserva=id_reserva, factura=factura
+    )
 
 
 @mcp.tool()
@@ -218,13 +707,7 @@ async def get_liquidacion(liquidacion_id: int) -> str:
     Returns:
         str: JSON string con los datos de la liquidación
     """
-    url = f"{LIQUIDACIONES_SERVICE_URL.rstrip('/')}/api/v1/liquidaciones/{liquidacion_id}"
-    
-    try:
-        result = await _make_request("GET", url)
-        return json.dumps(result, ensure_ascii=False, indent=2)
-    except Exception as e:
-        return json.dumps({"error": str(e)}, ensure_ascii=False)
+    return await _crud_call("GET", f"{LIQUIDACIONES_BASE}/{liquidacion_id}")
 
 
 @mcp.tool()
@@ -243,16 +726,7 @@ async def create_liquidacion(data: str) -> str:
     Returns:
         str: JSON string con la liquidación creada
     """
-    url = f"{LIQUIDACIONES_SERVICE_URL.rstrip('/')}/api/v1/liquidaciones"
-    
-    try:
-        payload = json.loads(data)
-        result = await _make_request("POST", url, json=payload)
-        return json.dumps(result, ensure_ascii=False, indent=2)
-    except json.JSONDecodeError as e:
-        return json.dumps({"error": f"JSON inválido: {str(e)}"}, ensure_ascii=False)
-    except Exception as e:
-        return json.dumps({"error": str(e)}, ensure_ascii=False)
+    return await _crud_write("POST", LIQUIDACIONES_BASE, data, _LIQUIDACION_FIELDS, required=("observaciones",))
 
 
 @mcp.tool()
@@ -267,16 +741,7 @@ async def update_liquidacion(liquidacion_id: int, data: str) -> str:
     Returns:
         str: JSON string con la liquidación actualizada
     """
-    url = f"{LIQUIDACIONES_SERVICE_URL.rstrip('/')}/api/v1/liquidaciones/{liquidacion_id}"
-    
-    try:
-        payload = json.loads(data)
-        result = await _make_request("PUT", url, json=payload)
-        return json.dumps(result, ensure_ascii=False, indent=2)
-    except json.JSONDecodeError as e:
-        return json.dumps({"error": f"JSON inválido: {str(e)}"}, ensure_ascii=False)
-    except Exception as e:
-        return json.dumps({"error": str(e)}, ensure_ascii=False)
+    return await _crud_write("PUT", f"{LIQUIDACIONES_BASE}/{liquidacion_id}", data, _LIQUIDACION_FIELDS)
 
 
 @mcp.tool()
@@ -290,13 +755,7 @@ async def delete_liquidacion(liquidacion_id: int) -> str:
     Returns:
         str: JSON string confirmando la eliminación
     """
-    url = f"{LIQUIDACIONES_SERVICE_URL.rstrip('/')}/api/v1/liquidaciones/{liquidacion_id}"
-    
-    try:
-        result = await _make_request("DELETE", url)
-        return json.dumps(result, ensure_ascii=False, indent=2)
-    except Exception as e:
-        return json.dumps({"error": str(e)}, ensure_ascii=False)
+    return await _crud_call("DELETE", f"{LIQUIDACIONES_BASE}/{liquidacion_id}")
 
 
 @mcp.tool()
@@ -307,13 +766,7 @@ async def get_liquidacion_stats() -> str:
     Returns:
         str: JSON string con estadísticas (total, activas, inactivas, por_estado)
     """
-    url = f"{LIQUIDACIONES_SERVICE_URL.rstrip('/')}/api/v1/liquidaciones/stats"
-    
-    try:
-        result = await _make_request("GET", url)
-        return json.dumps(result, ensure_ascii=False, indent=2)
-    except Exception as e:
-        return json.dumps({"error": str(e)}, ensure_ascii=False)
+    return await _cached_stats("liquidaciones", LIQUIDACIONES_STATS_URL)
 
 
 # ===============================================================================
@@ -327,7 +780,8 @@ async def list_provedores(
     search: Optional[str] = None,
     estado: Optional[int] = None,
     tipo: Optional[int] = None,
-    ciudad: Optional[int] = None
+    ciudad: Optional[int] = None,
+    cursor: Optional[str] = None
 ) -> str:
     """
     Lista proveedores con paginación y filtros opcionales.
@@ -339,30 +793,49 @@ async def list_provedores(
         estado: Filtrar por estado (1=activo, 0=inactivo, opcional)
         tipo: Filtrar por tipo de proveedor (opcional)
         ciudad: Filtrar por ID de ciudad (opcional)
+        cursor: Cursor `next_cursor` de una respuesta anterior para continuar desde el
+                último elemento visto, sin paginar por offset (opcional, reemplaza a `page`)
     
     Returns:
         str: JSON string con lista paginada de proveedores
     """
-    url = f"{PROVEDORES_SERVICE_URL.rstrip('/')}/api/v1/provedores"
-    params = {
-        "page": page,
-        "limit": limit
-    }
-    
-    if search:
-        params["search"] = search
-    if estado is not None:
-        params["estado"] = estado
-    if tipo is not None:
-        params["tipo"] = tipo
-    if ciudad is not None:
-        params["ciudad"] = ciudad
+    return await _crud_list(
+        PROVEDORES_BASE, page, limit, cursor,
+        search=search or None, estado=estado, tipo=tipo, ciudad=ciudad
+    )
+
+
+@mcp.tool()
+async def list_all_provedores(
+    limit_per_page: int = 100,
+    max_pages: int = 20,
+    search: Optional[str] = None,
+    estado: Optional[int] = None,
+    tipo: Optional[int] = None,
+    ciudad: Optional[int] = None
+) -> str:
+    """
+    Lista todos los proveedores que cumplen los filtros, recorriendo todas las páginas.
     
-    try:
-        result = await _make_request("GET", url, params=params)
-        return json.dumps(result, ensure_ascii=False, indent=2)
-    except Exception as e:
-        return json.dumps({"error": str(e)}, ensure_ascii=False)
+    La primera página se consulta para conocer el total y las demás se piden en
+    paralelo, en lugar de llamar `list_provedores` una vez por página.
+    
+    Args:
+        limit_per_page: Elementos por página solicitada (1-100, default: 100)
+        max_pages: Máximo de páginas a consultar (default: 20)
+        search: Término de búsqueda en nombre, razón social, identificación (opcional)
+        estado: Filtrar por estado (1=activo, 0=inactivo, opcional)
+        tipo: Filtrar por tipo de proveedor (opcional)
+        ciudad: Filtrar por ID de ciudad (opcional)
+    
+    Returns:
+        str: JSON string con `items` (todos los proveedores), `total` y `pages_fetched`;
+             las páginas que fallen se reportan en `errors`
+    """
+    return await _crud_list_all(
+        PROVEDORES_BASE, limit_per_page, max_pages,
+        search=search or None, estado=estado, tipo=tipo, ciudad=ciudad
+    )
 
 
 @mcp.tool()
@@ -376,13 +849,31 @@ async def get_provedor(provedor_id: int) -> str:
     Returns:
         str: JSON string con los datos del proveedor
     """
-    url = f"{PROVEDORES_SERVICE_URL.rstrip('/')}/api/v1/provedores/{provedor_id}"
+    return await _crud_call("GET", f"{PROVEDORES_BASE}/{provedor_id}")
+
+
+@mcp.tool()
+async def batch_get_provedores(provedor_ids: list[int]) -> str:
+    """
+    Obtiene varios proveedores por su ID en una sola llamada.
     
-    try:
-        result = await _make_request("GET", url)
-        return json.dumps(result, ensure_ascii=False, indent=2)
-    except Exception as e:
-        return json.dumps({"error": str(e)}, ensure_ascii=False)
+    Las peticiones se hacen en paralelo, limitadas por MAX_CONCURRENT_REQUESTS por host.
+    
+    Args:
+        provedor_ids: Lista de IDs únicos de proveedores
+    
+    Returns:
+        str: JSON string con una lista de proveedores en el mismo orden de `provedor_ids`;
+             los que fallen se reportan como {"provedor_id": id, "error": "..."}
+    """
+    results = await asyncio.gather(
+        *(_make_request("GET", f"{PROVEDORES_BASE}/{provedor_id}") for provedor_id in provedor_ids),
+        return_exceptions=True
+    )
+    return _dumps([
+        {"provedor_id": provedor_id, "error": str(result)} if isinstance(result, Exception) else result
+        for provedor_id, result in zip(provedor_ids, results)
+    ])
 
 
 @mcp.tool()
@@ -399,16 +890,51 @@ async def create_provedor(data: str) -> str:
     Returns:
         str: JSON string con el proveedor creado
     """
-    url = f"{PROVEDORES_SERVICE_URL.rstrip('/')}/api/v1/provedores"
+    return await _crud_write("POST", PROVEDORES_BASE, data, _PROVEDOR_FIELDS)
+
+
+@mcp.tool()
+async def create_provedores_bulk(data: str) -> str:
+    """
+    Crea varios proveedores en una sola llamada.
+    
+    Los proveedores se validan localmente y se crean en paralelo, limitados por
+    MAX_CONCURRENT_REQUESTS por host.
     
+    Args:
+        data: JSON string con una lista de objetos, cada uno con los mismos campos
+              que acepta `create_provedor`
+    
+    Returns:
+        str: JSON string con `created` (proveedores creados) y `errors`
+             (lista de {"index": posición en la lista, "error": "..."})
+    """
     try:
-        payload = json.loads(data)
-        result = await _make_request("POST", url, json=payload)
-        return json.dumps(result, ensure_ascii=False, indent=2)
-    except json.JSONDecodeError as e:
-        return json.dumps({"error": f"JSON inválido: {str(e)}"}, ensure_ascii=False)
-    except Exception as e:
-        return json.dumps({"error": str(e)}, ensure_ascii=False)
+        items = _loads(data)
+    except orjson.JSONDecodeError as e:
+        return _dumps({"error": f"JSON inválido: {str(e)}"})
+    if not isinstance(items, list):
+        return _dumps({"error": "El JSON debe ser una lista de proveedores"})
+    
+    created, errors, valid = [], [], []
+    for index, item in enumerate(items):
+        try:
+            valid.append((index, _validate_payload(item, _PROVEDOR_FIELDS)))
+        except ValueError as e:
+            errors.append({"index": index, "error": str(e)})
+    
+    results = await asyncio.gather(
+        *(_make_request("POST", PROVEDORES_BASE, json=payload) for _, payload in valid),
+        return_exceptions=True
+    )
+    for (index, _), result in zip(valid, results):
+        if isinstance(result, Exception):
+            errors.append({"index": index, "error": str(result)})
+        else:
+            created.append(result)
+    
+    errors.sort(key=lambda error: error["index"])
+    return _dumps({"created": created, "errors": errors})
 
 
 @mcp.tool()
@@ -423,16 +949,7 @@ async def update_provedor(provedor_id: int, data: str) -> str:
     Returns:
         str: JSON string con el proveedor actualizado
     """
-    url = f"{PROVEDORES_SERVICE_URL.rstrip('/')}/api/v1/provedores/{provedor_id}"
-    
-    try:
-        payload = json.loads(data)
-        result = await _make_request("PUT", url, json=payload)
-        return json.dumps(result, ensure_ascii=False, indent=2)
-    except json.JSONDecodeError as e:
-        return json.dumps({"error": f"JSON inválido: {str(e)}"}, ensure_ascii=False)
-    except Exception as e:
-        return json.dumps({"error": str(e)}, ensure_ascii=False)
+    return await _crud_write("PUT", f"{PROVEDORES_BASE}/{provedor_id}", data, _PROVEDOR_FIELDS)
 
 
 @mcp.tool()
@@ -446,13 +963,34 @@ async def delete_provedor(provedor_id: int) -> str:
     Returns:
         str: JSON string confirmando la eliminación
     """
-    url = f"{PROVEDORES_SERVICE_URL.rstrip('/')}/api/v1/provedores/{provedor_id}"
+    return await _crud_call("DELETE", f"{PROVEDORES_BASE}/{provedor_id}")
+
+
+@mcp.tool()
+async def delete_provedores_bulk(provedor_ids: list[int]) -> str:
+    """
+    Elimina varios proveedores (soft delete) en una sola llamada.
     
-    try:
-        result = await _make_request("DELETE", url)
-        return json.dumps(result, ensure_ascii=False, indent=2)
-    except Exception as e:
-        return json.dumps({"error": str(e)}, ensure_ascii=False)
+    Las eliminaciones se hacen en paralelo, limitadas por MAX_CONCURRENT_REQUESTS por host.
+    
+    Args:
+        provedor_ids: Lista de IDs únicos de proveedores a eliminar
+    
+    Returns:
+        str: JSON string con `deleted` (IDs eliminados) y `errors`
+             (lista de {"provedor_id": id, "error": "..."})
+    """
+    results = await asyncio.gather(
+        *(_make_request("DELETE", f"{PROVEDORES_BASE}/{provedor_id}") for provedor_id in provedor_ids),
+        return_exceptions=True
+    )
+    deleted, errors = [], []
+    for provedor_id, result in zip(provedor_ids, results):
+        if isinstance(result, Exception):
+            errors.append({"provedor_id": provedor_id, "error": str(result)})
+        else:
+            deleted.append(provedor_id)
+    return _dumps({"deleted": deleted, "errors": errors})
 
 
 @mcp.tool()
@@ -463,19 +1001,109 @@ async def get_provedor_stats() -> str:
     Returns:
         str: JSON string con estadísticas (total, activos, inactivos, por_estado, por_tipo)
     """
-    url = f"{PROVEDORES_SERVICE_URL.rstrip('/')}/api/v1/provedores/stats"
-    
-    try:
-        result = await _make_request("GET", url)
-        return json.dumps(result, ensure_ascii=False, indent=2)
-    except Exception as e:
-        return json.dumps({"error": str(e)}, ensure_ascii=False)
+    return await _cached_stats("provedores", PROVEDORES_STATS_URL)
 
 
 # ===============================================================================
 # HERRAMIENTAS MCP - FACTURAS
 # ===============================================================================
 
+def _build_invoice_query(invoice_number: Optional[str] = None, cufe: Optional[str] = None, provider_nit: Optional[str] = None) -> str:
+    """
+    Construye la pregunta para el RAG a partir de los identificadores de la factura.
+    """
+    parts = tuple(
+        template.format(value)
+        for value, template in (
+            (invoice_number, "factura número {}"),
+            (cufe, "CUFE {}"),
+            (provider_nit, "proveedor NIT {}")
+        )
+        if value
+    )
+    return "Dame toda la información de la factura" + (f" con {' y '.join(parts)}" if parts else "")
+
+
+# Consultas al RAG en curso, por (pregunta, exacta), compartidas entre llamadas concurrentes idénticas
+_RAG_INFLIGHT: dict = {}
+
+
+async def _fetch_invoice_text(query: str, exact: bool = False) -> str:
+    """
+    Retorna el texto de la factura para `query`: primero la caché semántica, luego
+    una consulta idéntica ya en curso y, si no hay ninguna, una nueva petición al RAG.
+    
+    `exact` indica que la consulta incluye un número de factura o CUFE, en cuyo caso
+    se omiten el reranking y la reescritura de la consulta.
+    """
+    cached = RAG_CACHE.get(query)
+    if cached is not None:
+        logger.info("[RAG_GET_INVOICE_DATA] Respuesta obtenida de la caché")
+        return cached
+    
+    key = (query, exact)
+    task = _RAG_INFLIGHT.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_request_invoice_text(query, exact))
+        _RAG_INFLIGHT[key] = task
+        task.add_done_callback(lambda _: _RAG_INFLIGHT.pop(key, None))
+    
+    # shield: si una de las llamadas se cancela, la consulta sigue para las demás
+    return await asyncio.shield(task)
+
+
+async def _request_invoice_text(query: str, exact: bool) -> str:
+    """Consulta el endpoint /api/v1/ask del RAG; los errores se retornan como texto que inicia con "Error"."""
+    payload = (_RAG_PAYLOAD_EXACT if exact else _RAG_PAYLOAD_TEMPLATE) | {"question": query}
+    
+    try:
+        response = await _get_client().post(RAG_ASK_URL, json=payload)
+        response.raise_for_status()
+        result = _loads(response.content)
+        
+        invoice_text = result.get("answer") if isinstance(result, dict) else None
+        if invoice_text is None:
+            return "Error: La respuesta del RAG no contiene el campo 'answer'"
+        
+        logger.info("[RAG_GET_INVOICE_DATA] Texto obtenido del RAG (%s caracteres)", len(invoice_text))
+        RAG_CACHE.set(query, invoice_text)
+        
+        return invoice_text
+            
+    except httpx.HTTPError as e:
+        error_msg = f"Error HTTP consultando RAG: {str(e)}"
+        logger.error("[RAG_GET_INVOICE_DATA] %s", error_msg)
+        return error_msg
+    except Exception as e:
+        error_msg = f"Error obteniendo datos de factura desde RAG: {str(e)}"
+        logger.error("[RAG_GET_INVOICE_DATA] %s", error_msg)
+        return error_msg
+
+
+async def _fetch_invoice_direct(invoice_number: str) -> Optional[str]:
+    """
+    Busca la factura por número exacto en INVOICES_SERVICE_URL.
+    
+    Returns:
+        str | None: JSON de la factura, o None si el servicio no está configurado,
+                    no la encuentra o falla (en ese caso se consulta el RAG)
+    """
+    if not INVOICES_SERVICE_URL:
+        return None
+    
+    url = f"{INVOICES_SERVICE_URL}/invoices/{quote(invoice_number, safe='')}"
+    try:
+        response = await _send("GET", url)
+    except httpx.HTTPError as e:
+        logger.warning("[RAG_GET_INVOICE_DATA] Servicio de facturas no disponible, se usa el RAG: %s", e)
+        return None
+    if response.status_code != 200:
+        return None
+    
+    logger.info("[RAG_GET_INVOICE_DATA] Factura %s obtenida del servicio de facturas", invoice_number)
+    return response.content.decode()
+
+
 @mcp.tool()
 async def rag_get_invoice_data(
     invoice_number: Optional[str] = None,
@@ -505,57 +1133,37 @@ async def rag_get_invoice_data(
         str: Texto completo de la factura obtenido del RAG con todos los detalles (número, CUFE, proveedor, cliente, fecha, total, items, etc.)
     """
     # Construir query para RAG
-    query_parts = []
-    if invoice_number:
-        query_parts.append(f"factura número {invoice_number}")
-    if cufe:
-        query_parts.append(f"CUFE {cufe}")
-    if provider_nit:
-        query_parts.append(f"proveedor NIT {provider_nit}")
-    
-    if not query_parts:
-        query = "Dame toda la información de la factura"
-    else:
-        query = f"Dame toda la información de la factura con {' y '.join(query_parts)}"
-    
-    rag_url = f"{RAG_BASE_URL.rstrip('/')}/api/v1/ask"
-    
-    # Configuración del RAG
-    rag_collection = "semana3_test_collection"
-    rag_top_k = 5
-    rag_use_reranking = True
-    rag_use_query_rewriting = True
-    
-    payload = {
-        "question": query,
-        "top_k": rag_top_k,
-        "collection": rag_collection,
-        "use_reranking": rag_use_reranking,
-        "use_query_rewriting": rag_use_query_rewriting
-    }
+    # Camino directo: el caso más común (solo número de factura) no necesita el RAG
+    if invoice_number and not cufe and not provider_nit:
+        invoice_json = await _fetch_invoice_direct(invoice_number)
+        if invoice_json is not None:
+            return invoice_json
     
+    query = _build_invoice_query(invoice_number, cufe, provider_nit)
+    return await _fetch_invoice_text(query, exact=bool(invoice_number or cufe))
+
+
+# Formatos de fecha aceptados: YYYY-MM-DD, YYYY/MM/DD, DD-MM-YYYY y DD/MM/YYYY
+# (el separador debe ser el mismo en toda la fecha). Una sola expresión regular
+# reemplaza los intentos sucesivos con strptime, que lanzaban una excepción por formato fallido.
+_FECHA_YMD_RE = re.compile(r"(\d{4})([-/])(\d{1,2})\2(\d{1,2})")
+_FECHA_DMY_RE = re.compile(r"(\d{1,2})([-/])(\d{1,2})\2(\d{4})")
+
+
+def _parse_fecha(fecha_texto: str) -> Optional[date]:
+    """Convierte la fecha de emisión a `date`, o retorna None si no tiene un formato aceptado."""
+    fecha_texto = fecha_texto.strip()
     try:
-        async with httpx.AsyncClient(timeout=HTTP_TIMEOUT) as client:
-            response = await client.post(rag_url, json=payload)
-            response.raise_for_status()
-            result = response.json()
-            
-            if "answer" not in result:
-                return "Error: La respuesta del RAG no contiene el campo 'answer'"
-            
-            invoice_text = result["answer"]
-            logger.info(f"[RAG_GET_INVOICE_DATA] Texto obtenido del RAG ({len(invoice_text)} caracteres)")
-            
-            return invoice_text
-                
-    except httpx.HTTPError as e:
-        error_msg = f"Error HTTP consultando RAG: {str(e)}"
-        logger.error(f"[RAG_GET_INVOICE_DATA] {error_msg}")
-        return error_msg
-    except Exception as e:
-        error_msg = f"Error obteniendo datos de factura desde RAG: {str(e)}"
-        logger.error(f"[RAG_GET_INVOICE_DATA] {error_msg}")
-        return error_msg
+        match = _FECHA_YMD_RE.fullmatch(fecha_texto)
+        if match:
+            return date(int(match[1]), int(match[3]), int(match[4]))
+        match = _FECHA_DMY_RE.fullmatch(fecha_texto)
+        if match:
+            return date(int(match[4]), int(match[3]), int(match[1]))
+    except ValueError:
+        # Día o mes fuera de rango (ej: 2025-02-30)
+        return None
+    return None
 
 
 @mcp.tool()
@@ -578,29 +1186,13 @@ async def calcular_vencimiento(fecha_emision: str, dias_credito: int) -> str:
             - error (si aplica): Mensaje de error si hubo algún problema
     """
     try:
-        fecha_emision_dt = None
-        
-        # Intentar diferentes formatos de fecha
-        formatos_fecha = [
-            "%Y-%m-%d",      # YYYY-MM-DD (formato preferido)
-            "%d-%m-%Y",      # DD-MM-YYYY
-            "%d/%m/%Y",      # DD/MM/YYYY
-            "%Y/%m/%d",      # YYYY/MM/DD
-        ]
-        
-        for formato in formatos_fecha:
-            try:
-                fecha_emision_dt = datetime.strptime(fecha_emision.strip(), formato).date()
-                break
-            except ValueError:
-                continue
-        
+        fecha_emision_dt = _parse_fecha(fecha_emision)
         if fecha_emision_dt is None:
             raise ValueError(f"No se pudo parsear la fecha '{fecha_emision}'. Use formato YYYY-MM-DD (ej: 2025-10-03)")
         
         dias_credito = int(dias_credito)
         fecha_vencimiento = fecha_emision_dt + timedelta(days=dias_credito)
-        hoy = datetime.now().date()
+        hoy = date.today()
         
         dias_restantes = (fecha_vencimiento - hoy).days
         vencida = dias_restantes < 0
@@ -619,10 +1211,10 @@ async def calcular_vencimiento(fecha_emision: str, dias_credito: int) -> str:
             "error": None
         }
         
-        return json.dumps(result, ensure_ascii=False, indent=2)
+        return _dumps(result)
         
     except Exception as e:
-        logger.error(f"[CALCULAR_VENCIMIENTO] Error: {e}")
+        logger.error("[CALCULAR_VENCIMIENTO] Error: %s", e)
         error_result = {
             "fecha_emision": fecha_emision,
             "fecha_vencimiento": None,
@@ -631,8 +1223,14 @@ async def calcular_vencimiento(fecha_emision: str, dias_credito: int) -> str:
             "mensaje": f"Hubo un error al intentar calcular la fecha de vencimiento: {e}",
             "error": str(e)
         }
-        return json.dumps(error_result, ensure_ascii=False, indent=2)
+        return _dumps(error_result)
 
 
 if __name__ == "__main__":
+    # uvloop (si está instalado) reemplaza el bucle de eventos por defecto; no existe en Windows
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass
     mcp.run(transport="stdio")
@@ -18,7 +18,6 @@ from langchain_google_genai import ChatGoogleGenerativeAI
 import logging
 
 
-logging.basicConfig(level = logging.INFO, format = "%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
 
@@ -14,10 +14,17 @@ IMPLEMENTACIÓN SEMANA 6:
 """
 
 from mcp.server.fastmcp import FastMCP
+import asyncio
 import logging
 import httpx
+import orjson
 import os
 import sys
+from typing import Optional
+from contextlib import asynccontextmanager
+from importlib.util import find_spec
+# El servidor se ejecuta como script (uv run), por lo que los módulos hermanos se importan directamente
+from semantic_cache import SemanticCache
 
 
 # Configurar logging con UTF-8
@@ -39,7 +46,47 @@ for handler in logging.root.handlers:
 
 logger = logging.getLogger(__name__)
 
-mcp = FastMCP("rag-server")
+# Cliente HTTP compartido: se crea en el primer uso y se cierra al terminar el servidor
+_CLIENT: Optional[httpx.AsyncClient] = None
+
+# HTTP/2 solo si el paquete h2 está disponible (httpx[http2])
+# find_spec comprueba la instalación sin importar el paquete (httpcore lo carga al abrir la primera conexión)
+HTTP2_ENABLED = find_spec("h2") is not None
+
+# Brotli reduce el tamaño de las respuestas JSON; solo se anuncia si se puede decodificar
+ACCEPT_ENCODING = "br, gzip" if find_spec("brotli") is not None else "gzip"
+
+
+def _get_client() -> httpx.AsyncClient:
+    """
+    Retorna el cliente HTTP compartido, creándolo en el primer uso.
+    
+    Reutilizar el cliente evita un handshake TCP/TLS por cada consulta al RAG.
+    """
+    global _CLIENT
+    if _CLIENT is None or _CLIENT.is_closed:
+        _CLIENT = httpx.AsyncClient(
+            timeout=30.0,
+            http2=HTTP2_ENABLED,
+            headers={"Accept-Encoding": ACCEPT_ENCODING},
+            limits=httpx.Limits(max_keepalive_connections=20, max_connections=100)
+        )
+    return _CLIENT
+
+
+@asynccontextmanager
+async def _lifespan(server):
+    """Cierra el cliente HTTP compartido cuando el servidor MCP termina."""
+    global _CLIENT
+    try:
+        yield
+    finally:
+        if _CLIENT is not None:
+            await _CLIENT.aclose()
+            _CLIENT = None
+
+
+mcp = FastMCP("rag-server", lifespan=_lifespan)
 
 
 # ===============================================================================
@@ -52,6 +99,25 @@ rag_top_k = 5
 rag_use_reranking = True
 rag_use_query_rewriting = True
 
+# URL y payload precalculados: la configuración no cambia durante la vida del servidor.
+# El endpoint del RAG es /api/v1/ask según la documentación
+RAG_BASE_URL = os.getenv("RAG_BASE_URL", "http://34.63.203.124")
+RAG_ASK_URL = f"{RAG_BASE_URL.rstrip('/')}/api/v1/ask"
+_RAG_PAYLOAD_TEMPLATE = {
+    "top_k": rag_top_k,
+    "collection": rag_collection,
+    "use_reranking": rag_use_reranking,
+    "use_query_rewriting": rag_use_query_rewriting
+}
+
+# Caché de respuestas para preguntas idénticas (tras normalizar mayúsculas y espacios).
+# Las preguntas son texto libre: "con IVA" y "sin IVA" son casi idénticas pero no
+# tienen la misma respuesta, así que `ask` no usa la capa de coincidencia aproximada
+RAG_CACHE = SemanticCache(max_entries=1024, ttl_seconds=900.0)
+
+# Consultas al RAG en curso, por pregunta, compartidas entre llamadas concurrentes idénticas
+_INFLIGHT: dict = {}
+
 
 @mcp.tool()
 async def ask(query: str) -> str:
@@ -72,46 +138,54 @@ async def ask(query: str) -> str:
         httpx.HTTPError: Si hay un error en la conexión HTTP
         httpx.TimeoutException: Si la petición excede el timeout
     """
-    # Obtener la URL base del RAG desde variables de entorno o usar valor por defecto
-    rag_base_url = os.getenv("RAG_BASE_URL", "http://34.63.203.124")
-    if not rag_base_url:
+    if not RAG_BASE_URL:
         error_msg = "RAG_BASE_URL no está configurado en las variables de entorno"
         logger.error(error_msg)
         raise ValueError(error_msg)
     
-    # Construir la URL completa del endpoint
-    # El endpoint del RAG es /api/v1/ask según la documentación
-    rag_url = f"{rag_base_url.rstrip('/')}/api/v1/ask"
+    cached = RAG_CACHE.get(query, approximate=False)
+    if cached is not None:
+        logger.info("Respuesta del RAG obtenida de la caché")
+        return cached
+    
+    # Una pregunta idéntica ya en curso se comparte en lugar de repetir la petición
+    task = _INFLIGHT.get(query)
+    if task is None:
+        task = asyncio.ensure_future(_query_rag(query))
+        _INFLIGHT[query] = task
+        task.add_done_callback(lambda _: _INFLIGHT.pop(query, None))
     
+    # shield: si una de las llamadas se cancela, la consulta sigue para las demás
+    return await asyncio.shield(task)
+
+
+async def _query_rag(query: str) -> str:
+    """Envía la pregunta al RAG y retorna el campo 'answer' (ver `ask`)."""
     # Preparar el payload de la petición
-    payload = {
-        "question": query,
-        "top_k": rag_top_k,
-        "collection": rag_collection,
-        "use_reranking": rag_use_reranking,
-        "use_query_rewriting": rag_use_query_rewriting
-    }
+    payload = _RAG_PAYLOAD_TEMPLATE | {"question": query}
     
-    logger.info(f"Consultando RAG en {rag_url} con pregunta: {query[:50]}...")
+    logger.info("Consultando RAG en %s con pregunta: %s...", RAG_ASK_URL, query[:50])
     
     try:
         # Realizar la petición POST al sistema RAG
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(rag_url, json=payload)
-            response.raise_for_status()
-            
-            # Extraer la respuesta JSON
-            result = response.json()
-            
-            # Extraer el campo 'answer' de la respuesta
-            if "answer" not in result:
-                error_msg = f"La respuesta del RAG no contiene el campo 'answer'. Respuesta: {result}"
-                logger.error(error_msg)
-                raise ValueError(error_msg)
-            
-            answer = result["answer"]
-            logger.info(f"Respuesta del RAG recuperada exitosamente ({len(answer)} caracteres)")
-            return answer
+        response = await _get_client().post(RAG_ASK_URL, json=payload)
+        response.raise_for_status()
+        
+        # Extraer la respuesta JSON (orjson parsea los bytes directamente, sin decodificar a str)
+        result = orjson.loads(response.content)
+        
+        # Extraer el campo 'answer' de la respuesta
+        answer = result.get("answer") if isinstance(result, dict) else None
+        if answer is None:
+            # Solo las llaves: la respuesta completa puede incluir todos los fragmentos recuperados
+            keys = sorted(result) if isinstance(result, dict) else type(result).__name__
+            error_msg = f"La respuesta del RAG no contiene el campo 'answer'. Campos recibidos: {keys}"
+            logger.error(error_msg)
+            raise ValueError(error_msg)
+        
+        logger.info("Respuesta del RAG recuperada exitosamente (%s caracteres)", len(answer))
+        RAG_CACHE.set(query, answer)
+        return answer
             
     except httpx.TimeoutException as e:
         error_msg = f"Timeout al consultar el sistema RAG: {str(e)}"
@@ -128,4 +202,10 @@ async def ask(query: str) -> str:
 
 
 if __name__ == "__main__":
+    # uvloop (si está instalado) reemplaza el bucle de eventos por defecto; no existe en Windows
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass
     mcp.run(transport="stdio")
\ No newline at end of file
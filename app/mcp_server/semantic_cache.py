@@ -0,0 +1,206 @@
+"""
+Caché Semántica para Consultas al RAG
+======================================
+
+Este módulo implementa una caché en memoria para las respuestas del sistema RAG,
+de modo que consultas idénticas o casi idénticas ("dame la factura HBE122090"
+vs "info de la factura HBE122090") se respondan sin repetir la llamada HTTP,
+el reranking y la generación del backend RAG.
+
+FUNCIONAMIENTO:
+- Capa exacta: diccionario indexado por la consulta normalizada
+  (minúsculas, espacios colapsados)
+- Capa aproximada: MinHash sobre shingles de caracteres con LSH por bandas
+  para encontrar candidatos similares sin comparar contra toda la caché
+- Los identificadores (tokens con dígitos: números de factura, CUFE, NIT)
+  deben coincidir exactamente; así dos facturas distintas nunca comparten respuesta
+- Expiración deslizante (TTL) y desalojo LRU por número de entradas
+- Con approximate=False solo se usa la capa exacta (sin calcular firmas MinHash)
+"""
+
+from collections import OrderedDict
+from typing import Optional
+import hashlib
+import re
+import time
+
+
+_WHITESPACE_RE = re.compile(r"\s+")
+_TOKEN_RE = re.compile(r"[\w-]+")
+
+# Primo de Mersenne 2^61 - 1 para las permutaciones universales de MinHash
+_MERSENNE_PRIME = (1 << 61) - 1
+
+
+def _normalize(query: str) -> str:
+    """Normaliza la consulta: minúsculas y espacios colapsados."""
+    return _WHITESPACE_RE.sub(" ", query.strip().lower())
+
+
+def _identifiers(normalized: str) -> tuple:
+    """Extrae los tokens con dígitos (identificadores) ordenados."""
+    return tuple(sorted(
+        token for token in _TOKEN_RE.findall(normalized)
+        if any(map(str.isdigit, token))
+    ))
+
+
+class SemanticCache:
+    """
+    Caché de respuestas del RAG con coincidencia exacta y aproximada (MinHash LSH).
+
+    Args:
+        max_entries: Número máximo de respuestas almacenadas (LRU)
+        ttl_seconds: Tiempo de vida de cada entrada; se renueva en cada acierto
+        threshold: Similitud de Jaccard estimada mínima para aceptar un candidato
+        num_perm: Número de permutaciones de MinHash (debe ser múltiplo de bands)
+        bands: Número de bandas LSH
+        shingle_size: Tamaño de los shingles de caracteres
+        approximate: Si es False la caché solo resuelve coincidencias exactas y no
+                     calcula firmas MinHash al guardar
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 256,
+        ttl_seconds: float = 900.0,
+        threshold: float = 0.8,
+        num_perm: int = 64,
+        bands: int = 16,
+        shingle_size: int = 4,
+        approximate: bool = True
+    ):
+        if num_perm % bands:
+            raise ValueError("num_perm debe ser múltiplo de bands")
+
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.approximate = approximate
+
+        # Coeficientes deterministas (a, b) para cada permutación
+        self._perms = [
+            (
+                int.from_bytes(hashlib.blake2b(f"a{i}".encode(), digest_size=8).digest(), "big") % _MERSENNE_PRIME or 1,
+                int.from_bytes(hashlib.blake2b(f"b{i}".encode(), digest_size=8).digest(), "big") % _MERSENNE_PRIME
+            )
+            for i in range(num_perm)
+        ]
+
+        # llave normalizada -> (respuesta, expira_en, identificadores, firma)
+        self._entries = OrderedDict()
+        # (banda, hash de banda) -> conjunto de llaves normalizadas
+        self._buckets = {}
+
+    def _signature(self, normalized: str) -> tuple:
+        """Calcula la firma MinHash de la consulta normalizada."""
+        size = self.shingle_size
+        shingles = {normalized[i:i + size] for i in range(max(1, len(normalized) - size + 1))}
+        hashes = [
+            int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=8).digest(), "big")
+            for shingle in shingles
+        ]
+        return tuple(
+            min((a * h + b) % _MERSENNE_PRIME for h in hashes)
+            for a, b in self._perms
+        )
+
+    def _band_keys(self, signature: tuple):
+        """Genera las llaves de bucket LSH para cada banda de la firma."""
+        rows = self.rows
+        for band in range(self.bands):
+            yield band, hash(signature[band * rows:(band + 1) * rows])
+
+    def _remove(self, key: str):
+        """Elimina una entrada y sus referencias en los buckets LSH."""
+        entry = self._entries.pop(key, None)
+        if entry is None or entry[3] is None:
+            return
+        for band_key in self._band_keys(entry[3]):
+            bucket = self._buckets.get(band_key)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[band_key]
+
+    def _touch(self, key: str, now: float) -> Optional[str]:
+        """Retorna la respuesta de una entrada vigente y renueva su expiración."""
+        answer, expires_at, identifiers, signature = self._entries[key]
+        if expires_at < now:
+            self._remove(key)
+            return None
+        self._entries[key] = (answer, now + self.ttl_seconds, identifiers, signature)
+        self._entries.move_to_end(key)
+        return answer
+
+    def get(self, query: str, approximate: bool = True) -> Optional[str]:
+        """
+        Busca una respuesta para la consulta (exacta o semánticamente similar).
+
+        Args:
+            query: Consulta a buscar
+            approximate: Si es False solo se aceptan coincidencias exactas de la
+                         consulta normalizada (para preguntas libres, donde una
+                         palabra distinta puede cambiar la respuesta)
+
+        Returns:
+            str: La respuesta almacenada, o None si no hay coincidencia vigente
+        """
+        now = time.monotonic()
+        normalized = _normalize(query)
+
+        if normalized in self._entries:
+            return self._touch(normalized, now)
+        if not (approximate and self.approximate):
+            return None
+
+        identifiers = _identifiers(normalized)
+        signature = self._signature(normalized)
+
+        # Candidatos que comparten al menos una banda LSH
+        candidates = set()
+        for band_key in self._band_keys(signature):
+            candidates.update(self._buckets.get(band_key, ()))
+
+        best_key, best_score = None, self.threshold
+        for key in candidates:
+            _, _, candidate_ids, candidate_sig = self._entries[key]
+            if candidate_ids != identifiers:
+                continue
+            score = sum(x == y for x, y in zip(signature, candidate_sig)) / self.num_perm
+            if score >= best_score:
+                best_key, best_score = key, score
+
+        if best_key is None:
+            return None
+        return self._touch(best_key, now)
+
+    def set(self, query: str, answer: str):
+        """Almacena la respuesta del RAG para la consulta."""
+        normalized = _normalize(query)
+        self._remove(normalized)
+
+        if not self.approximate:
+            self._entries[normalized] = (answer, time.monotonic() + self.ttl_seconds, (), None)
+        else:
+            signature = self._signature(normalized)
+            self._entries[normalized] = (
+                answer,
+                time.monotonic() + self.ttl_seconds,
+                _identifiers(normalized),
+                signature
+            )
+            for band_key in self._band_keys(signature):
+                self._buckets.setdefault(band_key, set()).add(normalized)
+
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def clear(self):
+        """Vacía la caché."""
+        self._entries.clear()
+        self._buckets.clear()
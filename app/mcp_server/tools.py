@@ -11,6 +11,11 @@ RESPONSABILIDADES:
 - Convertir herramientas MCP a formato LangChain
 - Crear diccionario de herramientas indexadas por nombre
 
+Las herramientas cargadas son proxies que envían cada llamada por la sesión MCP;
+no abren conexiones HTTP en este proceso. Las peticiones a los servicios REST las
+hace cada servidor MCP con su propio cliente httpx compartido (pool de conexiones
+keep-alive creado una vez y cerrado en el lifespan del servidor).
+
 NOTA: Este archivo NO requiere modificación por parte de los estudiantes.
 """
 
@@ -19,7 +24,6 @@ from mcp import ClientSession
 import logging
 
 
-logging.basicConfig(level = logging.INFO, format = "%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
 
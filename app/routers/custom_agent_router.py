@@ -8,7 +8,7 @@ por el agente ReAct utilizando las herramientas especializadas disponibles.
 
 ENDPOINT:
 - POST /ask_custom
-  - Request: {"question": "texto de la pregunta o tarea"}
+  - Request: {"question": "texto de la pregunta o tarea", "session_id": "opcional"}
   - Response: {"answer": "texto de la respuesta"}
 
 NOTA: Este archivo NO requiere modificación por parte de los estudiantes.
@@ -17,15 +17,20 @@ NOTA: Este archivo NO requiere modificación por parte de los estudiantes.
 from schemas.custom_agent_schema import QuestionRequest, AnswerResponse
 from services.custom_agent_service import CUSTOM_AGENT_SERVICE
 from fastapi import APIRouter
+from fastapi.responses import ORJSONResponse
 
 
 router = APIRouter(prefix = "")
 
 
-@router.post("/ask_custom", response_model = AnswerResponse)
+# AnswerResponse solo documenta el esquema en OpenAPI; la respuesta se serializa con orjson
+@router.post("/ask_custom", response_class = ORJSONResponse, responses = {200: {"model": AnswerResponse}})
 async def ask_question(request: QuestionRequest):
     try:
-        answer = await CUSTOM_AGENT_SERVICE.ask_custom(request.question)
+        answer = await CUSTOM_AGENT_SERVICE.ask_custom(request.question, session_id=request.session_id)
     except Exception as e:
         raise e
-    return {"answer": answer}
\ No newline at end of file
+    return ORJSONResponse(
+        content={"answer": answer},
+        media_type="application/json; charset=utf-8"
+    )
\ No newline at end of file
@@ -8,14 +8,14 @@ por el agente ReAct utilizando las herramientas de Liquidaciones y Proveedores.
 
 ENDPOINT:
 - POST /ask_greentravel
-  - Request: {"question": "texto de la pregunta o tarea"}
+  - Request: {"question": "texto de la pregunta o tarea", "session_id": "opcional"}
   - Response: {"answer": "texto de la respuesta"}
 """
 
 from schemas.greentravel_agent_schema import QuestionRequest, AnswerResponse
 from services.custom_agent_service import CUSTOM_AGENT_SERVICE
 from fastapi import APIRouter, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
 import logging
 
 logger = logging.getLogger(__name__)
@@ -24,7 +24,9 @@ logger = logging.getLogger(__name__)
 router = APIRouter(prefix="")
 
 
-@router.post("/ask_greentravel", response_model=AnswerResponse)
+# La respuesta se construye directamente con orjson; AnswerResponse solo documenta el esquema
+# en OpenAPI (con response_model FastAPI validaría y serializaría el dict con Pydantic)
+@router.post("/ask_greentravel", response_class=ORJSONResponse, responses={200: {"model": AnswerResponse}})
 async def ask_question(request: QuestionRequest):
     """
     Endpoint unificado para consultas de GreenTravelBackend.
@@ -34,16 +36,16 @@ async def ask_question(request: QuestionRequest):
     - Facturas (obtener desde RAG + calcular vencimiento)
     """
     try:
-        logger.info(f"[ASK_GREENTRAVEL] Recibida pregunta: {request.question[:100]}...")
-        answer = await CUSTOM_AGENT_SERVICE.ask_custom(request.question)
-        logger.info(f"[ASK_GREENTRAVEL] Respuesta generada exitosamente ({len(answer)} caracteres)")
+        logger.info("[ASK_GREENTRAVEL] Recibida pregunta: %s...", request.question[:100])
+        answer = await CUSTOM_AGENT_SERVICE.ask_custom(request.question, session_id=request.session_id)
+        logger.info("[ASK_GREENTRAVEL] Respuesta generada exitosamente (%s caracteres)", len(answer))
         # Asegurar que la respuesta se devuelva con encoding UTF-8 correcto
-        return JSONResponse(
+        return ORJSONResponse(
             content={"answer": answer},
             media_type="application/json; charset=utf-8"
         )
     except Exception as e:
-        logger.error(f"[ASK_GREENTRAVEL] Error procesando pregunta: {str(e)}", exc_info=True)
+        logger.error("[ASK_GREENTRAVEL] Error procesando pregunta: %s", e, exc_info=True)
         raise HTTPException(
             status_code=500,
             detail=f"Error procesando la consulta: {str(e)}"
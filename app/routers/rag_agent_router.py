@@ -6,10 +6,14 @@ Este módulo define el endpoint HTTP para interactuar con el Agente RAG.
 Recibe peticiones POST con preguntas del usuario y retorna respuestas
 generadas por el agente basadas en contexto del sistema RAG.
 
-ENDPOINT:
+ENDPOINTS:
 - POST /ask_rag
   - Request: {"question": "texto de la pregunta"}
   - Response: {"answer": "texto de la respuesta"}
+- POST /ask_rag/stream
+  - Request: {"question": "texto de la pregunta"}
+  - Response: Server-Sent Events con eventos {"delta": "fragmento"} y un evento final {"done": true}
+    (si el agente falla a mitad de la respuesta, antes del final se emite {"error": "mensaje"})
 
 NOTA: Este archivo NO requiere modificación por parte de los estudiantes.
 """
@@ -17,20 +21,47 @@ NOTA: Este archivo NO requiere modificación por parte de los estudiantes.
 from schemas.rag_agent_schema import QuestionRequest, AnswerResponse
 from services.rag_agent_service import RAG_AGENT_SERVICE
 from fastapi import APIRouter
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse, StreamingResponse
+import logging
+import orjson
+
+logger = logging.getLogger(__name__)
 
 
 router = APIRouter(prefix = "")
 
+# Evento final del stream (constante: se serializa una sola vez)
+_DONE_EVENT = f"data: {orjson.dumps({'done': True}).decode()}\n\n"
+
 
-@router.post("/ask_rag", response_model = AnswerResponse)
+# AnswerResponse solo documenta el esquema en OpenAPI; la respuesta se serializa con orjson
+@router.post("/ask_rag", response_class = ORJSONResponse, responses = {200: {"model": AnswerResponse}})
 async def ask_question(request: QuestionRequest):
     try:
         answer = await RAG_AGENT_SERVICE.ask_rag(request.question)
         # Asegurar que la respuesta se devuelva con encoding UTF-8 correcto
-        return JSONResponse(
+        return ORJSONResponse(
             content={"answer": answer},
             media_type="application/json; charset=utf-8"
         )
     except Exception as e:
-        raise e
\ No newline at end of file
+        raise e
+
+
+@router.post("/ask_rag/stream")
+async def ask_question_stream(request: QuestionRequest):
+    async def event_stream():
+        # Los encabezados ya se enviaron: un error no puede convertirse en un 500, así
+        # que se informa como evento y el stream termina normalmente con `done`
+        try:
+            async for delta in RAG_AGENT_SERVICE.stream_rag(request.question):
+                yield f"data: {orjson.dumps({'delta': delta}).decode()}\n\n"
+        except Exception as e:
+            logger.error("[ASK_RAG_STREAM] Error generando la respuesta: %s", e, exc_info=True)
+            yield f"data: {orjson.dumps({'error': str(e)}).decode()}\n\n"
+        yield _DONE_EVENT
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream; charset=utf-8"
+    )
@@ -8,6 +8,8 @@ y salida del endpoint del Agente Personalizado.
 MODELOS:
 - QuestionRequest: Valida la petición del usuario
   - question (str): La pregunta o tarea del usuario
+  - session_id (str, opcional): Identificador de la sesión del cliente; las
+    preguntas de una misma sesión comparten el historial de conversación
   
 - AnswerResponse: Formato de la respuesta del agente
   - answer (str): La respuesta generada por el agente
@@ -15,10 +17,12 @@ MODELOS:
 NOTA: Este archivo NO requiere modificación por parte de los estudiantes.
 """
 
+from typing import Optional
 from pydantic import BaseModel
 
 class QuestionRequest(BaseModel):
     question: str
+    session_id: Optional[str] = None
 
 class AnswerResponse(BaseModel):
     answer: str
\ No newline at end of file
@@ -8,15 +8,19 @@ y salida del endpoint del Agente GreenTravelBackend.
 MODELOS:
 - QuestionRequest: Valida la petición del usuario
   - question (str): La pregunta o tarea del usuario
+  - session_id (str, opcional): Identificador de la sesión del cliente; las
+    preguntas de una misma sesión comparten el historial de conversación
   
 - AnswerResponse: Formato de la respuesta del agente
   - answer (str): La respuesta generada por el agente
 """
 
+from typing import Optional
 from pydantic import BaseModel, ConfigDict
 
 class QuestionRequest(BaseModel):
     question: str
+    session_id: Optional[str] = None
     # Configurar para ignorar campos adicionales que el frontend pueda enviar
     # (top_k, collection, use_reranking, etc.) - estos no se usan en greentravel
     model_config = ConfigDict(extra='ignore')
@@ -58,6 +58,12 @@ except ImportError as e:
     print("="*60)
     sys.exit(1)
 
+# orjson (C) para el formateo en modo debug; json estándar si no está instalado
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 from mcp_server.config import get_greentravel_server_parameters
 from mcp_server.tools import load_tools
 import logging
@@ -77,6 +83,14 @@ else:
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
+# Tiempo máximo (segundos) de cada intento de health check
+HEALTH_CHECK_TIMEOUT = float(os.getenv("GATEWAY_HEALTH_CHECK_TIMEOUT", "2.0"))
+
+# Configuración del gateway leída una sola vez (el .env ya se cargó arriba)
+GREENTRAVEL_GATEWAY_URL = os.getenv("GREENTRAVEL_GATEWAY_URL")
+IS_NGINX_GATEWAY = GREENTRAVEL_GATEWAY_URL is not None and GREENTRAVEL_GATEWAY_URL.strip() != ""
+_GATEWAY_URL = (GREENTRAVEL_GATEWAY_URL if GREENTRAVEL_GATEWAY_URL is not None else "http://localhost").rstrip('/')
+
 
 def _get_liquidaciones_service_url():
     """
@@ -89,11 +103,8 @@ def _get_liquidaciones_service_url():
     - GREENTRAVEL_GATEWAY_URL: URL base del gateway NGINX (ej: http://34.134.74.83)
     - Si no está configurada, usa http://localhost como valor por defecto para desarrollo
     """
-    # Obtener URL base del gateway NGINX
-    base_url = os.getenv("GREENTRAVEL_GATEWAY_URL", "http://localhost")
-    
-    # Limpiar la URL (remover trailing slash)
-    return base_url.rstrip('/')
+    # URL base del gateway NGINX, ya sin slash final
+    return _GATEWAY_URL
 
 
 def _get_provedores_service_url():
@@ -107,21 +118,34 @@ def _get_provedores_service_url():
     - GREENTRAVEL_GATEWAY_URL: URL base del gateway NGINX (ej: http://34.134.74.83)
     - Si no está configurada, usa http://localhost como valor por defecto para desarrollo
     """
-    # Obtener URL base del gateway NGINX (misma que liquidaciones)
-    base_url = os.getenv("GREENTRAVEL_GATEWAY_URL", "http://localhost")
+    # URL base del gateway NGINX (misma que liquidaciones)
+    return _GATEWAY_URL
+
+
+async def test_service_connection(service_name: str, service_url_getter, port: int, env_var: str, client: httpx.AsyncClient):
+    """
+    Verifica que un servicio esté accesible.
     
-    # Limpiar la URL (remover trailing slash)
-    return base_url.rstrip('/')
+    `client` se comparte entre todas las verificaciones para reutilizar las conexiones.
+    Las verificaciones corren en paralelo, así que el reporte de cada servicio se
+    acumula y se imprime completo al terminar, sin intercalarse con el del otro.
+    """
+    report = []
+    try:
+        return await _check_service(service_name, service_url_getter, port, env_var, client, report.append)
+    finally:
+        # Una sola escritura (y un solo flush) por verificación
+        report.append("")
+        sys.stdout.write("\n".join(report))
+        sys.stdout.flush()
 
 
-async def test_service_connection(service_name: str, service_url_getter, port: int, env_var: str):
-    """Verifica que un servicio esté accesible."""
+async def _check_service(service_name, service_url_getter, port, env_var, client, emit):
+    """Prueba las URLs de health check del servicio, escribiendo el reporte con `emit`."""
     service_url = service_url_getter()
     
-    # Detectar si se está usando NGINX gateway
-    # Verificar si GREENTRAVEL_GATEWAY_URL está configurada (no None y no vacía)
-    gateway_url = os.getenv("GREENTRAVEL_GATEWAY_URL")
-    is_nginx_gateway = gateway_url is not None and gateway_url.strip() != ""
+    # Detectar si se está usando NGINX gateway (GREENTRAVEL_GATEWAY_URL configurada y no vacía)
+    is_nginx_gateway = IS_NGINX_GATEWAY
     
     if is_nginx_gateway:
         # Cuando se usa NGINX, el health check es a través del gateway
@@ -131,15 +155,15 @@ async def test_service_connection(service_name: str, service_url_getter, port: i
         # Sin NGINX, usar el health check directo del servicio
         health_url = f"{service_url.rstrip('/')}/health"
     
-    print(f"\n{'='*60}")
-    print(f"Verificando conexión al Servicio de {service_name}...")
-    print(f"{'='*60}")
-    print(f"Service URL: {service_url}")
-    print(f"Health Check: {health_url}")
+    emit(f"\n{'='*60}")
+    emit(f"Verificando conexión al Servicio de {service_name}...")
+    emit(f"{'='*60}")
+    emit(f"Service URL: {service_url}")
+    emit(f"Health Check: {health_url}")
     if is_nginx_gateway:
-        print(f"Modo: NGINX Gateway (GREENTRAVEL_GATEWAY_URL configurado)")
+        emit(f"Modo: NGINX Gateway (GREENTRAVEL_GATEWAY_URL configurado)")
     else:
-        print(f"Modo: Conexión directa (puerto {port})")
+        emit(f"Modo: Conexión directa (puerto {port})")
     
     # También intentar con localhost si estamos en Docker y falla con host.docker.internal
     urls_to_try = [health_url]
@@ -151,36 +175,41 @@ async def test_service_connection(service_name: str, service_url_getter, port: i
     
     for url in urls_to_try:
         try:
-            async with httpx.AsyncClient(timeout=5.0) as client:
-                response = await client.get(url)
-                if response.status_code == 200:
-                    print(f"✓ Servicio accesible en: {url}")
-                    # Actualizar la URL del servicio si encontramos una que funciona
-                    if url != health_url:
-                        os.environ[env_var] = url.replace("/health", "")
-                    return True
+            # Límite por intento: con varias URLs de respaldo inaccesibles, el tiempo
+            # total queda acotado a HEALTH_CHECK_TIMEOUT por URL
+            response = await asyncio.wait_for(client.get(url), timeout=HEALTH_CHECK_TIMEOUT)
+            if response.status_code == 200:
+                emit(f"✓ Servicio accesible en: {url}")
+                # Actualizar la URL del servicio si encontramos una que funciona
+                if url != health_url:
+                    os.environ[env_var] = url.replace("/health", "")
+                return True
         except Exception as e:
+            if isinstance(e, asyncio.TimeoutError):
+                e = f"sin respuesta en {HEALTH_CHECK_TIMEOUT}s"
+                if url != urls_to_try[-1]:
+                    emit(f"  {url}: {e}, probando la siguiente URL...")
             if url == urls_to_try[-1]:  # Último intento
-                print(f"✗ Error conectando al servicio: {e}")
-                print(f"  Intentado: {', '.join(urls_to_try)}")
-                print(f"\nSugerencias:")
+                emit(f"✗ Error conectando al servicio: {e}")
+                emit(f"  Intentado: {', '.join(urls_to_try)}")
+                emit(f"\nSugerencias:")
                 if is_nginx_gateway:
-                    print(f"  1. Verifica que NGINX Gateway esté corriendo y accesible:")
-                    print(f"     curl {health_url}")
-                    print(f"  2. Si estás en GCP, verifica que GREENTRAVEL_GATEWAY_URL sea correcta:")
-                    print(f"     GREENTRAVEL_GATEWAY_URL=http://34.134.74.83")
-                    print(f"  3. Si estás en desarrollo local con NGINX:")
-                    print(f"     GREENTRAVEL_GATEWAY_URL=http://localhost")
+                    emit(f"  1. Verifica que NGINX Gateway esté corriendo y accesible:")
+                    emit(f"     curl {health_url}")
+                    emit(f"  2. Si estás en GCP, verifica que GREENTRAVEL_GATEWAY_URL sea correcta:")
+                    emit(f"     GREENTRAVEL_GATEWAY_URL=http://34.134.74.83")
+                    emit(f"  3. Si estás en desarrollo local con NGINX:")
+                    emit(f"     GREENTRAVEL_GATEWAY_URL=http://localhost")
                 else:
-                    print(f"  1. Asegúrate de que el servicio de {service_name.lower()} esté corriendo:")
-                    print(f"     cd GreenTravelBackend")
-                    print(f"     docker-compose up -d {service_name.lower()}-service")
-                    print(f"  2. Verifica que el servicio responda:")
-                    print(f"     curl http://localhost:{port}/health")
-                    print(f"  3. Si estás en Docker, configura {env_var}:")
-                    print(f"     - Para host: http://host.docker.internal:{port}")
-                    print(f"  4. O configura GREENTRAVEL_GATEWAY_URL para usar NGINX:")
-                    print(f"     GREENTRAVEL_GATEWAY_URL=http://localhost (o IP del servidor)")
+                    emit(f"  1. Asegúrate de que el servicio de {service_name.lower()} esté corriendo:")
+                    emit(f"     cd GreenTravelBackend")
+                    emit(f"     docker-compose up -d {service_name.lower()}-service")
+                    emit(f"  2. Verifica que el servicio responda:")
+                    emit(f"     curl http://localhost:{port}/health")
+                    emit(f"  3. Si estás en Docker, configura {env_var}:")
+                    emit(f"     - Para host: http://host.docker.internal:{port}")
+                    emit(f"  4. O configura GREENTRAVEL_GATEWAY_URL para usar NGINX:")
+                    emit(f"     GREENTRAVEL_GATEWAY_URL=http://localhost (o IP del servidor)")
                 return False
             continue
     
@@ -206,10 +235,9 @@ async def test_mcp_server():
         tools, tools_by_name = await load_tools(session)
         print(f"✓ {len(tools)} herramientas cargadas")
         
-        # Listar herramientas disponibles
+        # Listar herramientas disponibles (ordenadas, en una sola escritura)
         print("\nHerramientas disponibles:")
-        for tool_name in sorted(tools_by_name.keys()):
-            print(f"  - {tool_name}")
+        print("\n".join(f"  - {tool_name}" for tool_name in sorted(tools_by_name)))
         
         return session, tools_by_name, stdio_ctx
         
@@ -236,11 +264,18 @@ async def test_tool(session, tool_name, *args, **kwargs):
         if result.content:
             content = result.content[0] if result.content else None
             if content and hasattr(content, 'text'):
-                try:
-                    result_json = json.loads(content.text)
-                    print(f"✓ {tool_name}: {json.dumps(result_json, ensure_ascii=False, indent=2)[:200]}...")
-                except:
-                    print(f"✓ {tool_name}: {content.text[:200]}...")
+                # Solo se muestran 200 caracteres: el texto se recorta sin decodificarlo;
+                # la versión formateada (parse + serialización) queda para modo debug
+                preview = content.text[:200]
+                if logger.isEnabledFor(logging.DEBUG):
+                    try:
+                        if orjson is not None:
+                            preview = orjson.dumps(orjson.loads(content.text), option=orjson.OPT_INDENT_2).decode()[:200]
+                        else:
+                            preview = json.dumps(json.loads(content.text), ensure_ascii=False, indent=2)[:200]
+                    except ValueError:
+                        pass
+                print(f"✓ {tool_name}: {preview}...")
             else:
                 print(f"✓ {tool_name}: {str(result)[:200]}...")
         else:
@@ -260,7 +295,7 @@ async def run_tests():
     print("="*60)
     
     # Verificar variables de entorno
-    greentravel_gateway = os.getenv("GREENTRAVEL_GATEWAY_URL")
+    greentravel_gateway = GREENTRAVEL_GATEWAY_URL
     liquidaciones_url = _get_liquidaciones_service_url()
     provedores_url = _get_provedores_service_url()
     
@@ -276,13 +311,18 @@ async def run_tests():
         print(f"\n  NOTA: Para usar el gateway NGINX en GCP, configura en .env:")
         print(f"        GREENTRAVEL_GATEWAY_URL=http://34.134.74.83")
     
-    # 1. Verificar conexión a los servicios
-    liquidaciones_ok = await test_service_connection(
-        "Liquidaciones", _get_liquidaciones_service_url, 8001, "LIQUIDACIONES_SERVICE_URL"
-    )
-    provedores_ok = await test_service_connection(
-        "Proveedores", _get_provedores_service_url, 8002, "PROVEDORES_SERVICE_URL"
-    )
+    # 1. Verificar conexión a los servicios (un solo cliente: ambos servicios
+    # comparten el gateway, así que la segunda verificación reutiliza la conexión)
+    # Ambas verificaciones son independientes: se ejecutan en paralelo
+    async with httpx.AsyncClient(timeout=5.0, limits=httpx.Limits(max_keepalive_connections=4)) as client:
+        liquidaciones_ok, provedores_ok = await asyncio.gather(
+            test_service_connection(
+                "Liquidaciones", _get_liquidaciones_service_url, 8001, "LIQUIDACIONES_SERVICE_URL", client
+            ),
+            test_service_connection(
+                "Proveedores", _get_provedores_service_url, 8002, "PROVEDORES_SERVICE_URL", client
+            )
+        )
     
     if not liquidaciones_ok and not provedores_ok:
         print("\n✗ No se puede continuar sin conexión a ningún servicio")
@@ -299,25 +339,20 @@ async def run_tests():
     print("3. Probando herramientas básicas...")
     print(f"{'='*60}")
     
-    tests_passed = 0
-    tests_failed = 0
+    # Las pruebas no dependen entre sí: se programan todas y se ejecutan en
+    # paralelo sobre la misma sesión MCP (cada resultado se imprime con su herramienta)
+    coros = []
     
     # Pruebas de Liquidaciones
     if liquidaciones_ok:
         print("\n--- PRUEBAS DE LIQUIDACIONES ---")
         # Test: Estadísticas de liquidaciones
-        print("\n[Test 1] Estadísticas de liquidaciones...")
-        if await test_tool(session, "get_liquidacion_stats"):
-            tests_passed += 1
-        else:
-            tests_failed += 1
+        print("[Test 1] Estadísticas de liquidaciones...")
+        coros.append(test_tool(session, "get_liquidacion_stats"))
         
         # Test: Listar liquidaciones (primera página)
-        print("\n[Test 2] Listar liquidaciones (página 1)...")
-        if await test_tool(session, "list_liquidaciones", page=1, limit=5):
-            tests_passed += 1
-        else:
-            tests_failed += 1
+        print("[Test 2] Listar liquidaciones (página 1)...")
+        coros.append(test_tool(session, "list_liquidaciones", page=1, limit=5))
     else:
         print("\n--- PRUEBAS DE LIQUIDACIONES (SALTADAS - servicio no disponible) ---")
     
@@ -325,21 +360,20 @@ async def run_tests():
     if provedores_ok:
         print("\n--- PRUEBAS DE PROVEEDORES ---")
         # Test: Estadísticas de proveedores
-        print("\n[Test 3] Estadísticas de proveedores...")
-        if await test_tool(session, "get_provedor_stats"):
-            tests_passed += 1
-        else:
-            tests_failed += 1
+        print("[Test 3] Estadísticas de proveedores...")
+        coros.append(test_tool(session, "get_provedor_stats"))
         
         # Test: Listar proveedores (primera página)
-        print("\n[Test 4] Listar proveedores (página 1)...")
-        if await test_tool(session, "list_provedores", page=1, limit=5):
-            tests_passed += 1
-        else:
-            tests_failed += 1
+        print("[Test 4] Listar proveedores (página 1)...")
+        coros.append(test_tool(session, "list_provedores", page=1, limit=5))
     else:
         print("\n--- PRUEBAS DE PROVEEDORES (SALTADAS - servicio no disponible) ---")
     
+    print("\nResultados:")
+    results = await asyncio.gather(*coros, return_exceptions=True)
+    tests_passed = sum(result is True for result in results)
+    tests_failed = len(results) - tests_passed
+    
     # Cerrar sesión
     if stdio_ctx:
         await session.__aexit__(None, None, None)
@@ -362,6 +396,12 @@ async def run_tests():
 
 
 if __name__ == "__main__":
+    # uvloop (si está instalado) reemplaza el bucle de eventos por defecto; no existe en Windows
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass
     try:
         asyncio.run(run_tests())
     except KeyboardInterrupt:
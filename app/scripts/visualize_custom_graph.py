@@ -16,17 +16,16 @@ OPCIONES DE USO:
 """
 
 import sys
+from importlib.util import find_spec
 from pathlib import Path
 
 # Agregar el directorio app al path
 app_dir = Path(__file__).parent.parent
 sys.path.insert(0, str(app_dir))
 
-# Verificar que las dependencias estén instaladas
-try:
-    import langgraph
-    import langchain_core
-except ImportError as e:
+# Verificar que las dependencias estén instaladas (find_spec no ejecuta los módulos;
+# langgraph/langchain se importan recién al construir el grafo)
+if find_spec("langgraph") is None or find_spec("langchain_core") is None:
     print("\n" + "="*60)
     print("ERROR: Dependencias no instaladas")
     print("="*60)
@@ -39,7 +38,6 @@ except ImportError as e:
     print("="*60)
     sys.exit(1)
 
-from flows.custom_agent import visualize_graph
 import logging
 import os
 
@@ -59,6 +57,8 @@ if __name__ == "__main__":
     logger.info("Generando visualización del grafo Custom Agent...")
     
     try:
+        from flows.custom_agent import visualize_graph
+        
         output_path = visualize_graph()
         
         if output_path:
@@ -23,14 +23,53 @@ import asyncio
 import logging
 import re
 import hashlib
+import uuid
+from collections import OrderedDict
 from typing import Optional
 from langgraph.checkpoint.memory import MemorySaver
 
 
 
-logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
+# Patrones comunes para números de factura, en orden de prioridad (compilados una
+# vez al cargar el módulo). Ejemplos: HBE122090, E018-175709, FACT-12345, etc.
+_INVOICE_PATTERNS = (
+    re.compile(r'\b([A-Z]{2,4}\d{6,})\b', re.IGNORECASE),  # HBE122090
+    re.compile(r'\b([A-Z]+\d*-\d+)\b', re.IGNORECASE),  # FACT-12345, INV-789, E018-175709
+    # factura 12345, factura número 4567: se saltan las palabras de relleno y el
+    # identificador debe contener un dígito
+    re.compile(
+        r'\bfactura\s+(?:(?:de|del|la|el|n[°ºo]\.?|nro\.?|n[uú]mero)\s+)*([A-Z0-9-]*\d[A-Z0-9-]*)',
+        re.IGNORECASE,
+    ),
+)
+
+# CUFE (32 caracteres alfanuméricos), solo como último recurso
+_CUFE_RE = re.compile(r'\b([A-Z0-9]{32})\b', re.IGNORECASE)
+
+# Herramientas de GreenTravelBackend que se vinculan al LLM (frozenset: búsqueda O(1))
+_GREENTRAVEL_TOOLS = frozenset({
+    # Liquidaciones
+    "list_liquidaciones", "get_liquidacion", "create_liquidacion",
+    "update_liquidacion", "delete_liquidacion", "get_liquidacion_stats",
+    # Proveedores
+    "list_provedores", "get_provedor", "create_provedor",
+    "update_provedor", "delete_provedor", "get_provedor_stats",
+    # Facturas
+    "rag_get_invoice_data", "rag_get_invoices_batch",
+    "calcular_vencimiento", "calcular_vencimientos_batch"
+})
+
+# thread_id ya calculado por pregunta (reintentos y reanudaciones repiten la misma
+# pregunta): evita repetir el escaneo de patrones y el hash. LRU acotada.
+THREAD_ID_CACHE_MAX_ENTRIES = 256
+_THREAD_ID_CACHE = OrderedDict()
+
+# Hilos de sesión conservados en el checkpointer: MemorySaver no expira nada por sí
+# mismo, así que al superar el límite se borra el hilo usado hace más tiempo
+CHECKPOINT_MAX_THREADS = 256
+
 
 class CustomAgentService:
 
@@ -42,6 +81,7 @@ class CustomAgentService:
         self._session = None
         self.agent = None
         self.checkpointer = MemorySaver()  # Persistencia de estado para HITL
+        self._threads = OrderedDict()  # thread_id -> None, en orden de uso (LRU)
 
     
     def set_server_parameters(self, server_parameters):
@@ -68,24 +108,13 @@ class CustomAgentService:
 
                 # Cargar herramientas del MCP server
                 tools, tools_by_name = await load_tools(self._session)
-                logger.info(f"Loaded {len(tools)} tools from MCP server")
+                logger.info("Loaded %s tools from MCP server", len(tools))
                 
                 # Filtrar herramientas de GreenTravelBackend (liquidaciones, proveedores, facturas)
-                greentravel_tools = [
-                    # Liquidaciones
-                    "list_liquidaciones", "get_liquidacion", "create_liquidacion",
-                    "update_liquidacion", "delete_liquidacion", "get_liquidacion_stats",
-                    # Proveedores
-                    "list_provedores", "get_provedor", "create_provedor",
-                    "update_provedor", "delete_provedor", "get_provedor_stats",
-                    # Facturas
-                    "rag_get_invoice_data", "calcular_vencimiento"
-                ]
-                
-                filtered_tools = [t for t in tools if t.name in greentravel_tools]
-                filtered_tools_by_name = {name: tool for name, tool in tools_by_name.items() if name in greentravel_tools}
+                filtered_tools = [t for t in tools if t.name in _GREENTRAVEL_TOOLS]
+                filtered_tools_by_name = {name: tools_by_name[name] for name in tools_by_name.keys() & _GREENTRAVEL_TOOLS}
                 
-                logger.info(f"Using GreenTravelBackend tools: {list(filtered_tools_by_name.keys())}")
+                logger.info("Using GreenTravelBackend tools: %s", list(filtered_tools_by_name.keys()))
                 
                 # Verificar que tenemos al menos algunas herramientas
                 if not filtered_tools:
@@ -94,6 +123,11 @@ class CustomAgentService:
                     filtered_tools = tools
                     filtered_tools_by_name = tools_by_name
                 
+                # La variante por lotes no se vincula al LLM: el nodo de herramientas
+                # la usa internamente para agrupar varias consultas de factura
+                if "rag_get_invoice_data_batch" in tools_by_name:
+                    filtered_tools_by_name["rag_get_invoice_data_batch"] = tools_by_name["rag_get_invoice_data_batch"]
+                
                 # Obtener la herramienta rag_get_invoice_data específica
                 rag_get_invoice_tool = filtered_tools_by_name.get("rag_get_invoice_data")
 
@@ -102,12 +136,12 @@ class CustomAgentService:
                 self.agent = build_custom_agent(
                     llm.bind_tools(filtered_tools), 
                     filtered_tools_by_name, 
-                    rag_get_invoice_tool=rag_get_invoice_tool
+                    rag_get_invoice_tool=rag_get_invoice_tool,
+                    checkpointer=self.checkpointer
                 )
                 
-                # El agente ya está compilado por build_custom_agent
-                # Si necesitamos agregar checkpointer, necesitaríamos modificar build_custom_agent
-                # Por ahora, el agente funciona sin checkpointer adicional
+                # El agente se compila con el checkpointer: las consultas de una misma
+                # sesión sobre la misma factura retoman el historial guardado en memoria
                 
                 logger.info("Simplified Custom Agent created successfully")
     
@@ -122,26 +156,22 @@ class CustomAgentService:
         Extrae identificadores de factura de la pregunta (número de factura, CUFE, NIT).
         Retorna un identificador único basado en lo encontrado.
         """
-        # Patrones comunes para números de factura
-        # Ejemplos: HBE122090, E018-175709, FACT-12345, etc.
-        invoice_patterns = [
-            r'\b([A-Z]{2,4}\d{6,})\b',  # HBE122090, E018-175709
-            r'\b([A-Z]+-\d+)\b',  # FACT-12345, INV-789
-            r'\bfactura\s+([A-Z0-9-]+)',  # factura HBE122090
-            r'\b([A-Z]{2}\d{9})\b',  # CUFE (32 caracteres alfanuméricos, pero buscamos patrones comunes)
-        ]
+        # Todos los identificadores de factura contienen dígitos: una sola pasada en C
+        # descarta las preguntas sin dígitos antes de recorrer los patrones
+        if not any(map(str.isdigit, question)):
+            return None
         
-        for pattern in invoice_patterns:
-            match = re.search(pattern, question, re.IGNORECASE)
+        for pattern in _INVOICE_PATTERNS:
+            match = pattern.search(question)
             if match:
-                invoice_id = match.group(1) if match.lastindex else match.group(0)
-                logger.info(f"[CUSTOM SERVICE] Invoice identifier found: {invoice_id}")
+                invoice_id = match.group(1)
+                logger.debug("[CUSTOM SERVICE] Invoice identifier found: %s", invoice_id)
                 return invoice_id
         
         # Buscar CUFE (32 caracteres alfanuméricos)
-        cufe_match = re.search(r'\b([A-Z0-9]{32})\b', question, re.IGNORECASE)
+        cufe_match = _CUFE_RE.search(question)
         if cufe_match:
-            logger.info(f"[CUSTOM SERVICE] CUFE found: {cufe_match.group(1)}")
+            logger.debug("[CUSTOM SERVICE] CUFE found: %s", cufe_match.group(1))
             return cufe_match.group(1)
         
         return None
@@ -152,60 +182,104 @@ class CustomAgentService:
         o en un hash de la pregunta si no se encuentra factura específica.
         Esto evita mezclar información entre diferentes facturas.
         """
+        thread_id = _THREAD_ID_CACHE.get(question)
+        if thread_id is not None:
+            _THREAD_ID_CACHE.move_to_end(question)
+            logger.debug("[CUSTOM SERVICE] Using cached thread_id: %s", thread_id)
+            return thread_id
+        
+        thread_id = self._thread_id_for(question)
+        _THREAD_ID_CACHE[question] = thread_id
+        if len(_THREAD_ID_CACHE) > THREAD_ID_CACHE_MAX_ENTRIES:
+            _THREAD_ID_CACHE.popitem(last=False)
+        return thread_id
+
+    def _thread_id_for(self, question: str) -> str:
+        """Calcula el thread_id de la pregunta (sin caché)."""
         invoice_id = self._extract_invoice_identifier(question)
         
         if invoice_id:
             # Usar el identificador de factura como parte del thread_id
             # Esto agrupa consultas sobre la misma factura
             thread_id = f"invoice_{invoice_id.lower().replace('-', '_')}"
-            logger.info(f"[CUSTOM SERVICE] Using invoice-specific thread_id: {thread_id}")
+            logger.debug("[CUSTOM SERVICE] Using invoice-specific thread_id: %s", thread_id)
             return thread_id
         else:
             # Si no hay factura específica, usar un hash de la pregunta
             # Esto crea un thread único por consulta diferente
-            question_hash = hashlib.md5(question.encode()).hexdigest()[:8]
+            # blake2b con digest de 4 bytes produce directamente los 8 caracteres hex
+            question_hash = hashlib.blake2b(question.encode("utf-8"), digest_size=4).hexdigest()
             thread_id = f"query_{question_hash}"
-            logger.info(f"[CUSTOM SERVICE] Using query-specific thread_id: {thread_id}")
+            logger.debug("[CUSTOM SERVICE] Using query-specific thread_id: %s", thread_id)
             return thread_id
 
-    async def ask_custom(self, question):
+    def _touch_thread(self, thread_id: str) -> None:
+        """Marca el hilo como usado y borra del checkpointer el más antiguo si se supera el límite."""
+        if thread_id in self._threads:
+            self._threads.move_to_end(thread_id)
+            return
+        self._threads[thread_id] = None
+        if len(self._threads) > CHECKPOINT_MAX_THREADS:
+            evicted, _ = self._threads.popitem(last=False)
+            self.checkpointer.delete_thread(evicted)
+            logger.debug("[CUSTOM SERVICE] Evicted checkpoint thread: %s", evicted)
+
+    async def ask_custom(self, question, session_id: Optional[str] = None):
             """
             Procesa una pregunta usando el agente personalizado ReAct.
             
             Args:
                 question (str): La pregunta o tarea del usuario
+                session_id (str, opcional): Sesión del cliente. Sin ella la consulta se
+                    ejecuta en un hilo propio que se descarta al terminar
             
             Returns:
                 str: La respuesta generada por el agente
             """
-            # Asegurarse de que el agente está inicializado
-            if self._session is None or self.agent is None:
+            # Asegurarse de que el agente está inicializado. Tras la primera petición
+            # ambos atributos existen y no se entra a initialize() (ni a su lock);
+            # initialize() vuelve a comprobar bajo el lock en el arranque concurrente
+            if self.agent is None or self._session is None:
                 await self.initialize()
             
-            logger.info(f"[CUSTOM SERVICE] Processing question: {question}")
+            logger.debug("[CUSTOM SERVICE] Processing question: %s", question)
 
             # ======================================
-            # 1. Generar thread_id único basado en la factura o consulta
+            # 1. Generar thread_id único por sesión y factura o consulta
             # ======================================
-            thread_id = self._generate_thread_id(question)
+            # El thread_id se limita a la sesión del cliente: dos clientes que preguntan
+            # por la misma factura no comparten historial en el checkpointer
+            if session_id:
+                thread_id = f"{session_id}:{self._generate_thread_id(question)}"
+                self._touch_thread(thread_id)
+            else:
+                thread_id = f"oneshot_{uuid.uuid4().hex}"
 
             # ======================================
             # 2. Preparar estado inicial del agente (siempre limpio)
             # ======================================
             # IMPORTANTE: Siempre empezar con rag_invoice=None para evitar mezclar información
             # entre diferentes facturas. El agente obtendrá la información fresca del RAG.
+            # Solo los mensajes de la misma sesión y factura se conservan entre consultas.
+            # La pregunta ya llega como str desde el router: model_construct evita
+            # repetir la validación de Pydantic en cada petición
             state = {
-                "messages": [HumanMessage(content=question)],
+                "messages": [HumanMessage.model_construct(content=question)],
                 "rag_invoice": None  # Siempre limpiar al inicio de cada consulta
             }
             
-            logger.info(f"[CUSTOM SERVICE] Starting with clean state (rag_invoice=None)")
+            logger.debug("[CUSTOM SERVICE] Starting with clean state (rag_invoice=None)")
 
             # ======================================
             # 3. Ejecutar el agente con configuración de checkpoint
             # ======================================
             config = {"configurable": {"thread_id": thread_id}}
-            result = await self.agent.ainvoke(state, config=config)
+            try:
+                result = await self.agent.ainvoke(state, config=config)
+            finally:
+                if not session_id:
+                    # Sin sesión no hay a quién devolverle el historial
+                    self.checkpointer.delete_thread(thread_id)
 
             # ======================================
             # 3. Extraer el último mensaje como respuesta final
@@ -232,12 +306,18 @@ class CustomAgentService:
         NOTA: Este método ya está implementado y NO necesita modificación.
         """
         async with self._lock:
-            if self._session:
-                await self._session.__aexit__(None, None, None)
+            # Los contextos están anidados (la sesión vive sobre los streams de stdio_client)
+            # y sus cancel scopes de anyio deben cerrarse en orden inverso y en la misma
+            # tarea, así que no pueden cerrarse en paralelo con asyncio.gather. El finally
+            # garantiza que el subproceso se cierre aunque falle la salida de la sesión.
+            try:
+                if self._session:
+                    await self._session.__aexit__(None, None, None)
+            finally:
                 self._session = None
-            if self._stdio_ctx:
-                await self._stdio_ctx.__aexit__(None, None, None)
-                self._stdio_ctx = None
+                if self._stdio_ctx:
+                    await self._stdio_ctx.__aexit__(None, None, None)
+                    self._stdio_ctx = None
             logger.debug("MCP session and stdio_client shut down")
 
 
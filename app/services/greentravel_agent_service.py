@@ -5,6 +5,15 @@ Servicio del Agente GreenTravelBackend
 Este módulo gestiona el ciclo de vida del Agente GreenTravelBackend, incluyendo
 la inicialización de la sesión MCP, carga de herramientas y ejecución del agente
 para procesar consultas sobre Liquidaciones y Proveedores.
+
+CONCURRENCIA:
+- Una sola instancia (GREEN_TRAVEL_AGENT_SERVICE) atiende peticiones concurrentes:
+  tras la inicialización no hay lock en el camino de cada pregunta
+- El grafo compilado no guarda estado entre invocaciones; cada pregunta lleva el suyo
+- La sesión MCP multiplexa las llamadas a herramientas concurrentes por id de
+  petición, y el servidor MCP las atiende en paralelo
+- Por eso no se usa un pool de servicios: varias instancias solo sumarían
+  subprocesos MCP sin aumentar el paralelismo
 """
 
 from langchain_core.messages import HumanMessage, AIMessage
@@ -13,77 +22,334 @@ from mcp.client.stdio import stdio_client
 from mcp_server.tools import load_tools
 from mcp_server.model import llm
 from mcp import ClientSession
+from collections import OrderedDict
+from contextlib import nullcontext
+from typing import AsyncIterator, List, Optional
 import asyncio
 import logging
+import os
+import time
 
 
-logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+# La configuración de logging la hace el punto de entrada (configure_logging en main.py)
 logger = logging.getLogger(__name__)
 
+# Tiempo máximo (segundos) para lanzar el servidor MCP, completar el handshake y cargar
+# las herramientas: un subproceso colgado falla rápido en vez de bloquear las peticiones
+INIT_TIMEOUT_SECONDS = float(os.getenv("GREENTRAVEL_INIT_TIMEOUT", "30"))
+
+# Tiempo máximo (segundos) que shutdown() espera el cierre de la conexión MCP
+SHUTDOWN_TIMEOUT_SECONDS = 5.0
+
+# Si está activo, warmup() además ejecuta una invocación de prueba del agente (una llamada
+# real al LLM) para abrir la conexión con el proveedor antes de recibir tráfico
+WARMUP_INVOKE = os.getenv("GREENTRAVEL_WARMUP_INVOKE", "").lower() in ("1", "true", "yes")
+
+# Caché de respuestas de ask_greentravel por (pregunta, herramientas): TTL corto porque
+# las respuestas dependen de datos mutables (liquidaciones, proveedores)
+ANSWER_CACHE_TTL = 60
+ANSWER_CACHE_MAX_ENTRIES = 512
+
+# Prefijos de las herramientas que modifican datos: invalidan la caché de respuestas
+_MUTATING_TOOL_PREFIXES = ("create_", "update_", "delete_")
+
+# Herramientas de GreenTravelBackend que se vinculan al LLM (incluyendo facturas);
+# frozenset: búsqueda O(1)
+_GREENTRAVEL_TOOLS = frozenset({
+    # Liquidaciones
+    "list_liquidaciones", "get_liquidacion", "create_liquidacion",
+    "update_liquidacion", "delete_liquidacion", "get_liquidacion_stats",
+    # Proveedores
+    "list_provedores", "list_all_provedores", "get_provedor", "batch_get_provedores",
+    "create_provedor", "create_provedores_bulk", "update_provedor",
+    "delete_provedor", "delete_provedores_bulk", "get_provedor_stats",
+    # Facturas
+    "rag_get_invoice_data", "calcular_vencimiento"
+})
+
+
+class _MCPConnection:
+    """Sesión MCP sobre stdio compartida por los consumidores de un mismo servidor."""
+
+    def __init__(self):
+        self.session = None
+        self.refs = 0
+        self.owner_task = None
+        self.ping_task = None
+        self.ready = asyncio.get_running_loop().create_future()
+        self.closing = asyncio.Event()
+        self.on_lost = []
+
+
+class _MCPConnectionManager:
+    """
+    Mantiene una conexión stdio MCP persistente por servidor, compartida con conteo
+    de referencias: el subproceso y el handshake MCP solo se pagan al abrir la primera
+    referencia, y la conexión se cierra al liberar la última.
+    
+    Un ping periódico detecta conexiones caídas; en ese caso la conexión se descarta
+    y se avisa a los consumidores para que reconecten de forma perezosa.
+    
+    Los cancel scopes de anyio de stdio_client y ClientSession deben cerrarse en la
+    misma tarea que los abrió: cada conexión tiene una tarea dueña que entra a ambos
+    contextos, publica la sesión y espera la señal de cierre. Los demás solo activan
+    esa señal y esperan a la tarea dueña, nunca llaman a __aexit__.
+    """
+
+    PING_INTERVAL = 30.0
+
+    def __init__(self):
+        self._lock = asyncio.Lock()
+        self._connections = {}
+
+    @staticmethod
+    def _key(server_parameters):
+        return (server_parameters.command, tuple(server_parameters.args))
+
+    async def acquire(self, server_parameters, on_lost=None) -> ClientSession:
+        """
+        Retorna la sesión MCP del servidor, abriéndola si no existe.
+        
+        Args:
+            server_parameters: Parámetros del servidor MCP (stdio)
+            on_lost: Callback opcional que se invoca si la conexión se pierde
+        """
+        key = self._key(server_parameters)
+        async with self._lock:
+            conn = self._connections.get(key)
+            if conn is None:
+                conn = _MCPConnection()
+                logger.info("Starting stdio_client for %s...", key[0])
+                conn.owner_task = asyncio.create_task(self._own(server_parameters, conn))
+                try:
+                    await asyncio.shield(conn.ready)
+                except BaseException:
+                    await self._close(conn)
+                    raise
+                logger.info("MCP session initialized successfully")
+                conn.ping_task = asyncio.create_task(self._keepalive(key, conn))
+                self._connections[key] = conn
+            conn.refs += 1
+            if on_lost is not None:
+                conn.on_lost.append(on_lost)
+            return conn.session
+
+    async def release(self, server_parameters, on_lost=None, timeout: Optional[float] = None):
+        """
+        Libera una referencia; la conexión se cierra al liberar la última.
+        
+        Args:
+            timeout: Máximo de segundos que se espera a la tarea dueña; si se agota,
+                     el cierre continúa en segundo plano
+        """
+        key = self._key(server_parameters)
+        async with self._lock:
+            conn = self._connections.get(key)
+            if conn is None:
+                return
+            if on_lost in conn.on_lost:
+                conn.on_lost.remove(on_lost)
+            conn.refs -= 1
+            if conn.refs > 0:
+                return
+            del self._connections[key]
+        if await self._close(conn, timeout):
+            logger.debug("MCP session and stdio_client shut down")
+        else:
+            logger.warning("MCP shutdown did not finish in %ss; closing in background", timeout)
+
+    @staticmethod
+    async def _own(server_parameters, conn):
+        """Tarea dueña: abre la conexión, la publica en `conn.ready` y la cierra al recibir la señal."""
+        try:
+            async with stdio_client(server_parameters) as (read, write), ClientSession(read, write) as session:
+                await session.initialize()
+                conn.session = session
+                if not conn.ready.done():
+                    conn.ready.set_result(session)
+                await conn.closing.wait()
+        except asyncio.CancelledError:
+            if not conn.ready.done():
+                conn.ready.cancel()
+            raise
+        except Exception as e:
+            if not conn.ready.done():
+                conn.ready.set_exception(e)
+            else:
+                logger.warning("La conexión MCP terminó con error: %s", e)
+
+    async def _keepalive(self, key, conn):
+        """Envía un ping MCP periódico y descarta la conexión si deja de responder."""
+        while True:
+            await asyncio.sleep(self.PING_INTERVAL)
+            try:
+                await asyncio.wait_for(conn.session.send_ping(), timeout=self.PING_INTERVAL)
+            except Exception as e:
+                logger.warning("Conexión MCP perdida (%s): %s", key[0], e)
+                break
+        
+        async with self._lock:
+            if self._connections.get(key) is conn:
+                del self._connections[key]
+        for callback in conn.on_lost:
+            callback()
+        await self._close(conn)
+
+    @staticmethod
+    async def _close(conn, timeout: Optional[float] = None) -> bool:
+        """
+        Señala el cierre a la tarea dueña y espera a que salga de sus contextos.
+        
+        Returns:
+            bool: False si la tarea dueña no terminó dentro de `timeout`
+        """
+        if conn.ping_task is not None and conn.ping_task is not asyncio.current_task():
+            conn.ping_task.cancel()
+        conn.closing.set()
+        if conn.session is None:
+            # Aún en el handshake: la cancelación llega a la tarea dueña, que desenrolla
+            # sus propios contextos
+            conn.owner_task.cancel()
+        # shield: cancelar o agotar el tiempo de quien espera no interrumpe el cierre a
+        # medias; wait además no propaga la excepción de la tarea dueña
+        done, _ = await asyncio.shield(asyncio.wait((conn.owner_task,), timeout=timeout))
+        return bool(done)
+
+
+_MCP_CONNECTIONS = _MCPConnectionManager()
+
 
 class GreenTravelAgentService:
 
+    # Atributos fijos: sin __dict__ por instancia y acceso por descriptor de slot
+    __slots__ = (
+        "server_parameters", "_lock", "_ready", "_init_task", "_session", "agent",
+        "_bound_llm_cache", "_tools_key", "_answer_cache", "_answer_generation",
+    )
+
     def __init__(self):
         self.server_parameters = None
         self._lock = asyncio.Lock()
-        self._stdio_ctx = None
+        self._ready = asyncio.Event()
+        self._init_task = None
         self._session = None
         self.agent = None
+        # LLM con herramientas vinculadas por conjunto de nombres: reconectar al MCP
+        # con las mismas herramientas no vuelve a serializar sus esquemas
+        self._bound_llm_cache = {}
+        # Conjunto de herramientas del agente actual (parte de la llave de la caché de respuestas)
+        self._tools_key = ()
+        # (pregunta, herramientas) -> (expira_en, respuesta), en orden LRU
+        self._answer_cache = OrderedDict()
+        # Se incrementa cada vez que se vacía la caché: una ejecución de solo lectura que
+        # empezó antes de una escritura no guarda su respuesta si cambió mientras corría
+        self._answer_generation = 0
 
     def set_server_parameters(self, server_parameters):
+        # Rechazar parámetros mal formados aquí y no en la primera petición
+        if server_parameters is None or not getattr(server_parameters, "command", None):
+            raise ValueError("Invalid MCP server parameters: a command is required")
         self.server_parameters = server_parameters
 
     async def initialize(self):
         """
         Inicializa la sesión MCP y construye el agente GreenTravelBackend.
+        
+        La inicialización corre en una única tarea compartida: las llamadas
+        concurrentes esperan su resultado sin retener ningún lock durante la E/S
+        (subproceso MCP, handshake y carga de herramientas). Si falla, la
+        siguiente llamada la reintenta.
         """
-        async with self._lock:
-            if self._session is None:
-                if not self.server_parameters:
-                    raise ValueError("MCP server parameters not set. Call set_server_parameters() first")
-                
-                logger.info("Starting stdio_client for GreenTravelBackend...")
-                self._stdio_ctx = stdio_client(self.server_parameters)
-                read, write = await self._stdio_ctx.__aenter__()
-                self._session = await ClientSession(read, write).__aenter__()
-                await self._session.initialize()
-                logger.info("MCP session initialized successfully")
+        if self._ready.is_set():
+            return
+        if self._init_task is None:
+            self._init_task = asyncio.ensure_future(self._initialize())
+            self._init_task.add_done_callback(self._on_init_done)
+        # shield: cancelar a un solicitante no cancela la inicialización de los demás
+        await asyncio.shield(self._init_task)
 
-                # Cargar herramientas del MCP server
-                tools, tools_by_name = await load_tools(self._session)
-                logger.info(f"Loaded {len(tools)} tools from MCP server")
-                
-                # Filtrar solo las herramientas de GreenTravelBackend (incluyendo facturas)
-                greentravel_tools = [
-                    # Liquidaciones
-                    "list_liquidaciones", "get_liquidacion", "create_liquidacion",
-                    "update_liquidacion", "delete_liquidacion", "get_liquidacion_stats",
-                    # Proveedores
-                    "list_provedores", "get_provedor", "create_provedor",
-                    "update_provedor", "delete_provedor", "get_provedor_stats",
-                    # Facturas
-                    "rag_get_invoice_data", "calcular_vencimiento"
-                ]
-                
-                filtered_tools = [t for t in tools if t.name in greentravel_tools]
-                filtered_tools_by_name = {name: tool for name, tool in tools_by_name.items() if name in greentravel_tools}
-                
-                logger.info(f"Using GreenTravelBackend tools: {list(filtered_tools_by_name.keys())}")
-                
-                # Verificar que tenemos al menos algunas herramientas
-                if not filtered_tools:
-                    logger.warning("No GreenTravelBackend tools found. Available tools: " + ", ".join(tools_by_name.keys()))
-                    # Usar todas las herramientas como fallback
-                    filtered_tools = tools
-                    filtered_tools_by_name = tools_by_name
-
-                # Construir el agente con las herramientas filtradas
-                self.agent = build_greentravel_agent(
-                    llm.bind_tools(filtered_tools), 
-                    filtered_tools_by_name
-                )
-                
-                logger.info("GreenTravelBackend Agent created successfully")
+    def _on_init_done(self, task):
+        """Descarta la tarea de inicialización fallida para permitir un reintento."""
+        if task.cancelled() or task.exception() is not None:
+            self._init_task = None
+
+    async def _initialize(self):
+        """Crea la sesión MCP, carga las herramientas y construye el agente."""
+        if self._session is None:
+            if not self.server_parameters:
+                raise ValueError("MCP server parameters not set. Call set_server_parameters() first")
+            
+            try:
+                async with asyncio.timeout(INIT_TIMEOUT_SECONDS):
+                    # Conexión persistente compartida: si ya existe, no se relanza el subproceso
+                    session = await _MCP_CONNECTIONS.acquire(self.server_parameters, on_lost=self._on_connection_lost)
+
+                    # Cargar herramientas del MCP server (si falla, liberar la conexión
+                    # para no dejar una sesión a medio inicializar)
+                    try:
+                        tools, tools_by_name = await load_tools(session)
+                    except BaseException:
+                        await _MCP_CONNECTIONS.release(self.server_parameters, on_lost=self._on_connection_lost)
+                        raise
+            except TimeoutError:
+                logger.error("GreenTravelBackend MCP initialization timed out after %ss", INIT_TIMEOUT_SECONDS)
+                raise
+            logger.info("Loaded %d tools from MCP server", len(tools))
+            
+            # Filtrar solo las herramientas de GreenTravelBackend en una sola pasada
+            filtered_tools = []
+            filtered_tools_by_name = {}
+            for t in tools:
+                if t.name in _GREENTRAVEL_TOOLS:
+                    filtered_tools.append(t)
+                    filtered_tools_by_name[t.name] = t
+            
+            # Sin herramientas de GreenTravelBackend el servidor MCP está mal configurado:
+            # fallar al inicializar en vez de vincular al LLM herramientas ajenas
+            if not filtered_tools:
+                await _MCP_CONNECTIONS.release(self.server_parameters, on_lost=self._on_connection_lost)
+                raise RuntimeError(f"No GreenTravelBackend tools found. Available: {sorted(tools_by_name)}")
+            
+            self._session = session
+            logger.info("Using GreenTravelBackend tools: %s", list(filtered_tools_by_name.keys()))
+
+            # bind_tools solo usa los esquemas de las herramientas, así que el LLM vinculado
+            # se reutiliza entre reconexiones. El grafo sí se reconstruye: las herramientas
+            # cargadas ejecutan las llamadas sobre la sesión MCP actual
+            tools_key = self._tools_key = tuple(sorted(filtered_tools_by_name))
+            bound_llm = self._bound_llm_cache.get(tools_key)
+            if bound_llm is None:
+                bound_llm = self._bound_llm_cache[tools_key] = llm.bind_tools(filtered_tools)
+
+            # Construir el agente con las herramientas filtradas
+            self.agent = build_greentravel_agent(
+                bound_llm, 
+                filtered_tools_by_name
+            )
+            
+            logger.info("GreenTravelBackend Agent created successfully")
+        
+        self._ready.set()
+
+    async def warmup(self):
+        """
+        Prepara el servicio antes de recibir tráfico (se llama desde el lifespan).
+        
+        Inicializa la sesión MCP, las herramientas y el agente; con
+        GREENTRAVEL_WARMUP_INVOKE activo también ejecuta una pregunta trivial para
+        recorrer el grafo y abrir la conexión con el proveedor del LLM.
+        """
+        await self.initialize()
+        if WARMUP_INVOKE:
+            # Directo al agente: la pregunta de prueba no debe quedar en la caché de respuestas
+            await self.agent.ainvoke({"messages": [HumanMessage(content="ping")]})
+            logger.info("GreenTravelBackend Agent warmed up")
+
+    def _on_connection_lost(self):
+        """La conexión MCP cayó: la siguiente petición vuelve a inicializar el agente."""
+        self._session = None
+        self._init_task = None
+        self._ready.clear()
 
     async def ask_greentravel(self, question):
         """
@@ -95,11 +361,20 @@ class GreenTravelAgentService:
         Returns:
             str: La respuesta generada por el agente
         """
-        # Asegurarse de que el agente está inicializado
-        if self._session is None or self.agent is None:
+        # Asegurarse de que el agente está inicializado (tras el arranque es solo
+        # la lectura de un flag, sin lock ni cambio de corrutina)
+        if not self._ready.is_set():
             await self.initialize()
         
-        logger.info(f"[GREEN TRAVEL SERVICE] Processing question: {question}")
+        # Solo la longitud: el prompt completo puede ocupar kilobytes por petición
+        logger.debug("[GREEN TRAVEL SERVICE] Processing question len=%d", len(question))
+
+        # Las preguntas repetidas se responden desde la caché mientras sigan vigentes
+        cache_key = (question, self._tools_key)
+        answer = self._get_cached_answer(cache_key)
+        if answer is not None:
+            logger.debug("[GREEN TRAVEL SERVICE] Respuesta servida desde caché")
+            return answer
 
         # Crear un HumanMessage con la pregunta del usuario
         human_message = HumanMessage(content=question)
@@ -109,24 +384,153 @@ class GreenTravelAgentService:
             "messages": [human_message]
         }
         
+        generation = self._answer_generation
         result = await self.agent.ainvoke(state)
 
-        # Extraer el último mensaje (AIMessage) que contiene la respuesta final
-        messages = result.get("messages", [])
-        if not messages:
-            raise ValueError("El agente no retornó ningún mensaje")
+        answer = self._extract_answer(result)
 
-        # El último mensaje es la respuesta del LLM
-        last_message = messages[-1]
+        # Una respuesta que modificó datos no se cachea (repetir la pregunta debe volver a
+        # ejecutar la operación) y deja obsoletas las respuestas guardadas
+        if self._called_mutating_tool(result):
+            self._invalidate_answers()
+        else:
+            self._set_cached_answer(cache_key, answer, generation)
 
-        # Verificar que es un AIMessage
-        if not isinstance(last_message, AIMessage):
-            raise ValueError(f"El último mensaje no es un AIMessage: {type(last_message)}")
+        logger.info("[GREEN TRAVEL SERVICE] Respuesta generada exitosamente (%d caracteres)", len(answer))
 
-        # Extraer el contenido de la respuesta
-        answer = last_message.content
+        return answer
 
-        logger.info(f"[GREEN TRAVEL SERVICE] Respuesta generada exitosamente ({len(answer)} caracteres)")
+    async def ask_greentravel_stream(self, question: str) -> AsyncIterator[str]:
+        """
+        Procesa una pregunta entregando el texto de la respuesta a medida que el LLM
+        lo genera, en vez de esperar el AIMessage final (menor tiempo al primer token).
+        
+        Se emiten los fragmentos de texto de todas las llamadas al LLM del ciclo ReAct;
+        los turnos que solo piden herramientas no producen texto.
+        
+        Args:
+            question (str): La pregunta o tarea del usuario
+        
+        Yields:
+            str: Fragmentos de texto de la respuesta
+        """
+        if not self._ready.is_set():
+            await self.initialize()
+        
+        logger.debug("[GREEN TRAVEL SERVICE] Streaming question len=%d", len(question))
+
+        state = {"messages": [HumanMessage(content=question)]}
+        mutated = False
+        try:
+            async for event in self.agent.astream_events(state, version="v2"):
+                if event["event"] == "on_tool_start":
+                    if event["name"].startswith(_MUTATING_TOOL_PREFIXES):
+                        # Invalidar ya: las ejecuciones concurrentes que terminen durante
+                        # el resto del stream no deben guardar respuestas previas a la escritura
+                        mutated = True
+                        self._invalidate_answers()
+                    continue
+                if event["event"] != "on_chat_model_stream":
+                    continue
+                content = event["data"]["chunk"].content
+                # Algunos modelos (Gemini) entregan el contenido como lista de partes
+                for part in ((content,) if isinstance(content, str) else content):
+                    text = part if isinstance(part, str) else part.get("text", "")
+                    if text:
+                        yield text
+        finally:
+            # Igual que en ask_greentravel: si se modificaron datos las respuestas
+            # cacheadas quedan obsoletas (también si el cliente corta el stream)
+            if mutated:
+                self._invalidate_answers()
+
+    async def ask_greentravel_batch(self, questions: List[str], max_concurrency: Optional[int] = None) -> List[str]:
+        """
+        Procesa varias preguntas independientes en paralelo con el agente GreenTravelBackend.
+        
+        Cada pregunta se ejecuta en su propia invocación del agente (estado independiente),
+        así el tiempo total se acerca a la latencia de la pregunta más lenta en vez de a
+        la suma de todas.
+        
+        Args:
+            questions (List[str]): Las preguntas del usuario
+            max_concurrency (int, optional): Máximo de invocaciones simultáneas
+                (para respetar el límite de peticiones del proveedor del LLM)
+        
+        Returns:
+            List[str]: Las respuestas, en el mismo orden que las preguntas
+        """
+        # Inicializar una sola vez antes del gather
+        if not self._ready.is_set():
+            await self.initialize()
+        
+        logger.info("[GREEN TRAVEL SERVICE] Processing batch of %d questions", len(questions))
+
+        limit = asyncio.Semaphore(max_concurrency) if max_concurrency else nullcontext()
+
+        async def _ask(question):
+            async with limit:
+                result = await self.agent.ainvoke({"messages": [HumanMessage(content=question)]})
+            # Igual que en ask_greentravel: si se modificaron datos las respuestas
+            # cacheadas quedan obsoletas
+            if self._called_mutating_tool(result):
+                self._invalidate_answers()
+            return self._extract_answer(result)
+
+        return list(await asyncio.gather(*(_ask(question) for question in questions)))
+
+    def _get_cached_answer(self, key) -> Optional[str]:
+        """Retorna la respuesta cacheada de `key` si sigue vigente (y la marca como usada)."""
+        entry = self._answer_cache.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del self._answer_cache[key]
+            return None
+        self._answer_cache.move_to_end(key)
+        return entry[1]
+
+    def _set_cached_answer(self, key, answer: str, generation: int):
+        """
+        Guarda la respuesta de `key`, desalojando la menos usada si se supera el máximo.
+        
+        `generation` es el valor de _answer_generation leído antes de ejecutar el agente;
+        si una escritura vació la caché mientras tanto, la respuesta no se guarda.
+        """
+        if generation != self._answer_generation:
+            return
+        self._answer_cache[key] = (time.monotonic() + ANSWER_CACHE_TTL, answer)
+        self._answer_cache.move_to_end(key)
+        while len(self._answer_cache) > ANSWER_CACHE_MAX_ENTRIES:
+            self._answer_cache.popitem(last=False)
+
+    def _invalidate_answers(self):
+        """Vacía la caché de respuestas y descarta las que estén en curso."""
+        self._answer_generation += 1
+        self._answer_cache.clear()
+
+    @staticmethod
+    def _called_mutating_tool(result) -> bool:
+        """Indica si el agente llamó alguna herramienta create_/update_/delete_ en esta ejecución."""
+        return any(
+            call["name"].startswith(_MUTATING_TOOL_PREFIXES)
+            for message in result.get("messages", ())
+            if isinstance(message, AIMessage)
+            for call in message.tool_calls
+        )
+
+    @staticmethod
+    def _extract_answer(result) -> str:
+        """Extrae el contenido del último AIMessage del resultado del agente."""
+        messages = result.get("messages", ())
+        if not messages:
+            raise ValueError("El agente no retornó ningún mensaje")
+
+        # Buscar desde el final el último AIMessage: en rutas de error el historial
+        # puede terminar en un ToolMessage posterior a la respuesta del LLM
+        answer = next((m.content for m in reversed(messages) if isinstance(m, AIMessage)), None)
+        if answer is None:
+            raise ValueError(f"El agente no retornó ningún AIMessage (último mensaje: {type(messages[-1])})")
 
         return answer
 
@@ -135,13 +539,21 @@ class GreenTravelAgentService:
         Cierra la sesión MCP y limpia recursos.
         """
         async with self._lock:
-            if self._session:
-                await self._session.__aexit__(None, None, None)
-                self._session = None
-            if self._stdio_ctx:
-                await self._stdio_ctx.__aexit__(None, None, None)
-                self._stdio_ctx = None
-            logger.debug("MCP session and stdio_client shut down")
+            # Esperar una inicialización en curso antes de cerrar lo que haya creado
+            if self._init_task is not None and not self._init_task.done():
+                await asyncio.wait((self._init_task,))
+            self._ready.clear()
+            self._init_task = None
+            session, self._session = self._session, None
+            self.agent = None
+            if session is not None:
+                # El cierre lo hace la tarea dueña de la conexión; release() espera por
+                # ella protegida con shield y sin pasar de SHUTDOWN_TIMEOUT_SECONDS (si
+                # el subproceso ya murió y el cierre se bloquea, sigue en segundo plano)
+                await _MCP_CONNECTIONS.release(
+                    self.server_parameters, on_lost=self._on_connection_lost,
+                    timeout=SHUTDOWN_TIMEOUT_SECONDS
+                )
 
 
 GREEN_TRAVEL_AGENT_SERVICE = GreenTravelAgentService()
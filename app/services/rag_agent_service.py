@@ -23,7 +23,6 @@ import asyncio
 import logging
 
 
-logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
 
@@ -93,7 +92,7 @@ class RagAgentService:
         if self._session is None or self.agent is None:
             await self.initialize()
         
-        logger.info(f"[RAG SERVICE] Processing question: {question}")
+        logger.info("[RAG SERVICE] Processing question: %s", question)
         
         # ==========================================================
         # Ejecución del agente de consulta al RAG
@@ -123,11 +122,72 @@ class RagAgentService:
         # Extraer el contenido de la respuesta
         answer = last_message.content
         
-        logger.info(f"[RAG SERVICE] Respuesta generada exitosamente ({len(answer)} caracteres)")
+        logger.info("[RAG SERVICE] Respuesta generada exitosamente (%s caracteres)", len(answer))
         
         return answer
     
 
+    async def stream_rag(self, question, flush_interval=0.075):
+        """
+        Procesa una pregunta usando el agente RAG y emite la respuesta por partes.
+        
+        Los tokens del nodo LLM se agrupan durante `flush_interval` segundos antes
+        de emitirse, para no pagar el costo de envío por cada token.
+        
+        Args:
+            question (str): La pregunta del usuario
+            flush_interval (float): Segundos que se acumulan tokens antes de emitirlos
+        
+        Yields:
+            str: Fragmentos de la respuesta generada por el agente
+        """
+        # Asegurarse de que el agente está inicializado
+        if self._session is None or self.agent is None:
+            await self.initialize()
+        
+        logger.info("[RAG SERVICE] Streaming question: %s", question)
+        
+        loop = asyncio.get_running_loop()
+        buffer = []
+        last_flush = loop.time()
+        streamed = False
+        final_state = None
+        
+        events = self.agent.astream_events(
+            {"messages": [HumanMessage(content=question)]},
+            version="v2"
+        )
+        async for event in events:
+            if event["event"] == "on_chain_end" and not event.get("parent_ids"):
+                final_state = event["data"].get("output")
+                continue
+            if event["event"] != "on_chat_model_stream":
+                continue
+            if event.get("metadata", {}).get("langgraph_node") != "llm":
+                continue
+            
+            content = event["data"]["chunk"].content
+            if isinstance(content, str) and content:
+                buffer.append(content)
+                streamed = True
+            
+            now = loop.time()
+            if buffer and now - last_flush >= flush_interval:
+                yield "".join(buffer)
+                buffer.clear()
+                last_flush = now
+        
+        if buffer:
+            yield "".join(buffer)
+        
+        # Si la respuesta no pasó por el nodo llm (borrador especulativo aceptado),
+        # emitirla completa desde el estado final
+        if not streamed and isinstance(final_state, dict):
+            messages = final_state.get("messages") or []
+            if messages and isinstance(messages[-1], AIMessage) and messages[-1].content:
+                yield messages[-1].content
+    
+
     async def shutdown(self):
         """
         Cierra la sesión MCP y limpia recursos.